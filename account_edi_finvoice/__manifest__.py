@@ -33,6 +33,9 @@
     "data": [
         "data/finvoice_template.xml",
         "data/account_edi_data.xml",
+        "data/account_move_actions.xml",
+        "data/ir_cron_data.xml",
+        "views/account_edi_format_views.xml",
     ],
     "demo": [],
 }
@@ -1,2 +1,9 @@
+from . import account_edi_document
 from . import account_edi_format
+from . import account_journal
 from . import account_move
+from . import ir_attachment
+from . import ir_binary
+from . import res_company
+from . import res_partner
+from . import res_partner_bank
@@ -0,0 +1,268 @@
+import gzip
+import logging
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Number of cron jobs exporting Finvoice documents in parallel.
+# Each has its own ir_cron_finvoice_export_<shard> record
+FINVOICE_EXPORT_SHARDS = 4
+
+# Seconds a shard exports chunks before continuing in a new run,
+# to stay within the cron time limit
+FINVOICE_EXPORT_SHARD_TIME = 300
+
+
+class AccountEdiDocument(models.Model):
+    _inherit = "account.edi.document"
+
+    finvoice_timings = fields.Json(
+        string="Finvoice timings",
+        help="Time and SQL queries spent in each phase of the Finvoice export",
+        readonly=True,
+        copy=False,
+    )
+    finvoice_fingerprint = fields.Char(
+        string="Finvoice fingerprint",
+        help="Hash of the invoice data the exported Finvoice was generated from",
+        readonly=True,
+        copy=False,
+    )
+    finvoice_validation_state = fields.Selection(
+        [
+            ("pending", "Pending"),
+            ("valid", "Valid"),
+            ("invalid", "Invalid"),
+        ],
+        string="Finvoice validation",
+        readonly=True,
+        copy=False,
+        index=True,
+    )
+    finvoice_validation_errors = fields.Text(
+        string="Finvoice validation errors",
+        readonly=True,
+        copy=False,
+    )
+
+    finvoice_transmission_state = fields.Selection(
+        [
+            ("to_send", "To send"),
+            ("sent", "Sent"),
+            ("error", "Error"),
+        ],
+        string="Finvoice transmission",
+        readonly=True,
+        copy=False,
+        index=True,
+    )
+    finvoice_transmission_attempts = fields.Integer(
+        string="Finvoice transmission attempts",
+        readonly=True,
+        copy=False,
+    )
+    finvoice_transmission_next_try = fields.Datetime(
+        string="Finvoice next transmission",
+        readonly=True,
+        copy=False,
+    )
+    finvoice_transmission_error = fields.Text(
+        string="Finvoice transmission error",
+        readonly=True,
+        copy=False,
+    )
+
+    @api.model
+    def _cron_process_documents_web_services(self, job_count=None):
+        # Sharded Finvoice exports are left to the Finvoice export crons
+        return super(
+            AccountEdiDocument, self.with_context(finvoice_skip_sharded_export=True)
+        )._cron_process_documents_web_services(job_count=job_count)
+
+    def _process_documents_web_services(self, job_count=None, with_commit=True):
+        documents = self
+        if self._context.get("finvoice_skip_sharded_export"):
+            documents = self.filtered(
+                lambda d: not d.edi_format_id._finvoice_use_sharded_export()
+            )
+        return super(AccountEdiDocument, documents)._process_documents_web_services(
+            job_count=job_count, with_commit=with_commit
+        )
+
+    @api.model
+    def _finvoice_claim_export_chunk(self, edi_format, chunk_size, skip_ids=()):
+        """
+        Lock a chunk of Finvoice documents waiting for export, and their
+        invoices. Documents locked by other shards, and documents of
+        invoices locked by another transaction, are skipped. So concurrent
+        shards always get disjoint chunks, and account_edi can lock the
+        invoices of the chunk without waiting
+        """
+        self.flush_model()
+        self.env.cr.execute(
+            """
+            SELECT document.id
+              FROM account_edi_document document
+              JOIN account_move move ON move.id = document.move_id
+             WHERE document.edi_format_id = %s
+               AND document.state = 'to_send'
+               AND document.blocking_level IS DISTINCT FROM 'error'
+               AND move.state = 'posted'
+               AND document.id != ALL(%s)
+             ORDER BY document.id
+             LIMIT %s
+               FOR UPDATE OF document, move SKIP LOCKED
+            """,
+            [edi_format.id, list(skip_ids), chunk_size],
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_finvoice_export(self, shard=1):
+        """
+        Export Finvoice documents waiting for export, chunk by chunk.
+        Every shard runs this in its own cron job, claiming chunks that
+        aren't being exported by the other shards. Each chunk is committed
+        on its own
+        """
+        edi_format = self.env["account.edi.format"]._finvoice_get_edi_format()
+        if not edi_format or not edi_format._finvoice_use_sharded_export():
+            return
+
+        chunk_size = edi_format.finvoice_export_chunk_size or 100
+        start = time.monotonic()
+        processed_ids = set()
+        exported = 0
+        while time.monotonic() - start < FINVOICE_EXPORT_SHARD_TIME:
+            documents = self._finvoice_claim_export_chunk(
+                edi_format, chunk_size, processed_ids
+            )
+            if not documents:
+                break
+
+            documents.with_context(
+                finvoice_export_shard=shard
+            )._process_documents_web_services(with_commit=False)
+            # Documents still waiting (e.g. after a warning) are retried
+            # in the next run instead of claiming them again now
+            processed_ids.update(documents.ids)
+            exported += len(documents.filtered(lambda d: d.state == "sent"))
+            # Each chunk is a transaction of its own: committing releases
+            # its locks and keeps the chunk if a later one fails
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+
+            _logger.info(
+                "Finvoice export shard %s: %s documents exported in %.1f s",
+                shard,
+                exported,
+                time.monotonic() - start,
+            )
+        else:
+            # Out of time, continue in a new run
+            self.env.ref(
+                f"account_edi_finvoice.ir_cron_finvoice_export_{shard}"
+            )._trigger()
+
+    @api.model
+    def _cron_finvoice_validate(self, limit=500):
+        """Validate exported Finvoice documents waiting for validation"""
+        documents = self.search(
+            [
+                ("finvoice_validation_state", "=", "pending"),
+                ("attachment_id", "!=", False),
+            ],
+            limit=limit,
+        )
+        for document in documents:
+            edi_format = document.edi_format_id
+            attachment = document.attachment_id
+            if attachment.store_fname:
+                # Validate from the filestore, without loading the whole file
+                path = attachment._full_path(attachment.store_fname)
+                opener = gzip.open if attachment.finvoice_compressed else open
+                with opener(path, "rb") as xml_file:
+                    errors = edi_format._finvoice_get_schema_errors(xml_file)
+            else:
+                errors = edi_format._finvoice_get_schema_errors(attachment.raw)
+            message = edi_format._finvoice_format_schema_errors(
+                errors, edi_format.finvoice_validation_max_errors
+            )
+            document.write(
+                {
+                    "finvoice_validation_state": "invalid" if errors else "valid",
+                    "finvoice_validation_errors": message or False,
+                }
+            )
+            # Keep the results of validated documents if the cron is
+            # interrupted, validation of big documents takes time
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+
+        if len(documents) == limit:
+            # More documents waiting, continue in a new run
+            self.env.ref("account_edi_finvoice.ir_cron_finvoice_validate")._trigger()
+
+    @api.model
+    def _cron_finvoice_transmit(self):
+        """Send queued Finvoice documents to the e-invoice operator"""
+        edi_format = self.env.ref(
+            "account_edi_finvoice.edi_finvoice_3_0", raise_if_not_found=False
+        )
+        transport = edi_format and edi_format._finvoice_get_transport()
+        if not transport:
+            return
+
+        now = fields.Datetime.now()
+        batch_size = edi_format.finvoice_transport_batch_size
+        documents = self.search(
+            [
+                ("edi_format_id", "=", edi_format.id),
+                ("finvoice_transmission_state", "=", "to_send"),
+                ("attachment_id", "!=", False),
+                "|",
+                ("finvoice_transmission_next_try", "=", False),
+                ("finvoice_transmission_next_try", "<=", now),
+            ],
+            limit=batch_size,
+        )
+        if not documents:
+            return
+
+        # Read the content here, the transport threads can't use the ORM
+        results = transport.send(
+            [(document.id, document.attachment_id.raw) for document in documents]
+        )
+
+        for document in documents:
+            success, message = results[document.id]
+            if success:
+                document.write(
+                    {
+                        "finvoice_transmission_state": "sent",
+                        "finvoice_transmission_error": False,
+                    }
+                )
+                continue
+
+            attempts = document.finvoice_transmission_attempts + 1
+            values = {
+                "finvoice_transmission_attempts": attempts,
+                "finvoice_transmission_error": message,
+            }
+            if attempts >= edi_format.finvoice_transport_max_attempts:
+                values["finvoice_transmission_state"] = "error"
+            else:
+                # Back off exponentially: 2, 4, 8... minutes
+                values["finvoice_transmission_next_try"] = now + timedelta(
+                    minutes=2**attempts
+                )
+            document.write(values)
+        # The documents have been sent: commit their state right away, so
+        # they aren't sent again if a later step of the cron fails
+        self.env.cr.commit()  # pylint: disable=invalid-commit
+
+        if len(documents) == batch_size:
+            # More documents waiting, continue in a new run
+            self.env.ref("account_edi_finvoice.ir_cron_finvoice_transmit")._trigger()
@@ -1,13 +1,27 @@
+import gzip
+import hashlib
 import logging
-import re
+import os
+import random
+import shutil
+import tempfile
 import textwrap
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 
 from lxml import etree
 
-from odoo import _, api, models, tools
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_repr
+from odoo.models import PREFETCH_MAX
+from odoo.tools import float_repr, split_every
+
+from .account_edi_document import FINVOICE_EXPORT_SHARDS
+
+from ..tools.amount import parse_amount
+from ..tools.extract import find_attribute, find_texts_joined
+from ..tools.timing import finvoice_phase, finvoice_timer
+from ..tools.transport import get_http_transport
 
 _logger = logging.getLogger(__name__)
 
@@ -36,35 +50,294 @@ INVOICE_TYPES = {
     "SDD01": "Suoraveloituksen ennakkoilmoitus",
 }
 
+# Finvoice QuantityUnitCode is free text. Map the commonly used codes
+# (Finnish, English and UN/ECE Recommendation 20) to units of measure.
+# Codes are matched in lower case
+FINVOICE_UOM_CODES = {
+    "kpl": "uom.product_uom_unit",
+    "kappale": "uom.product_uom_unit",
+    "pcs": "uom.product_uom_unit",
+    "pc": "uom.product_uom_unit",
+    "ea": "uom.product_uom_unit",
+    "unit": "uom.product_uom_unit",
+    "units": "uom.product_uom_unit",
+    "c62": "uom.product_uom_unit",
+    "h62": "uom.product_uom_unit",
+    "tus": "uom.product_uom_dozen",
+    "dzn": "uom.product_uom_dozen",
+    "kg": "uom.product_uom_kgm",
+    "kgm": "uom.product_uom_kgm",
+    "g": "uom.product_uom_gram",
+    "grm": "uom.product_uom_gram",
+    "tne": "uom.product_uom_ton",
+    "h": "uom.product_uom_hour",
+    "tunti": "uom.product_uom_hour",
+    "tuntia": "uom.product_uom_hour",
+    "hour": "uom.product_uom_hour",
+    "hours": "uom.product_uom_hour",
+    "hur": "uom.product_uom_hour",
+    "pv": "uom.product_uom_day",
+    "päivä": "uom.product_uom_day",
+    "päivää": "uom.product_uom_day",
+    "day": "uom.product_uom_day",
+    "days": "uom.product_uom_day",
+    "l": "uom.product_uom_litre",
+    "ltr": "uom.product_uom_litre",
+    "litra": "uom.product_uom_litre",
+    "m": "uom.product_uom_meter",
+    "mtr": "uom.product_uom_meter",
+    "km": "uom.product_uom_km",
+    "kmt": "uom.product_uom_km",
+    "cm": "uom.product_uom_cm",
+    "cmt": "uom.product_uom_cm",
+}
+
+# Namespaces of the SOAP envelope preceding each Finvoice in a transmission file
+SOAP_ENV_NS = "http://schemas.xmlsoap.org/soap/envelope/"
+EB_NS = "http://www.oasis-open.org/committees/ebxml-msg/schema/msg-header-2_0.xsd"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+
+# Compiled XSD schemas are cached per worker process.
+# Compiling the Finvoice XSD is expensive, so it's done once per version
+# and redone only if the schema file is modified (mtime changes)
+_finvoice_schema_cache = {}
+_finvoice_schema_cache_stats = {"hits": 0, "misses": 0}
+_finvoice_schema_cache_lock = threading.Lock()
+
+# Seller-side elements of the lxml export only depend on the company and
+# its bank account, so they are serialized once and reused for all invoices.
+# Entries are keyed by company and bank account, and rebuilt when the
+# write_date of any record they are built from changes. Writes to these
+# records also clear the cache, as a write_date doesn't change within a
+# transaction
+FINVOICE_FRAGMENT_CACHE_SIZE = 256
+_finvoice_fragment_cache = {}
+_finvoice_fragment_cache_lock = threading.Lock()
+
+# Transmission files are only created to be downloaded, so they are
+# removed by the autovacuum once they are older than this
+FINVOICE_TRANSMISSION_MAX_AGE = timedelta(days=1)
+FINVOICE_TRANSMISSION_PREFIX = "finvoice_transmission_"
+
+
+def _finvoice_text(value):
+    # Mimic QWeb t-esc: falsy values (except zero) are rendered as empty
+    if value is False or value is None:
+        return ""
+    return str(value)
+
+
+def _finvoice_sub(parent, tag, value="", **attrib):
+    # Mimic QWeb t-att-*: attributes with a falsy value are left out
+    element = etree.SubElement(
+        parent, tag, {key: str(val) for key, val in attrib.items() if val}
+    )
+    element.text = _finvoice_text(value)
+    return element
+
 
 class AccountEdiFormat(models.Model):
     _inherit = "account.edi.format"
 
+    finvoice_export_engine = fields.Selection(
+        [
+            ("qweb", "QWeb template"),
+            ("lxml", "Native lxml"),
+        ],
+        string="Finvoice export engine",
+        default="qweb",
+        help="QWeb renders the customizable export_finvoice template. "
+        "Native lxml builds the same document directly, which is faster, "
+        "but ignores customizations made to the template.",
+    )
+    finvoice_validation_policy = fields.Selection(
+        [
+            ("sync", "Validate"),
+            ("sampled", "Validate a sample"),
+            ("async", "Validate in background"),
+            ("strict", "Validate and block invalid documents"),
+            ("off", "Don't validate"),
+        ],
+        string="Finvoice schema validation",
+        default="sync",
+        help="How Finvoice documents are validated against the XML Schema.\n"
+        "Validate: invalid documents are logged.\n"
+        "Validate a sample: only the given percentage of documents is validated.\n"
+        "Validate in background: exported documents are validated later by "
+        "a scheduled action, which marks the EDI document valid or invalid. "
+        "Imported documents are validated right away.\n"
+        "Validate and block invalid documents: invalid documents raise an error.",
+    )
+    finvoice_validation_sample_rate = fields.Integer(
+        string="Finvoice validation sample (%)",
+        default=10,
+    )
+    finvoice_validation_max_errors = fields.Integer(
+        string="Finvoice validation errors shown",
+        default=10,
+        help="Number of schema validation errors logged for an invalid document",
+    )
+    finvoice_transport = fields.Selection(
+        [("none", "Don't send"), ("http", "HTTP")],
+        string="Finvoice transport",
+        default="none",
+        required=True,
+        help="How posted Finvoice documents are sent to the e-invoice operator. "
+        "Documents are queued and sent in batches by a scheduled action.",
+    )
+    finvoice_transport_url = fields.Char(string="Finvoice operator URL")
+    finvoice_transport_workers = fields.Integer(
+        string="Finvoice concurrent connections",
+        default=4,
+    )
+    finvoice_transport_timeout = fields.Integer(
+        string="Finvoice operator timeout (s)",
+        default=30,
+    )
+    finvoice_transport_batch_size = fields.Integer(
+        string="Finvoice transmission batch size",
+        default=100,
+    )
+    finvoice_transport_max_attempts = fields.Integer(
+        string="Finvoice transmission attempts",
+        default=5,
+        help="Failed documents are retried with a growing delay, "
+        "until the number of attempts is reached",
+    )
+    finvoice_stream_min_lines = fields.Integer(
+        string="Finvoice streaming export from (lines)",
+        default=5000,
+        help="Invoices with at least this many lines are written to a file "
+        "row by row with the native lxml builder, reading the lines in "
+        "chunks, so the export doesn't hold the whole document in memory. "
+        "0 disables streaming.",
+    )
+    finvoice_export_sharded = fields.Boolean(
+        string="Export Finvoice in parallel",
+        help="Posted invoices are exported by several scheduled actions "
+        "running in parallel, instead of during posting. Each scheduled "
+        "action exports chunks of documents in its own transaction.",
+    )
+    finvoice_export_chunk_size = fields.Integer(
+        string="Finvoice export chunk size",
+        default=100,
+        help="Number of documents a parallel export job claims at a time",
+    )
+    finvoice_import_workers = fields.Integer(
+        string="Finvoice import processes",
+        default=0,
+        help="Worker processes parsing and validating the files of a batch "
+        "import in parallel. 0 checks the files in the server process, one "
+        "at a time. Each process takes memory of its own, so keep this well "
+        "below the memory limit of the server workers.",
+    )
+    finvoice_compress_attachments = fields.Boolean(
+        string="Compress Finvoice attachments",
+        help="Store exported Finvoice documents gzip compressed. They are "
+        "decompressed transparently when read or downloaded.",
+    )
+    finvoice_store_timings = fields.Boolean(
+        string="Store Finvoice timings",
+        help="Store the time and SQL queries spent in each phase of the export "
+        "on the EDI document",
+    )
+
     def _get_move_applicability(self, move):
         if self.code != "finvoice_3_0":
             return super()._get_move_applicability(move)
 
         return {
             "post": self._post_invoice_edi_finvoice,
+            "post_batching": self._finvoice_post_batching,
             "cancel": self._cancel_invoice_edi_finvoice,
             "edi_content": self._edi_content_invoice_edi_finvoice,
         }
 
-    def _post_invoice_edi_finvoice(self, invoice):
+    def _needs_web_services(self):
+        if self._finvoice_use_sharded_export():
+            # Exported asynchronously by the Finvoice export crons
+            return True
+        return super()._needs_web_services()
+
+    def _finvoice_use_sharded_export(self):
+        self.ensure_one()
+        return self.code == "finvoice_3_0" and self.finvoice_export_sharded
+
+    def _finvoice_trigger_export(self):
+        """Wake up all the Finvoice export shards"""
+        for shard in range(1, FINVOICE_EXPORT_SHARDS + 1):
+            cron = self.env.ref(
+                f"account_edi_finvoice.ir_cron_finvoice_export_{shard}",
+                raise_if_not_found=False,
+            )
+            if cron and cron.active:
+                cron._trigger()
+
+    def _finvoice_post_batching(self, move):
+        # Posting only generates the XML, so invoices can be exported together.
+        # account_edi adds this key to the format, state and company
+        return () if move.is_invoice() else (move.id,)
+
+    def _post_invoice_edi_finvoice(self, invoices):
         if self.code != "finvoice_3_0":
-            return super()._post_invoice_edi(invoice)
+            return super()._post_invoice_edi(invoices)
 
         res = {}
-        attachment = self._export_finvoice(invoice)
-        res[invoice] = {
-            "success": True,
-            "attachment": attachment,
-            "message": None,
-            "response": None,
-        }
-        # We could post finvoice to a service here
+        errors = {}
+        attachments = self._export_finvoice_batch(invoices, errors=errors)
+        for invoice in invoices:
+            if invoice in errors:
+                res[invoice] = {
+                    "error": errors[invoice],
+                    "blocking_level": "error",
+                }
+                continue
+
+            res[invoice] = {
+                "success": True,
+                "attachment": attachments[invoice],
+                "message": None,
+                "response": None,
+            }
+
+        documents = invoices.filtered(
+            lambda i: i not in errors
+        ).edi_document_ids.filtered(lambda d: d.edi_format_id == self)
+        if self.finvoice_validation_policy == "async":
+            documents.finvoice_validation_state = "pending"
+
+        if self.finvoice_transport != "none":
+            # Sending is queued, so posting doesn't wait for the operator
+            self._finvoice_queue_transmission(documents)
+
         return res
 
+    def _finvoice_queue_transmission(self, documents):
+        documents.write(
+            {
+                "finvoice_transmission_state": "to_send",
+                "finvoice_transmission_attempts": 0,
+                "finvoice_transmission_next_try": False,
+                "finvoice_transmission_error": False,
+            }
+        )
+        self.env.ref("account_edi_finvoice.ir_cron_finvoice_transmit")._trigger()
+
+    def _finvoice_get_transport(self):
+        """
+        Return the transport for sending Finvoice documents,
+        or None if they aren't sent.
+        Override to add transports to finvoice_transport
+        """
+        self.ensure_one()
+        if self.finvoice_transport == "http" and self.finvoice_transport_url:
+            return get_http_transport(
+                self.finvoice_transport_url,
+                max_workers=self.finvoice_transport_workers,
+                timeout=self.finvoice_transport_timeout,
+            )
+        return None
+
     def _cancel_invoice_edi_finvoice(self, invoice):
         if self.code != "finvoice_3_0":
             return super()._cancel_invoice_edi(invoice)
@@ -73,12 +346,32 @@ class AccountEdiFormat(models.Model):
         return
 
     def _edi_content_invoice_edi_finvoice(self, invoice):
-        xml_string = self.env["ir.qweb"]._render(
-            "account_edi_finvoice.export_finvoice", self._get_finvoice_values(invoice)
-        )
+        with finvoice_timer(self.env.cr, "export", invoice=invoice.id):
+            attachment = self._finvoice_get_unchanged_attachment(invoice)
+            if attachment:
+                return attachment.raw
+            return self._finvoice_render(invoice)
+
+    def _finvoice_render(self, invoice):
+        if self.finvoice_export_engine == "lxml":
+            with finvoice_phase("render"):
+                tree = self._finvoice_build_tree(self._get_finvoice_values(invoice))
 
-        # Validate the content. This will NOT raise an error for user
-        self._finvoice_check_xml_schema(xml_string)
+            # Validate the tree as is, without a round trip through a string
+            self._finvoice_check_xml_schema(tree, deferrable=True)
+
+            with finvoice_phase("serialize"):
+                return etree.tostring(tree, encoding="UTF-8", xml_declaration=False)
+
+        with finvoice_phase("render"):
+            xml_string = self.env["ir.qweb"]._render(
+                "account_edi_finvoice.export_finvoice",
+                self._get_finvoice_values(invoice),
+            )
+
+        # Validate the content. This will NOT raise an error for user,
+        # unless the validation policy is strict
+        self._finvoice_check_xml_schema(xml_string, deferrable=True)
 
         # Add file encoding (schema validation doesn't want this)
         # xml_string = b"<?xml version='1.0' encoding='UTF-8'?>" + xml_string
@@ -86,6 +379,14 @@ class AccountEdiFormat(models.Model):
         return xml_string
 
     def _get_finvoice_values(self, invoice):
+        return dict(
+            self._finvoice_get_document_values(invoice),
+            rows=self._finvoice_group_lines(invoice),
+        )
+
+    def _finvoice_get_document_values(self, invoice):
+        """Values of the export template, except the invoice rows"""
+
         def format_monetary(amount):
             amount = float_repr(amount, invoice.currency_id.decimal_places)
             amount = str(amount).replace(".", ",")
@@ -143,20 +444,895 @@ class AccountEdiFormat(models.Model):
             "agreement_identifier": agreement_identifier,
         }
 
+    def _finvoice_group_lines(self, invoice):
+        """
+        Group the invoice lines into Finvoice rows, in a single pass.
+        Returns (line, sub_lines) pairs: the note lines following a product
+        line are exported as SubInvoiceRows of that line
+        """
+        rows = []
+        for line in invoice.invoice_line_ids:
+            if (
+                line.display_type == "line_note"
+                and rows
+                and rows[-1][0].display_type == "product"
+            ):
+                rows[-1][1].append(line)
+            else:
+                rows.append((line, []))
+        return rows
+
+    def _finvoice_iter_rows(self, invoice, batch_size=PREFETCH_MAX):
+        """
+        Group the invoice lines into Finvoice rows like _finvoice_group_lines,
+        reading the lines in chunks of batch_size. The cache of each chunk
+        is cleared once its rows have been used
+        """
+        lines = invoice.invoice_line_ids
+        row = None
+        for line_ids in split_every(batch_size, lines.ids):
+            chunk = lines.browse(line_ids)
+            for records, field_names in self._finvoice_line_export_dependencies(chunk):
+                records.fetch(field_names)
+
+            for line in chunk:
+                if (
+                    line.display_type == "line_note"
+                    and row
+                    and row[0].display_type == "product"
+                ):
+                    row[1].append(line)
+                    continue
+                if row:
+                    yield row
+                row = (line, [])
+
+            # The last row may still get sub lines from the next chunk
+            pending = row[0].union(*row[1]) if row else lines.browse()
+            (chunk - pending).invalidate_recordset()
+
+        if row:
+            yield row
+
+    def _finvoice_build_tree(self, values):
+        """
+        Build the Finvoice document with lxml.
+        This mirrors the export_finvoice QWeb template element by element
+        """
+        record = values["record"]
+        format_monetary = values["format_monetary"]
+        format_date = values["format_date"]
+        partner = record.partner_id
+        delivery = record.partner_id
+        currency_name = record.currency_id.name
+        sub = _finvoice_sub
+
+        fragments = self._finvoice_get_seller_fragments(record)
+
+        root = etree.Element("Finvoice", Version="3.0")
+
+        # region Message information
+        mtd = sub(root, "MessageTransmissionDetails")
+        mtd.append(fragments["MessageSenderDetails"])
+        mrd = sub(mtd, "MessageReceiverDetails")
+        sub(mrd, "ToIdentifier", partner.edicode)
+        sub(mrd, "ToIntermediator", partner.einvoice_operator_id.identifier)
+        md = sub(mtd, "MessageDetails")
+        sub(md, "MessageIdentifier", record.id)
+        sub(md, "MessageTimeStamp", values["message_timestamp"])
+        sub(md, "SpecificationIdentifier", "EN16931")
+        # endregion
+
+        # region Seller information
+        root.append(fragments["SellerPartyDetails"])
+        sub(root, "SellerContactPersonName", record.invoice_user_id.name)
+        root.append(fragments["SellerCommunicationDetails"])
+
+        sid = sub(root, "SellerInformationDetails")
+        sad = sub(sid, "SellerAccountDetails")
+        sub(
+            sad,
+            "SellerAccountID",
+            record.partner_bank_id.sanitized_acc_number,
+            IdentificationSchemeName="IBAN",
+        )
+        sub(
+            sad,
+            "SellerBic",
+            record.partner_bank_id.bank_bic,
+            IdentificationSchemeName="BIC",
+        )
+        # endregion
+
+        # region Invoice recipient, buyer and delivery information
+        party_name = (partner.name or "")[0:35]
+        for prefix, contact, name in (
+            ("InvoiceRecipient", partner, party_name),
+            ("Buyer", partner, partner.name),
+            ("Delivery", delivery, (delivery.name or "")[0:35]),
+        ):
+            ppd = sub(root, f"{prefix}PartyDetails")
+            sub(ppd, f"{prefix}PartyIdentifier", contact.company_registry)
+            sub(ppd, f"{prefix}OrganisationName", name)
+            sub(ppd, f"{prefix}OrganisationTaxCode", contact.vat)
+            ppad = sub(ppd, f"{prefix}PostalAddressDetails")
+            sub(ppad, f"{prefix}StreetName", contact.street)
+            sub(ppad, f"{prefix}StreetName", contact.street2)
+            sub(ppad, f"{prefix}TownName", contact.city)
+            sub(ppad, f"{prefix}PostCodeIdentifier", contact.zip)
+            sub(ppad, "CountryCode", contact.country_id.code)
+            sub(ppad, "CountryName", contact.country_id.name)
+
+            if prefix == "InvoiceRecipient":
+                sub(root, "InvoiceRecipientLanguageCode", "FI")
+            else:
+                pcd = sub(root, f"{prefix}CommunicationDetails")
+                sub(pcd, f"{prefix}PhoneNumberIdentifier", contact.phone)
+                sub(pcd, f"{prefix}EmailaddressIdentifier", contact.email)
+        # endregion
+
+        # region Invoice information
+        ind = sub(root, "InvoiceDetails")
+        sub(ind, "InvoiceTypeCode", values["type_code"])
+        sub(ind, "InvoiceTypeText", values["type_text"])
+        sub(ind, "OriginCode", values["origin_code"])
+        sub(ind, "InvoiceNumber", record.name)
+        sub(ind, "InvoiceDate", format_date(record.invoice_date), Format="CCYYMMDD")
+        sub(ind, "SellerReferenceIdentifier", record.payment_reference)
+        sub(ind, "OrderIdentifier", record.name)
+        sub(ind, "SalesPersonName", record.invoice_user_id.name)
+        sub(ind, "AgreementIdentifier", values["agreement_identifier"])
+        sub(ind, "BuyerReferenceIdentifier", record.ref or "")
+        sub(ind, "ProjectReferenceIdentifier", "")
+        for tag, amount in (
+            ("InvoiceTotalVatExcludedAmount", record.amount_untaxed_signed),
+            ("InvoiceTotalVatAmount", record.amount_tax_signed),
+            ("InvoiceTotalVatIncludedAmount", record.amount_total_signed),
+        ):
+            sub(
+                ind,
+                tag,
+                format_monetary(amount),
+                AmountCurrencyIdentifier=currency_name,
+            )
+        for free_text in values["free_texts"]:
+            sub(ind, "InvoiceFreeText", free_text)
+
+        ptd = sub(ind, "PaymentTermsDetails")
+        sub(ptd, "PaymentTermsFreeText", record.invoice_payment_term_id.name)
+        sub(
+            ptd,
+            "InvoiceDueDate",
+            format_date(record.invoice_date_due),
+            Format="CCYYMMDD",
+        )
+        if values["overdue_fine_percent"]:
+            podfd = sub(ptd, "PaymentOverDueFineDetails")
+            sub(podfd, "PaymentOverDueFinePercent", values["overdue_fine_percent"])
+        # endregion
+
+        # region Invoice Row information
+        for line, sub_lines in values["rows"]:
+            self._finvoice_build_row(root, line, format_monetary)
+            if sub_lines:
+                self._finvoice_build_sub_rows(root, sub_lines)
+        # endregion
+
+        # region EPI information
+        ede = sub(root, "EpiDetails")
+        eid = sub(ede, "EpiIdentificationDetails")
+        sub(eid, "EpiDate", format_date(), Format="CCYYMMDD")
+        sub(eid, "EpiReference")
+
+        epd = sub(ede, "EpiPartyDetails")
+        ebpd = sub(epd, "EpiBfiPartyDetails")
+        sub(
+            ebpd,
+            "EpiBfiIdentifier",
+            record.partner_bank_id.bank_bic,
+            IdentificationSchemeName="BIC",
+        )
+        epd.append(fragments["EpiBeneficiaryPartyDetails"])
+
+        epid = sub(ede, "EpiPaymentInstructionDetails")
+        sub(epid, "EpiPaymentInstructionId", record.payment_reference)
+        sub(
+            epid,
+            "EpiRemittanceInfoIdentifier",
+            record.payment_reference,
+            IdentificationSchemeName="SPY",
+        )
+        sub(
+            epid,
+            "EpiInstructedAmount",
+            format_monetary(record.amount_residual),
+            AmountCurrencyIdentifier=currency_name,
+        )
+        sub(epid, "EpiCharge", "SHA", ChargeOption="SHA")
+        sub(
+            epid,
+            "EpiDateOptionDate",
+            format_date(record.invoice_date_due),
+            Format="CCYYMMDD",
+        )
+        # endregion
+
+        return root
+
+    def _finvoice_build_seller_fragments(self, company, bank):
+        """
+        Build the seller-side elements of the export, which only depend on
+        the company and the bank account receiving the payment
+        """
+        sub = _finvoice_sub
+
+        msd = etree.Element("MessageSenderDetails")
+        sub(msd, "FromIdentifier", company.edicode)
+        sub(msd, "FromIntermediator", company.einvoice_operator_id.identifier)
+
+        spd = etree.Element("SellerPartyDetails")
+        sub(spd, "SellerPartyIdentifier", company.company_registry)
+        sub(spd, "SellerOrganisationName", company.name)
+        sub(spd, "SellerOrganisationTaxCode", company.vat)
+        spad = sub(spd, "SellerPostalAddressDetails")
+        if company.street:
+            sub(spad, "SellerStreetName", company.street)
+        if company.street2:
+            sub(spad, "SellerStreetName", company.street2)
+        sub(spad, "SellerTownName", company.city)
+        sub(spad, "SellerPostCodeIdentifier", company.zip)
+        sub(spad, "CountryCode", company.country_id.code)
+        sub(spad, "CountryName", company.country_id.name)
+
+        scd = etree.Element("SellerCommunicationDetails")
+        sub(scd, "SellerPhoneNumberIdentifier", company.phone)
+        sub(scd, "SellerEmailaddressIdentifier", company.email)
+
+        ebfpd = etree.Element("EpiBeneficiaryPartyDetails")
+        sub(ebfpd, "EpiNameAddressDetails", company.name)
+        sub(ebfpd, "EpiBei", company.company_registry)
+        if bank:
+            sub(
+                ebfpd,
+                "EpiAccountID",
+                bank.sanitized_acc_number,
+                IdentificationSchemeName="IBAN",
+            )
+
+        return [msd, spd, scd, ebfpd]
+
+    def _finvoice_get_seller_fragments_stamp(self, company, bank):
+        # Any change to these records may change the fragments
+        return (
+            company.write_date,
+            company.partner_id.write_date,
+            company.country_id.write_date,
+            company.einvoice_operator_id.write_date,
+            bank.write_date,
+        )
+
+    def _finvoice_get_seller_fragments(self, invoice):
+        """
+        Return the seller-side elements of the export of an invoice,
+        as {tag: element}. The elements are serialized once per company
+        and bank account, and are new copies for each call
+        """
+        company = invoice.company_id
+        bank = invoice.partner_bank_id or company.bank_ids[:1]
+        # Built in the language of the invoice's environment
+        key = (self.env.cr.dbname, invoice.env.lang, company.id, bank.id)
+        stamp = self._finvoice_get_seller_fragments_stamp(company, bank)
+
+        with _finvoice_fragment_cache_lock:
+            cached = _finvoice_fragment_cache.get(key)
+
+        if cached and cached[0] == stamp:
+            fragments = cached[1]
+        else:
+            fragments = {
+                element.tag: etree.tostring(element)
+                for element in self._finvoice_build_seller_fragments(company, bank)
+            }
+            with _finvoice_fragment_cache_lock:
+                if len(_finvoice_fragment_cache) >= FINVOICE_FRAGMENT_CACHE_SIZE:
+                    _finvoice_fragment_cache.clear()
+                _finvoice_fragment_cache[key] = (stamp, fragments)
+
+        return {tag: etree.fromstring(xml) for tag, xml in fragments.items()}
+
+    @api.model
+    def _finvoice_clear_fragment_cache(self):
+        with _finvoice_fragment_cache_lock:
+            _finvoice_fragment_cache.clear()
+
+    def _finvoice_build_row(self, parent, line, format_monetary):
+        sub = _finvoice_sub
+        currency_name = line.currency_id.name
+        uom_name = line.product_uom_id.name
+
+        row = sub(parent, "InvoiceRow")
+        sub(row, "ArticleIdentifier", line.product_id.default_code)
+        sub(row, "ArticleName", line.product_id.name)
+        sub(row, "BuyerArticleIdentifier", line.product_id.default_code)
+        sub(row, "EanCode", line.product_id.barcode)
+        sub(
+            row,
+            "DeliveredQuantity",
+            format_monetary(line.quantity),
+            QuantityUnitCode=uom_name,
+        )
+        sub(
+            row,
+            "InvoicedQuantity",
+            format_monetary(line.quantity),
+            QuantityUnitCode=uom_name,
+        )
+        sub(
+            row,
+            "UnitPriceAmount",
+            format_monetary(line.price_unit),
+            AmountCurrencyIdentifier=currency_name,
+        )
+        sub(row, "RowIdentifier", line.id)
+        sub(row, "RowPositionIdentifier", line.id)
+        sub(row, "RowFreeText", line.name)
+        sub(
+            row,
+            "RowVatRatePercent",
+            format_monetary(sum(line.tax_ids.mapped("amount"))),
+        )
+        sub(
+            row,
+            "RowVatAmount",
+            format_monetary(line.price_total - line.price_subtotal),
+            AmountCurrencyIdentifier=currency_name,
+        )
+        sub(
+            row,
+            "RowVatExcludedAmount",
+            format_monetary(line.price_subtotal),
+            AmountCurrencyIdentifier=currency_name,
+        )
+        sub(
+            row,
+            "RowAmount",
+            format_monetary(line.price_total),
+            AmountCurrencyIdentifier=currency_name,
+        )
+        return row
+
+    def _finvoice_build_sub_rows(self, parent, sub_lines):
+        sub = _finvoice_sub
+
+        # Sub rows go to an InvoiceRow of their own
+        row = sub(parent, "InvoiceRow")
+        for line in sub_lines:
+            name = line.name or ""
+            sub_row = sub(row, "SubInvoiceRow")
+            sub(sub_row, "SubRowPositionIdentifier", line.id)
+            sub(sub_row, "SubArticleName", name[0:100])
+            if len(name) > 100:
+                sub(sub_row, "SubArticleDescription", name[0:512])
+        return row
+
+    def _finvoice_write(self, invoice, file_obj):
+        """
+        Write the Finvoice document of an invoice to a file object,
+        one invoice row at a time.
+
+        The document is built with the native lxml builder: the header and
+        footer are built as usual, and the rows are serialized as soon as
+        they are built. Memory use doesn't grow with the number of lines
+        """
+        values = self._finvoice_get_document_values(invoice)
+        format_monetary = values["format_monetary"]
+        with finvoice_phase("render"):
+            root = self._finvoice_build_tree(dict(values, rows=[]))
+        epi_details = root.find("EpiDetails")
+
+        with finvoice_phase("stream"):
+            with etree.xmlfile(file_obj, encoding="UTF-8") as xml_file:
+                with xml_file.element(root.tag, root.attrib):
+                    for element in root:
+                        if element is epi_details:
+                            break
+                        xml_file.write(element)
+
+                    container = etree.Element(root.tag)
+                    for line, sub_lines in self._finvoice_iter_rows(invoice):
+                        self._finvoice_build_row(container, line, format_monetary)
+                        if sub_lines:
+                            self._finvoice_build_sub_rows(container, sub_lines)
+                        for element in container:
+                            xml_file.write(element)
+                        container.clear()
+
+                    xml_file.write(epi_details)
+
+    def _finvoice_use_stream_export(self, invoice):
+        min_lines = self.finvoice_stream_min_lines
+        return bool(min_lines) and len(invoice.invoice_line_ids) >= min_lines
+
+    def _finvoice_export_stream(self, invoice):
+        """
+        Export an invoice through a temporary file with _finvoice_write,
+        and store the attachment from the file. Returns the attachment
+        """
+        with tempfile.TemporaryFile() as xml_file:
+            self._finvoice_write(invoice, xml_file)
+            self._finvoice_check_xml_schema(xml_file, deferrable=True)
+
+            with finvoice_phase("attachment_create"):
+                values = self._get_finvoice_attachment_values(invoice, False)
+                del values["raw"]
+                if not values.get("finvoice_compressed"):
+                    return self._finvoice_create_attachment_from_file(xml_file, values)
+
+                with tempfile.TemporaryFile() as compressed_file:
+                    xml_file.seek(0)
+                    with gzip.GzipFile(
+                        fileobj=compressed_file, mode="wb", mtime=0
+                    ) as gzip_file:
+                        shutil.copyfileobj(xml_file, gzip_file)
+                    return self._finvoice_create_attachment_from_file(
+                        compressed_file, values
+                    )
+
+    def _get_finvoice_attachment_values(self, invoice, xml_string):
+        xml_name = "%s_finvoice_3_0.xml" % (invoice.name.replace("/", "_"))
+        values = {
+            "name": xml_name,
+            "raw": xml_string,
+            "mimetype": "application/xml",
+            "res_model": "account.move",
+        }
+        if self.finvoice_compress_attachments:
+            if isinstance(xml_string, str):
+                xml_string = xml_string.encode("UTF-8")
+            # No timestamp, so identical documents share the stored file
+            values.update(
+                raw=xml_string and gzip.compress(xml_string, mtime=0),
+                finvoice_compressed=True,
+            )
+        return values
+
     def _export_finvoice(self, invoice):
         self.ensure_one()
 
         xml_string = self._edi_content_invoice_edi_finvoice(invoice)
 
-        xml_name = "%s_finvoice_3_0.xml" % (invoice.name.replace("/", "_"))
         return self.env["ir.attachment"].create(
+            self._get_finvoice_attachment_values(invoice, xml_string)
+        )
+
+    def _finvoice_export_dependencies(self, invoices, with_lines=True):
+        """
+        Yield the records and fields the export template reads,
+        as (records, field names) pairs
+        """
+        yield (
+            invoices,
+            [
+                "name",
+                "ref",
+                "move_type",
+                "narration",
+                "payment_reference",
+                "invoice_date",
+                "invoice_date_due",
+                "amount_untaxed_signed",
+                "amount_tax_signed",
+                "amount_total_signed",
+                "amount_residual",
+                "company_id",
+                "partner_id",
+                "partner_bank_id",
+                "currency_id",
+                "invoice_user_id",
+                "invoice_payment_term_id",
+                "invoice_line_ids",
+            ],
+        )
+        # Fields of other modules the export reads when they're installed
+        hook_fields = [
+            name
+            for name in ("overdue_interest", "agreement_identifier")
+            if name in invoices._fields
+        ]
+        if hook_fields:
+            yield invoices, hook_fields
+
+        companies = invoices.company_id
+        partners = invoices.partner_id | companies.partner_id
+        partners |= invoices.invoice_user_id.partner_id
+        yield (
+            partners,
+            [
+                "name",
+                "company_registry",
+                "vat",
+                "street",
+                "street2",
+                "city",
+                "zip",
+                "phone",
+                "email",
+                "country_id",
+                "edicode",
+                "einvoice_operator_id",
+            ],
+        )
+        yield partners.country_id, ["code", "name"]
+        yield partners.einvoice_operator_id, ["identifier"]
+        yield companies, ["edicode", "einvoice_operator_id", "bank_ids"]
+        yield companies.einvoice_operator_id, ["identifier"]
+
+        banks = invoices.partner_bank_id | companies.bank_ids
+        yield banks, ["sanitized_acc_number", "bank_id"]
+        yield banks.bank_id, ["bic"]
+
+        yield invoices.invoice_payment_term_id, ["name"]
+        yield invoices.currency_id, ["name", "decimal_places"]
+
+        if with_lines:
+            yield from self._finvoice_line_export_dependencies(
+                invoices.invoice_line_ids
+            )
+
+    def _finvoice_line_export_dependencies(self, lines):
+        yield (
+            lines,
+            [
+                "name",
+                "display_type",
+                "quantity",
+                "price_unit",
+                "price_subtotal",
+                "price_total",
+                "product_id",
+                "product_uom_id",
+                "currency_id",
+                "tax_ids",
+            ],
+        )
+        yield lines.product_id, ["default_code", "barcode", "product_tmpl_id"]
+        yield lines.product_id.product_tmpl_id, ["name"]
+        yield lines.product_uom_id, ["name"]
+        yield lines.tax_ids, ["amount"]
+
+    def _finvoice_prefetch_export_data(self, invoices):
+        """
+        Read everything the export template uses with grouped reads,
+        instead of letting the template fetch the fields record by record
+        """
+        # Lines of streamed invoices are read in chunks during the export
+        streamed = invoices.filtered(self._finvoice_use_stream_export)
+        for records, field_names in self._finvoice_export_dependencies(
+            invoices - streamed
+        ):
+            records.fetch(field_names)
+        if streamed:
+            for records, field_names in self._finvoice_export_dependencies(
+                streamed, with_lines=False
+            ):
+                records.fetch(field_names)
+
+        invoices.edi_document_ids.fetch(
+            ["edi_format_id", "attachment_id", "finvoice_fingerprint"]
+        )
+
+    def _finvoice_get_export_fingerprint(self, invoice):
+        """
+        Hash of everything the export of an invoice depends on.
+        If the fingerprint hasn't changed, neither has the exported XML
+        """
+        digest = hashlib.sha256()
+        digest.update(repr(self._finvoice_get_export_version()).encode())
+        for records, field_names in self._finvoice_export_dependencies(invoice):
+            for record_ids in split_every(PREFETCH_MAX, records.ids):
+                chunk = records.browse(record_ids)
+                for record in chunk:
+                    values = [record.id] + [record[name] for name in field_names]
+                    digest.update(repr(values).encode())
+                if len(records) > PREFETCH_MAX:
+                    # Don't keep the lines of big invoices in the cache
+                    chunk.invalidate_recordset(field_names)
+        return digest.hexdigest()
+
+    def _finvoice_get_export_version(self):
+        # Exports change with the module and with template customizations
+        version = [
+            self.finvoice_export_engine,
+            self.env.ref("base.module_account_edi_finvoice").latest_version,
+        ]
+        if self.finvoice_export_engine == "qweb":
+            views = todo = self.env.ref("account_edi_finvoice.export_finvoice")
+            while todo:
+                todo = todo.inherit_children_ids - views
+                views |= todo
+            version += [(view.id, view.write_date) for view in views]
+        return version
+
+    def _finvoice_get_unchanged_attachment(self, invoice, fingerprint=None):
+        """
+        Return the exported attachment of an invoice,
+        if nothing it depends on has changed since the export
+        """
+        document = invoice.edi_document_ids.filtered(lambda d: d.edi_format_id == self)[
+            :1
+        ]
+        if not document.attachment_id or not document.finvoice_fingerprint:
+            return None
+
+        if fingerprint is None:
+            with finvoice_phase("fingerprint"):
+                fingerprint = self._finvoice_get_export_fingerprint(invoice)
+        if document.finvoice_fingerprint != fingerprint:
+            return None
+        return document.attachment_id
+
+    def _export_finvoice_batch(self, invoices, batch_size=PREFETCH_MAX, errors=None):
+        """
+        Export a recordset of invoices as Finvoice attachments
+
+        Invoices are handled in chunks of batch_size: the related data for
+        each chunk is prefetched and all attachments of the chunk are
+        created in one go. Invoices that haven't changed since their last
+        export reuse the exported XML. Returns a dict of attachments by invoice
+
+        :param errors: if a dict is given, invoices failing the export get
+            their error message in it instead of raising an error
+        """
+        self.ensure_one()
+
+        cr = self.env.cr
+        attachments = {}
+        for invoice_ids in split_every(batch_size, invoices.ids):
+            chunk = invoices.browse(invoice_ids)
+            timings = {}
+            with finvoice_timer(cr, "export_batch", invoices=len(chunk)):
+                with finvoice_phase("prefetch"):
+                    self._finvoice_prefetch_export_data(chunk)
+
+                exported = []
+                attachment_values = []
+                fingerprints = {}
+                for invoice in chunk:
+                    try:
+                        with finvoice_timer(cr, "export", invoice=invoice.id) as timer:
+                            with finvoice_phase("fingerprint"):
+                                fingerprint = self._finvoice_get_export_fingerprint(
+                                    invoice
+                                )
+                            unchanged = self._finvoice_get_unchanged_attachment(
+                                invoice, fingerprint
+                            )
+                            streamed = None
+                            if unchanged:
+                                xml_string = unchanged.raw
+                            elif self._finvoice_use_stream_export(invoice):
+                                streamed = self._finvoice_export_stream(invoice)
+                            else:
+                                xml_string = self._finvoice_render(invoice)
+                    except UserError as e:
+                        if errors is None:
+                            raise
+                        errors[invoice] = str(e)
+                        continue
+                    timings[invoice] = timer.as_dict()
+                    fingerprints[invoice] = fingerprint
+                    if streamed:
+                        attachments[invoice] = streamed
+                        continue
+                    exported.append(invoice)
+                    attachment_values.append(
+                        self._get_finvoice_attachment_values(invoice, xml_string)
+                    )
+
+                with finvoice_phase("attachment_create"):
+                    created = self.env["ir.attachment"].create(attachment_values)
+                attachments.update(zip(exported, created))
+                self._finvoice_store_fingerprints(fingerprints)
+
+            if self.finvoice_store_timings:
+                self._finvoice_store_timings(timings)
+
+        return attachments
+
+    def _finvoice_store_fingerprints(self, fingerprints):
+        for invoice, fingerprint in fingerprints.items():
+            documents = invoice.edi_document_ids.filtered(
+                lambda document: document.edi_format_id == self
+            )
+            documents.finvoice_fingerprint = fingerprint
+
+    def _finvoice_store_timings(self, timings):
+        """
+        Store export timings on the EDI documents
+
+        :param timings: dict of timings by invoice
+        """
+        for invoice, invoice_timings in timings.items():
+            documents = invoice.edi_document_ids.filtered(
+                lambda document: document.edi_format_id == self
+            )
+            documents.finvoice_timings = invoice_timings
+
+    def _finvoice_build_soap_envelope(self, invoice, message_timestamp):
+        """
+        Build the SOAP envelope (ebXML message header) for an invoice in
+        a Finvoice transmission file
+        """
+        company = invoice.company_id
+        partner = invoice.partner_id
+        soap = "{%s}" % SOAP_ENV_NS
+        eb = "{%s}" % EB_NS
+        message_id = str(invoice.id)
+
+        envelope = etree.Element(
+            soap + "Envelope",
+            nsmap={"SOAP-ENV": SOAP_ENV_NS, "eb": EB_NS, "xlink": XLINK_NS},
+        )
+        header = etree.SubElement(envelope, soap + "Header")
+        message_header = etree.SubElement(
+            header,
+            eb + "MessageHeader",
+            {soap + "mustUnderstand": "1", eb + "version": "2.0"},
+        )
+        for tag, party_id, role in (
+            ("From", company.edicode, "Sender"),
+            ("From", company.einvoice_operator_id.identifier, "Intermediator"),
+            ("To", partner.edicode, "Receiver"),
+            ("To", partner.einvoice_operator_id.identifier, "Intermediator"),
+        ):
+            party = etree.SubElement(message_header, eb + tag)
+            _finvoice_sub(party, eb + "PartyId", party_id)
+            _finvoice_sub(party, eb + "Role", role)
+        _finvoice_sub(message_header, eb + "CPAId", "yoursandmycpa")
+        _finvoice_sub(message_header, eb + "ConversationId", message_id)
+        _finvoice_sub(message_header, eb + "Service", "Routing")
+        _finvoice_sub(message_header, eb + "Action", "ProcessInvoice")
+        message_data = etree.SubElement(message_header, eb + "MessageData")
+        _finvoice_sub(message_data, eb + "MessageId", message_id)
+        _finvoice_sub(message_data, eb + "Timestamp", message_timestamp)
+        etree.SubElement(message_data, eb + "RefToMessageId")
+
+        body = etree.SubElement(envelope, soap + "Body")
+        manifest = etree.SubElement(
+            body, eb + "Manifest", {eb + "id": "Manifest", eb + "version": "2.0"}
+        )
+        reference = etree.SubElement(
+            manifest,
+            eb + "Reference",
+            {eb + "id": "Finvoice", "{%s}href" % XLINK_NS: message_id},
+        )
+        etree.SubElement(
+            reference,
+            eb + "Schema",
             {
-                "name": xml_name,
-                "raw": xml_string,
-                "mimetype": "application/xml",
-                "res_model": "account.move",
-            }
+                eb + "location": "http://www.finvoice.info/finvoice.xsd",
+                eb + "version": "3.0",
+            },
+        )
+
+        return envelope
+
+    def _export_finvoice_transmission(self, invoices, batch_size=PREFETCH_MAX):
+        """
+        Export invoices into a single Finvoice transmission file, where each
+        Finvoice is preceded by its SOAP envelope.
+
+        The file is written incrementally to a temporary file, so any
+        number of invoices can be exported. Returns the attachment
+        """
+        self.ensure_one()
+
+        declaration = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        message_timestamp = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+        with tempfile.TemporaryFile() as transmission_file:
+            for invoice_ids in split_every(batch_size, invoices.ids):
+                chunk = invoices.browse(invoice_ids)
+                self._finvoice_prefetch_export_data(chunk)
+
+                for invoice in chunk:
+                    envelope = self._finvoice_build_soap_envelope(
+                        invoice, message_timestamp
+                    )
+                    transmission_file.write(declaration)
+                    transmission_file.write(etree.tostring(envelope, encoding="UTF-8"))
+                    transmission_file.write(b"\n")
+                    transmission_file.write(declaration)
+                    if self._finvoice_use_stream_export(
+                        invoice
+                    ) and not self._finvoice_get_unchanged_attachment(invoice):
+                        self._finvoice_write(invoice, transmission_file)
+                    else:
+                        xml_content = self._edi_content_invoice_edi_finvoice(invoice)
+                        if isinstance(xml_content, str):
+                            xml_content = xml_content.encode("UTF-8")
+                        transmission_file.write(xml_content)
+                    transmission_file.write(b"\n")
+
+                # Free the memory used by the chunk
+                chunk.invoice_line_ids.invalidate_recordset()
+                chunk.invalidate_recordset()
+
+            transmission_name = "%s%s.xml" % (
+                FINVOICE_TRANSMISSION_PREFIX,
+                datetime.now().strftime("%Y%m%d_%H%M%S"),
+            )
+            return self._finvoice_create_attachment_from_file(
+                transmission_file,
+                {
+                    "name": transmission_name,
+                    "mimetype": "application/xml",
+                    "res_model": self._name,
+                    "res_id": self.id,
+                },
+            )
+
+    @api.autovacuum
+    def _gc_finvoice_transmissions(self):
+        """Remove downloaded transmission files"""
+        self.env["ir.attachment"].sudo().search(
+            [
+                ("res_model", "=", self._name),
+                ("name", "=like", f"{FINVOICE_TRANSMISSION_PREFIX}%"),
+                (
+                    "create_date",
+                    "<",
+                    fields.Datetime.now() - FINVOICE_TRANSMISSION_MAX_AGE,
+                ),
+            ]
+        ).unlink()
+
+    def _finvoice_create_attachment_from_file(self, file_obj, values):
+        """
+        Create an attachment from the content of a file object, without
+        reading the whole content into memory when the filestore is used
+        """
+        attachment_model = self.env["ir.attachment"]
+        file_obj.seek(0)
+
+        if attachment_model._storage() != "file":
+            return attachment_model.create(dict(values, raw=file_obj.read()))
+
+        checksum = hashlib.sha1()
+        file_size = 0
+        for block in iter(lambda: file_obj.read(1024 * 1024), b""):
+            checksum.update(block)
+            file_size += len(block)
+        checksum = checksum.hexdigest()
+
+        # Same layout as ir.attachment._get_path()
+        store_fname = checksum[:2] + "/" + checksum
+        full_path = attachment_model._full_path(store_fname)
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            file_obj.seek(0)
+            with open(full_path, "wb") as store_file:
+                shutil.copyfileobj(file_obj, store_file)
+            # The file is removed if the transaction is rolled back
+            attachment_model._mark_for_gc(store_fname)
+
+        # create() ignores the storage fields, so they are set afterwards.
+        # The record references the file from then on, so the filestore
+        # garbage collection only removes it if the transaction fails
+        attachment = attachment_model.create(values)
+        attachment.flush_recordset()
+        self.env.cr.execute(
+            """
+            UPDATE ir_attachment
+               SET store_fname = %s, checksum = %s, file_size = %s, db_datas = NULL
+             WHERE id = %s
+            """,
+            [store_fname, checksum, file_size, attachment.id],
+        )
+        attachment.invalidate_recordset(
+            ["store_fname", "checksum", "file_size", "db_datas", "raw", "datas"]
         )
+        return attachment
 
     def _is_compatible_with_journal(self, journal):
         self.ensure_one()
@@ -165,43 +1341,159 @@ class AccountEdiFormat(models.Model):
             return res
         return journal.type == "sale"
 
+    @api.model
+    def _finvoice_get_xml_schema_path(self, version="3.0"):
+        return tools.file_path(
+            f"account_edi_finvoice/static/schema/Finvoice{version}.xsd"
+        )
+
     def _finvoice_get_xml_schema(self, version="3.0"):
-        xsd_file = f"account_edi_finvoice/static/schema/Finvoice{version}.xsd"
-        xsd_etree_obj = etree.parse(tools.file_open(xsd_file))
-        finvoice_schema = etree.XMLSchema(xsd_etree_obj)
+        xsd_file = self._finvoice_get_xml_schema_path(version)
+        xsd_mtime = os.path.getmtime(xsd_file)
+
+        with _finvoice_schema_cache_lock:
+            cached = _finvoice_schema_cache.get(version)
+            if cached and cached[0] == xsd_mtime:
+                _finvoice_schema_cache_stats["hits"] += 1
+                return cached[1]
+
+            _finvoice_schema_cache_stats["misses"] += 1
+            with finvoice_phase("schema_compile"):
+                with tools.file_open(xsd_file, "rb") as xsd:
+                    xsd_etree_obj = etree.parse(xsd)
+                finvoice_schema = etree.XMLSchema(xsd_etree_obj)
+            _finvoice_schema_cache[version] = (xsd_mtime, finvoice_schema)
 
         return finvoice_schema
 
     @api.model
-    def _finvoice_check_xml_schema(self, xml, version="3.0"):
-        """Validate the XML file against the XSD"""
+    def _finvoice_get_xml_schema_cache_info(self):
+        """
+        Get the compiled schema cache statistics for this worker
+        """
+        with _finvoice_schema_cache_lock:
+            return {
+                "hits": _finvoice_schema_cache_stats["hits"],
+                "misses": _finvoice_schema_cache_stats["misses"],
+                "versions": sorted(_finvoice_schema_cache),
+            }
+
+    @api.model
+    def _finvoice_clear_xml_schema_cache(self):
+        with _finvoice_schema_cache_lock:
+            _finvoice_schema_cache.clear()
+            _finvoice_schema_cache_stats.update(hits=0, misses=0)
+
+    @api.model
+    def _finvoice_get_edi_format(self):
+        if self.code == "finvoice_3_0":
+            return self
+        return self.env.ref(
+            "account_edi_finvoice.edi_finvoice_3_0", raise_if_not_found=False
+        )
+
+    @api.model
+    def _finvoice_get_schema_errors(self, xml, version="3.0"):
+        """
+        Validate the XML file against the XSD.
+        Returns the validation errors, or an empty list for a valid file
+        """
         finvoice_schema = self._finvoice_get_xml_schema(version)
 
-        if isinstance(xml, str):
-            t = etree.ElementTree(etree.fromstring(xml))
-        elif isinstance(xml, bytes):
-            t = etree.ElementTree(etree.fromstring(xml.decode("UTF-8")))
-        else:
-            t = xml
+        if hasattr(xml, "read"):
+            return self._finvoice_get_file_schema_errors(xml, finvoice_schema)
+
+        with finvoice_phase("schema_parse"):
+            if isinstance(xml, str):
+                t = etree.ElementTree(etree.fromstring(xml))
+            elif isinstance(xml, bytes):
+                t = etree.ElementTree(etree.fromstring(xml))
+            else:
+                t = xml
 
         try:
-            finvoice_schema.assertValid(t)
+            with finvoice_phase("schema_validation"):
+                finvoice_schema.assertValid(t)
         except etree.DocumentInvalid as e:
-            # if the validation of the XSD fails, we arrive here
-            _logger.warning("The XML file is invalid against the XML Schema Definition")
-            _logger.warning(xml)
-            _logger.warning(e)
-
-            msg = _(
-                "The Finvoice XML file is not valid against the official "
-                "XML Schema Definition. The XML file and the "
-                "full error have been written in the server logs. "
-                "Here is the error, which may give you an idea on the "
-                "cause of the problem : {}.".format(e)
-            )
+            return list(e.error_log)
+        return []
 
-            _logger.error(msg)
-        return True
+    @api.model
+    def _finvoice_get_file_schema_errors(self, file_obj, finvoice_schema):
+        """
+        Validate an XML file object while parsing it.
+        Parsed elements are dropped right away, so the tree is never
+        held in memory as a whole
+        """
+        file_obj.seek(0)
+        try:
+            with finvoice_phase("schema_validation"):
+                for _event, element in etree.iterparse(
+                    file_obj, events=("end",), schema=finvoice_schema
+                ):
+                    element.clear(keep_tail=True)
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+        except etree.XMLSyntaxError as e:
+            return list(e.error_log)
+        return []
+
+    @api.model
+    def _finvoice_format_schema_errors(self, errors, max_errors=10):
+        lines = [
+            self._finvoice_format_schema_error(error) for error in errors[:max_errors]
+        ]
+        if len(errors) > max_errors:
+            lines.append(f"... and {len(errors) - max_errors} more errors")
+        return "\n".join(lines)
+
+    def _finvoice_format_schema_error(self, error):
+        # Trees built with lxml, streamed exports and incrementally parsed
+        # documents have no line numbers. The element path locates the error
+        if error.line:
+            return f"Line {error.line}: {error.message}"
+        if error.path:
+            return f"{error.path}: {error.message}"
+        return error.message
+
+    @api.model
+    def _finvoice_check_xml_schema(self, xml, version="3.0", deferrable=False):
+        """
+        Validate the XML file against the XSD, following the validation
+        policy of the Finvoice EDI format
+
+        :param deferrable: True if the validation can be left to the
+            background validation of EDI documents
+        :return: False if the file is invalid, otherwise True
+        """
+        edi_format = self._finvoice_get_edi_format()
+        policy = edi_format.finvoice_validation_policy or "sync"
+
+        if policy == "off" or (policy == "async" and deferrable):
+            return True
+        if (
+            policy == "sampled"
+            and random.random() * 100 >= edi_format.finvoice_validation_sample_rate
+        ):
+            return True
+
+        errors = self._finvoice_get_schema_errors(xml, version)
+        if not errors:
+            return True
+
+        # if the validation of the XSD fails, we arrive here
+        msg = _(
+            "The Finvoice XML file is not valid against the official "
+            "XML Schema Definition:\n%s",
+            self._finvoice_format_schema_errors(
+                errors, edi_format.finvoice_validation_max_errors
+            ),
+        )
+        if policy == "strict":
+            raise UserError(msg)
+
+        _logger.warning(msg)
+        return False
 
     def _create_invoice_from_xml_tree(self, filename, tree, journal=None):
         self.ensure_one()
@@ -211,27 +1503,40 @@ class AccountEdiFormat(models.Model):
             company_id = ctx.get("allowed_company_ids")[0]
 
         if self._is_finvoice(filename, tree):
-            return self._import_finvoice(
-                tree, self.env["account.move"], company_id=company_id
+            move_model = self.env["account.move"]
+            duplicate_keys = move_model._finvoice_get_duplicate_keys(tree)
+            duplicate = move_model._finvoice_find_duplicate(duplicate_keys, company_id)
+            if duplicate:
+                return duplicate
+
+            type_code = tree.findtext("./InvoiceDetails/InvoiceTypeCode")
+            move_values = {"move_type": self._get_invoice_type(type_code)}
+            if journal:
+                move_values["journal_id"] = journal.id
+            move = move_model.with_company(company_id).create(move_values)
+
+            return move_model._import_finvoice(
+                tree, move, company_id=company_id, duplicate_keys=duplicate_keys
             )
         return super()._create_invoice_from_xml_tree(filename, tree, journal)
 
     def _update_invoice_from_xml_tree(self, filename, tree, invoice):
         self.ensure_one()
         if self._is_finvoice(filename, tree):
-            return self._import_finvoice(tree, invoice)
+            return invoice._import_finvoice(tree, invoice)
         return super()._update_invoice_from_xml_tree(filename, tree, invoice)
 
+    def _is_finvoice(self, filename, tree):
+        return self.env["account.move"]._is_finvoice(tree)
+
     def _find_attribute(self, xpath, element, attribute):
-        element = element.xpath(xpath, namespaces=element.nsmap)
-        return element[0].attrib.get(attribute) if element else None
+        return find_attribute(xpath, element, attribute)
 
     def _find_values_joined(self, xpath, element, join_character="\n"):
         """
         Get a joined string from multiple values
         """
-        elements = element.xpath(xpath, namespaces=element.nsmap)
-        return join_character.join(x.text for x in elements)
+        return find_texts_joined(xpath, element, join_character)
 
     def _get_invoice_type(self, inv_type_code):
         """
@@ -254,32 +1559,27 @@ class AccountEdiFormat(models.Model):
 
         return inv_type
 
+    @api.model
+    def _finvoice_get_uom_mapping(self):
+        """
+        Get the Finvoice unit code to uom.uom mapping, as {code: uom id}
+        """
+        mapping = {}
+        for code, xmlid in FINVOICE_UOM_CODES.items():
+            uom = self.env.ref(xmlid, raise_if_not_found=False)
+            if uom:
+                mapping[code] = uom.id
+        return mapping
+
     def _to_float(self, string_number):
         # Format a '1 234,56' string as float 1234.56
-
-        float_number = 0
-
         if isinstance(string_number, float):
-            float_number = string_number
-        elif isinstance(string_number, int):
-            float_number = float(string_number)
-        elif isinstance(string_number, str):
-            if "." in string_number and "," in string_number:
-                # TODO: Add support for comma as thousands separator (1,000.00)
-                msg = _(
-                    f"Using comma as thousands separator not supported! ({string_number})"
-                )
-                raise UserError(msg)
+            return string_number
 
-            # Replace comma with period
-            string_number = string_number.replace(",", ".")
-
-            # Replace non-numeric
-            string_number = re.sub(r"[^\d.-]", "", string_number)
-
-            float_number = float(string_number)
-
-        return float_number
+        try:
+            return float(parse_amount(string_number))
+        except ValueError as e:
+            raise UserError(_("Invalid number in Finvoice: %s", string_number)) from e
 
     def _retrieve_bank_account(
         self, account_number, partner_id, bic=False, company_id=False
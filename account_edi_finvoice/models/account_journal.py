@@ -0,0 +1,39 @@
+from odoo import models
+
+
+class AccountJournal(models.Model):
+    _inherit = "account.journal"
+
+    def _create_document_from_attachment(self, attachment_ids):
+        attachments = self.env["ir.attachment"].browse(attachment_ids)
+        finvoices = attachments.filtered(
+            lambda attachment: attachment._finvoice_sniff()
+        )
+        if not finvoices:
+            return super()._create_document_from_attachment(attachment_ids)
+
+        invoices = self.env["account.move"]
+        others = attachments - finvoices
+        if others:
+            invoices |= super()._create_document_from_attachment(others.ids)
+
+        # Finvoice files are imported without creating a draft first, so an
+        # already imported file doesn't leave an empty draft behind
+        journal = self._finvoice_get_import_journal()
+        for attachment in finvoices:
+            invoices |= invoices._import_finvoice_attachment(attachment, journal)
+        return invoices
+
+    def _finvoice_get_import_journal(self):
+        """
+        Journal of the vendor bills imported from Finvoice files
+        """
+        if self:
+            return self
+        return self.search(
+            [
+                *self._check_company_domain(self.env.company),
+                ("type", "=", "purchase"),
+            ],
+            limit=1,
+        )
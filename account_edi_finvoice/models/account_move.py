@@ -1,57 +1,594 @@
+import hashlib
+import io
 import logging
+import os
 import re
 from datetime import datetime
 
-from odoo import _, api, models, tools
+from lxml import etree
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
 
+from .import_cache import FinvoiceImportCache
+
+from ..tools.amount import round_amount
+from ..tools.batch_import import check_finvoice_files
+from ..tools.extract import extract_epi_details, extract_header, find_text
+from ..tools.rows import parse_rows
+from ..tools.sniff import iter_finvoices, open_finvoice, sniff_finvoice
+from ..tools.timing import finvoice_phase, finvoice_timer
+
 _logger = logging.getLogger(__name__)
 
+# Number of invoice rows imported at once when streaming a document
+FINVOICE_STREAM_CHUNK_SIZE = 1000
+
+# Finvoice files from this size up are imported by streaming
+FINVOICE_STREAM_MIN_SIZE = 5 * 1024 * 1024
+
 
 class AccountMove(models.Model):
     _inherit = "account.move"
 
-    def _get_edi_decoder(self, file_data, new=False):
-        if file_data["type"] == "xml":
-            if self._is_finvoice(file_data["xml_tree"]):
-                self._import_finvoice(file_data["xml_tree"], self)
+    finvoice_content_hash = fields.Char(
+        string="Finvoice content hash",
+        help="SHA-256 of the normalized content of the imported Finvoice",
+        index=True,
+        copy=False,
+        readonly=True,
+    )
+    finvoice_document_key = fields.Char(
+        string="Finvoice document key",
+        help="Seller business code and invoice number of the imported Finvoice",
+        index=True,
+        copy=False,
+        readonly=True,
+    )
+
+    def _post(self, soft=True):
+        posted = super()._post(soft=soft)
+
+        edi_format = self.env["account.edi.format"]._finvoice_get_edi_format()
+        if edi_format and edi_format._finvoice_use_sharded_export():
+            documents = posted.edi_document_ids.filtered(
+                lambda d: d.edi_format_id == edi_format and d.state == "to_send"
+            )
+            if documents:
+                edi_format._finvoice_trigger_export()
+        return posted
 
+    def _get_edi_decoder(self, file_data, new=False):
+        if file_data["type"] == "finvoice":
+            # Detected by ir.attachment without parsing the document
+            return self._finvoice_decode
+        if file_data["type"] == "xml" and self._is_finvoice(file_data["xml_tree"]):
+            return self._finvoice_decode
         return super()._get_edi_decoder(file_data, new=new)
 
+    def _finvoice_decode(self, invoice, file_data, new=False):
+        """
+        Import a Finvoice file of an attachment into the invoice.
+        Returns whether the file was imported
+        """
+        if file_data["type"] == "finvoice":
+            content = file_data["content"]
+            sniff = file_data["finvoice"]
+            if sniff.soap:
+                count = len(list(iter_finvoices(content)))
+                if count > 1:
+                    raise UserError(
+                        _(
+                            "The transmission file contains %s Finvoice "
+                            "documents. Upload it to a purchase journal to "
+                            "import a bill for each of them.",
+                            count,
+                        )
+                    )
+            imported = invoice._import_finvoice_content(content, sniff)
+        else:
+            imported = self._import_finvoice(file_data["xml_tree"], invoice)
+
+        if imported != invoice:
+            invoice.message_post(
+                body=_(
+                    "This Finvoice document has already been imported: %s",
+                    imported._get_html_link(),
+                )
+            )
+            return False
+        return True
+
+    def _import_finvoice_content(self, content, sniff=None):
+        """
+        Import a Finvoice file into this invoice.
+        Big files are streamed instead of parsed as a whole
+
+        :param content: file content as bytes, or a memory map of the file
+        :param sniff: FinvoiceSniff of the Finvoice to import. Defaults to
+            the first Finvoice of the content
+        """
+        sniff = sniff or sniff_finvoice(content)
+        if not sniff:
+            raise UserError(_("The file is not a Finvoice document."))
+
+        if sniff.end - sniff.start >= FINVOICE_STREAM_MIN_SIZE:
+            with open_finvoice(content, sniff) as source:
+                return self._import_finvoice_stream(source, self)
+
+        with finvoice_phase("parse"):
+            tree = etree.fromstring(content[sniff.start : sniff.end])
+        return self._import_finvoice(tree, self)
+
+    @api.model
+    def _import_finvoice_attachment(self, attachment, journal):
+        """
+        Import a Finvoice attachment as vendor bills: one bill, or one for
+        each Finvoice of a transmission file.
+        Documents imported already return the existing invoices, and no
+        bill is left behind for them
+        """
+        # Mapped from the filestore, so a big file is not read at once
+        with attachment._finvoice_open_content() as content:
+            sniffs = list(iter_finvoices(content))
+            if not sniffs:
+                raise UserError(_("The file is not a Finvoice document."))
+
+            invoices = self.browse()
+            stem = os.path.splitext(attachment.name)[0]
+            for index, sniff in enumerate(sniffs, start=1):
+                invoice = self.create(
+                    {"journal_id": journal.id, "move_type": "in_invoice"}
+                )
+                imported = invoice._import_finvoice_content(content, sniff)
+                invoices |= imported
+                if imported != invoice:
+                    invoice.unlink()
+                    imported.message_post(
+                        body=_(
+                            "The Finvoice document %s was uploaded again.",
+                            attachment.name,
+                        )
+                    )
+                    continue
+
+                if len(sniffs) == 1:
+                    bill_attachment = attachment
+                    bill_attachment.write(
+                        {"res_model": self._name, "res_id": invoice.id}
+                    )
+                else:
+                    # Each bill of a transmission file gets its own Finvoice
+                    bill_attachment = attachment.create(
+                        {
+                            "name": f"{stem}_{index}.xml",
+                            "raw": content[sniff.start : sniff.end],
+                            "mimetype": "application/xml",
+                            "res_model": self._name,
+                            "res_id": invoice.id,
+                        }
+                    )
+                invoice.with_context(
+                    account_predictive_bills_disable_prediction=True,
+                    no_new_invoice=True,
+                ).message_post(attachment_ids=bill_attachment.ids)
+        return invoices
+
+    def action_export_finvoice_transmission(self):
+        """
+        Download the selected invoices as a Finvoice transmission file
+        """
+        edi_format = self.env.ref("account_edi_finvoice.edi_finvoice_3_0")
+        invoices = self.filtered(lambda move: move.is_sale_document())
+        not_posted = invoices.filtered(lambda move: move.state != "posted")
+        if not_posted:
+            raise UserError(
+                _(
+                    "Only posted invoices can be exported. Post or deselect: %s",
+                    ", ".join(not_posted.mapped("display_name")),
+                )
+            )
+        if not invoices:
+            raise UserError(_("Select at least one customer invoice to export."))
+
+        attachment = edi_format._export_finvoice_transmission(invoices)
+        return {
+            "type": "ir.actions.act_url",
+            "url": f"/web/content/{attachment.id}?download=true",
+            "target": "self",
+        }
+
     def _is_finvoice(self, tree):
         return tree.tag == "Finvoice"
 
-    # flake8: noqa: C901
-    def _import_finvoice(self, tree, invoice, company_id=False):
+    def _finvoice_get_duplicate_keys(self, tree, with_content_hash=True):
+        """
+        Get the values identifying an imported Finvoice document
+        """
+        business_code = find_text("./SellerPartyDetails/SellerPartyIdentifier", tree)
+        invoice_number = find_text("./InvoiceDetails/InvoiceNumber", tree)
+
+        document_key = False
+        if business_code and invoice_number:
+            business_code = business_code.replace(" ", "")
+            document_key = f"{business_code}/{invoice_number.strip()}"
+
+        content_hash = False
+        if with_content_hash:
+            # Canonical form ignores formatting, attribute order and comments
+            content = etree.tostring(
+                tree, method="c14n2", strip_text=True, with_comments=False
+            )
+            content_hash = hashlib.sha256(content).hexdigest()
+
+        return {
+            "finvoice_content_hash": content_hash,
+            "finvoice_document_key": document_key,
+        }
+
+    @api.model
+    def _finvoice_find_duplicate(self, duplicate_keys, company_id=False):
+        """
+        Find an already imported invoice with the same content or
+        the same seller and invoice number
+        """
+        domain = [
+            (field, "=", value) for field, value in duplicate_keys.items() if value
+        ]
+        if not domain:
+            return self.browse()
+
+        domain = ["|"] * (len(domain) - 1) + domain
+        domain += [
+            ("company_id", "=", company_id or self.env.company.id),
+            ("state", "!=", "cancel"),
+        ]
+        return self.search(domain, limit=1)
+
+    def _import_finvoice(
+        self,
+        tree,
+        invoice,
+        company_id=False,
+        import_cache=None,
+        check_schema=True,
+        duplicate_keys=None,
+        rows=None,
+    ):
+        """
+        Import finvoice document as Odoo invoice.
+        If the document has already been imported, returns the existing invoice
+
+        :param import_cache: FinvoiceImportCache to share lookups between
+            the documents of an import batch
+        :param check_schema: False if the document is already validated
+        :param duplicate_keys: keys of the document, if it has already been
+            checked not to be a duplicate
+        :param rows: FinvoiceImportRows of the document, if already parsed
+        """
+        edi_format = self.env["account.edi.format"]
+
+        with finvoice_timer(self.env.cr, "import"):
+            if duplicate_keys is None:
+                with finvoice_phase("duplicate_check"):
+                    duplicate_keys = self._finvoice_get_duplicate_keys(tree)
+                    duplicate = self._finvoice_find_duplicate(
+                        duplicate_keys, company_id
+                    )
+                if duplicate and duplicate != invoice:
+                    _logger.info("Finvoice already imported as %s", duplicate.name)
+                    return duplicate
+
+            if check_schema:
+                # Check XML schema to avoid headaches trying to import invalid files
+                edi_format._finvoice_check_xml_schema(tree)
+
+            invoice, invoice_type, import_cache = self._import_finvoice_header(
+                tree, invoice, company_id=company_id, import_cache=import_cache
+            )
+
+            lines = [] if rows is not None else tree.iterfind("InvoiceRow")
+            self._import_finvoice_rows(
+                lines, invoice, invoice_type, import_cache, rows=rows
+            )
+
+            self._import_finvoice_epi_details(tree, invoice, import_cache)
+            invoice.write(duplicate_keys)
+
+            return invoice
+
+    @api.model
+    def _import_finvoice_batch(
+        self, sources, journal=None, company_id=False, max_workers=None
+    ):
         """
-        Import finvoice document as Odoo invoice
+        Import a batch of Finvoice files
+
+        The files are parsed and validated in a pool of worker processes,
+        if configured, a chunk at a time. The invoices are then created one
+        file at a time, each in its own savepoint, so a failing file doesn't
+        roll back the others. Files are read only when they are checked.
+
+        :param sources: ir.attachment records, a list of file paths,
+            or a path of a directory containing the files
+        :param max_workers: number of worker processes, defaults to the
+            import processes of the Finvoice EDI format
+        :return: list of dicts with name, status (done, duplicate, invalid
+            or failed), move and message. One dict per file, in the order
+            of sources
         """
+        if isinstance(sources, str):
+            directory = sources
+            sources = sorted(
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.lower().endswith(".xml")
+            )
+
+        if isinstance(sources, models.BaseModel):
+            attachments = sources
+            names = attachments.mapped("name")
+            contents = [
+                attachment._finvoice_get_import_source() for attachment in attachments
+            ]
+        else:
+            attachments = [None] * len(sources)
+            names = [os.path.basename(path) for path in sources]
+            contents = list(sources)
+
+        if not company_id:
+            company_id = self.env.company.id
 
         edi_format = self.env["account.edi.format"]
-        edi_common = self.env["account.edi.common"]
+        if max_workers is None:
+            max_workers = edi_format._finvoice_get_edi_format().finvoice_import_workers
+        xsd_path = edi_format._finvoice_get_xml_schema_path()
+        # The workers also parse the invoice rows, leaving only the mapping to
+        # invoice lines to this process
+        checks = check_finvoice_files(
+            contents, xsd_path, max_workers=max_workers, parse_rows=True
+        )
 
-        def _find_value(xpath, element=tree):
-            return edi_common._find_value(xpath, element, element.nsmap)
+        # Lookups are shared by all the files
+        import_cache = FinvoiceImportCache(self.env, company_id)
+
+        results = []
+        for name, content, attachment, check in zip(
+            names, contents, attachments, checks
+        ):
+            result = {
+                "name": name,
+                "status": "invalid",
+                "move": self.env["account.move"],
+                "message": "\n".join(check["errors"]),
+            }
+            results.append(result)
+
+            if not check["finvoice"] or not check["valid"]:
+                _logger.info("Skipping invalid Finvoice file %s", name)
+                continue
 
-        ns = tree.nsmap
+            try:
+                with self.env.cr.savepoint(), finvoice_timer(
+                    self.env.cr, "import", file=name
+                ):
+                    move, duplicate = self._import_finvoice_file(
+                        content,
+                        name,
+                        check["type_code"],
+                        journal=journal,
+                        company_id=company_id,
+                        import_cache=import_cache,
+                        attachment=attachment,
+                        rows=check["rows"],
+                    )
+            except Exception as e:
+                _logger.warning("Could not import Finvoice file %s: %s", name, e)
+                result.update(status="failed", message=str(e))
+                import_cache.reset_partners()
+            else:
+                status = "duplicate" if duplicate else "done"
+                result.update(status=status, move=move, message="")
 
-        # Check XML schema to avoid headaches trying to import invalid files
-        edi_format._finvoice_check_xml_schema(tree)
+        _logger.info(
+            "Imported %s of %s Finvoice files",
+            len([result for result in results if result["status"] == "done"]),
+            len(results),
+        )
+        return results
+
+    def _import_finvoice_file(
+        self,
+        content,
+        name,
+        type_code,
+        journal=None,
+        company_id=False,
+        import_cache=None,
+        attachment=None,
+        rows=None,
+    ):
+        """
+        Create an invoice from an already validated Finvoice file
 
-        invoice_type = edi_format._get_invoice_type(
-            _find_value("./InvoiceDetails/InvoiceTypeCode")
+        :param content: file content as bytes, or a file path
+        :param rows: FinvoiceImportRows of the file, if already parsed
+        :return: the invoice, and whether it was imported already before
+        """
+        if not isinstance(content, bytes):
+            with open(content, "rb") as xml_file:
+                content = xml_file.read()
+
+        with finvoice_phase("parse"):
+            tree = etree.fromstring(content)
+        with finvoice_phase("duplicate_check"):
+            duplicate_keys = self._finvoice_get_duplicate_keys(tree)
+            duplicate = self._finvoice_find_duplicate(duplicate_keys, company_id)
+        if duplicate:
+            return duplicate, True
+
+        move_type = self.env["account.edi.format"]._get_invoice_type(type_code)
+        move_values = {"move_type": move_type}
+        if journal:
+            move_values["journal_id"] = journal.id
+        move = self.with_company(company_id).create(move_values)
+
+        move = self._import_finvoice(
+            tree,
+            move,
+            company_id=company_id,
+            import_cache=import_cache,
+            check_schema=False,
+            duplicate_keys=duplicate_keys,
+            rows=rows,
         )
+
+        if attachment:
+            attachment.write({"res_model": "account.move", "res_id": move.id})
+        else:
+            self.env["ir.attachment"].create(
+                {
+                    "name": name,
+                    "raw": content,
+                    "mimetype": "application/xml",
+                    "res_model": "account.move",
+                    "res_id": move.id,
+                }
+            )
+
+        return move, False
+
+    def _import_finvoice_stream(
+        self,
+        source,
+        invoice,
+        company_id=False,
+        import_cache=None,
+        chunk_size=FINVOICE_STREAM_CHUNK_SIZE,
+    ):
+        """
+        Import finvoice document as Odoo invoice without loading the whole
+        document into memory.
+
+        The document is validated against the schema while it's parsed.
+        Unlike with _import_finvoice, an invalid document raises an error.
+        Invoice rows are imported in chunks and freed right after, so the
+        memory use doesn't grow with the number of rows.
+
+        Duplicates are detected by the seller and invoice number only.
+
+        :param source: a file name or a file-like object opened in binary mode
+        """
+        with finvoice_timer(self.env.cr, "import"):
+            header = None
+            rows = []
+            duplicate_keys = {}
+            root = None
+
+            for element in self._finvoice_iterparse(source):
+                root = element.getparent()
+
+                if element.tag == "InvoiceDetails":
+                    # Seller and invoice details are known now (seller comes first)
+                    duplicate_keys = self._finvoice_get_duplicate_keys(
+                        root, with_content_hash=False
+                    )
+                    duplicate = self._finvoice_find_duplicate(
+                        duplicate_keys, company_id
+                    )
+                    if duplicate and duplicate != invoice:
+                        _logger.info("Finvoice already imported as %s", duplicate.name)
+                        return duplicate
+
+                if element.tag != "InvoiceRow":
+                    # Header and footer sections are small, keep them in the tree
+                    continue
+
+                if not header:
+                    # The header sections come before the rows
+                    header = self._import_finvoice_header(
+                        root, invoice, company_id=company_id, import_cache=import_cache
+                    )
+
+                rows.append(element)
+                if len(rows) >= chunk_size:
+                    self._import_finvoice_rows(rows, *header)
+                    self._finvoice_free_elements(rows)
+                    rows = []
+
+            if root is None:
+                raise UserError(_("The Finvoice XML file is empty or truncated."))
+
+            if not header:
+                header = self._import_finvoice_header(
+                    root, invoice, company_id=company_id, import_cache=import_cache
+                )
+            invoice, invoice_type, import_cache = header
+
+            self._import_finvoice_rows(rows, invoice, invoice_type, import_cache)
+            self._finvoice_free_elements(rows)
+
+            self._import_finvoice_epi_details(root, invoice, import_cache)
+            if duplicate_keys:
+                invoice.write(duplicate_keys)
+
+            return invoice
+
+    def _finvoice_iterparse(self, source):
+        """
+        Parse a finvoice document incrementally, validating it against the
+        schema. Yields the top level elements as soon as they are parsed
+        """
+        edi_format = self.env["account.edi.format"]
+        schema = edi_format._finvoice_get_xml_schema()
+
+        root = None
+        try:
+            for _event, element in etree.iterparse(
+                source, events=("end",), schema=schema
+            ):
+                if root is None:
+                    root = element.getroottree().getroot()
+                if element.getparent() is root:
+                    yield element
+        except etree.XMLSyntaxError as e:
+            _logger.warning("The Finvoice XML file could not be imported: %s", e)
+            raise UserError(
+                _(
+                    "The Finvoice XML file is not valid against the official "
+                    "XML Schema Definition: %s",
+                    e,
+                )
+            ) from e
+
+    def _finvoice_free_elements(self, elements):
+        # Release processed elements of an incrementally parsed document
+        for element in elements:
+            element.clear()
+            element.getparent().remove(element)
+
+    def _import_finvoice_header(
+        self, tree, invoice, company_id=False, import_cache=None
+    ):
+        """
+        Import the seller and invoice details.
+        Returns the invoice, the invoice type and the import cache
+        """
+        edi_format = self.env["account.edi.format"]
+
+        header = extract_header(tree)
+        invoice_type = edi_format._get_invoice_type(header.invoice_type_code)
         if not company_id:
             company_id = self.env.company.id
         invoice = invoice.with_company(company_id).with_context(
             default_move_type=invoice_type
         )
+        if import_cache is None:
+            import_cache = FinvoiceImportCache(self.env, company_id)
 
         # region SellerPartyDetails
-        spd = "SellerPartyDetails"
-
-        business_code = _find_value(f"./{spd}/SellerPartyIdentifier")
-        vat = _find_value(f"./{spd}/SellerOrganisationTaxCode")
+        business_code = header.seller_party_identifier
+        vat = header.seller_organisation_tax_code
 
         # Hacks for insufficient/defective Finvoice XML
         business_code_regex = "^[0-9]{7}[-][0-9]$"
@@ -64,206 +601,226 @@ class AccountMove(models.Model):
             # Business Code is incorrectly given in VAT field (this happens)
             vat = "FI%s" % re.sub("[^0-9]", "", vat)
 
-        spad = "SellerPostalAddressDetails"
-
-        edi_common._import_retrieve_and_fill_partner(
-            invoice,
-            name=_find_value(f"./{spd}/SellerOrganisationName"),
-            phone=_find_value(f"./{spd}/SellerPhoneNumberIdentifier"),
-            mail=_find_value(f"./{spd}/SellerEmailaddressIdentifier"),
-            vat=vat,
-        )
+        with finvoice_phase("partner"):
+            import_cache.get_partner(
+                invoice,
+                name=header.seller_organisation_name,
+                phone=header.seller_phone_number,
+                mail=header.seller_email,
+                vat=vat,
+                business_code=business_code,
+            )
 
-        partner_vals = {
-            "company_registry": business_code,
-            "street": _find_value(f"./{spd}/{spad}/SellerStreetName"),
-            "city": _find_value(f"./{spd}/{spad}/SellerTownName"),
-            "zip": _find_value(f"./{spd}/{spad}/SellerPostCodeIdentifier"),
-        }
+            partner_vals = {
+                "company_registry": business_code,
+                "street": header.seller_street_name,
+                "city": header.seller_town_name,
+                "zip": header.seller_post_code,
+            }
 
-        invoice.partner_id.write(partner_vals)
+            import_cache.update_partner(invoice.partner_id, partner_vals)
         # endregion
 
         # region InvoiceDetails
-        ind = "InvoiceDetails"
-        invoice.ref = _find_value(f"./{ind}/SellerReferenceIdentifier") or _find_value(
-            f"./{ind}/InvoiceNumber"
-        )
+        invoice.ref = header.seller_reference_identifier or header.invoice_number
 
-        invoice_date = _find_value(f"./{ind}/InvoiceDate")
-        invoice.invoice_date = datetime.strptime(invoice_date, "%Y%m%d")
+        invoice.invoice_date = datetime.strptime(header.invoice_date, "%Y%m%d")
         if hasattr(invoice, "agreement_identifier"):
-            invoice.agreement_identifier = _find_value(f"./{ind}/AgreementIdentifier")
-
-        invoice.narration = edi_format._find_values_joined(
-            f"./{ind}/InvoiceFreeText",
-            tree,
-        )
+            invoice.agreement_identifier = header.agreement_identifier
 
-        ptd = "PaymentTermsDetails"
-        invoice.narration += edi_format._find_values_joined(
-            f"./{ind}/{ptd}/PaymentTermsFreeText", tree
-        )
+        invoice.narration = header.invoice_free_text
+        invoice.narration += header.payment_terms_free_text
 
-        invoice_date_due = _find_value(f"./{ind}/{ptd}/InvoiceDueDate")
-        invoice.invoice_date_due = datetime.strptime(invoice_date_due, "%Y%m%d")
+        invoice.invoice_date_due = datetime.strptime(header.invoice_due_date, "%Y%m%d")
 
         # endregion
 
-        # region InvoiceRows
-        lines = tree.xpath("./InvoiceRow", namespaces=ns)
-        line_number = 0
-        line_count = len(lines)
+        return invoice, invoice_type, import_cache
 
-        for line in lines:
-            line_number += 1
-            _logger.debug("Importing line {}/{}".format(line_number, line_count))
-            line_values = {"move_id": invoice.id}
+    def _import_finvoice_rows(
+        self, lines, invoice, invoice_type, import_cache, rows=None
+    ):
+        """
+        Import InvoiceRow elements as invoice lines
 
-            if _find_value("./BuyerArticleIdentifier", line):
-                default_code = _find_value("./BuyerArticleIdentifier", line)
-            else:
-                default_code = _find_value("./ArticleIdentifier", line)
-            article_name = _find_value("./ArticleName", line)
-            article_description = _find_value("./ArticleDescription", line)
-            ean_code = _find_value("./EanCode", line)
-
-            # Construct a unit price
-            quantity = (
-                edi_format._to_float(_find_value("./InvoicedQuantity", line)) or 1
+        :param rows: FinvoiceImportRows already parsed from the lines,
+            e.g. in a worker process
+        """
+        if rows is None:
+            with finvoice_phase("row_parsing"):
+                # The rows are read twice: for the products, then the lines
+                try:
+                    rows = list(parse_rows(lines))
+                except ValueError as e:
+                    raise UserError(
+                        _("The Finvoice XML file could not be imported: %s", e)
+                    ) from e
+
+        lines_values = self._import_finvoice_lines_values(
+            rows, invoice, invoice_type, import_cache
+        )
+
+        # Create all the lines at once, so totals and taxes are computed only once
+        with finvoice_phase("line_creation"):
+            invoice.invoice_line_ids.create(lines_values)
+            invoice.env.flush_all()
+        _logger.debug("Finvoice import cache: %s", import_cache.get_stats())
+
+    def _import_finvoice_lines_values(self, rows, invoice, invoice_type, import_cache):
+        """
+        Map parsed FinvoiceImportRows to invoice line values
+        """
+        # Resolve all the products of the rows with a few queries
+        with finvoice_phase("product_prefetch"):
+            import_cache.prefetch_products(
+                (row.default_code, row.article_name, row.ean_code)
+                for row in rows
+                if not row.note
             )
-            # Try to find UnitPriceAmount
-            price_unit = _find_value("./UnitPriceAmount", line)
 
-            if not price_unit or edi_format._to_float(price_unit) == 0:
-                # Didn't find UnitPriceAmount. Try RowVatExcludedAmount
-                price_subtotal = _find_value("./RowVatExcludedAmount", line)
-                price_subtotal = edi_format._to_float(price_subtotal)
-                if price_subtotal:
-                    price_unit = price_subtotal / quantity
+        line_count = len(rows)
+        lines_values = []
+        for line_number, row in enumerate(rows, start=1):
+            _logger.debug("Importing line {}/{}".format(line_number, line_count))
+            with finvoice_phase("row_values"):
+                if row.note:
+                    line_values = self._import_finvoice_note_values(row, invoice)
+                else:
+                    line_values = self._import_finvoice_row_values(
+                        row, invoice, invoice_type, import_cache
+                    )
+                lines_values.append(line_values)
+        return lines_values
+
+    def _import_finvoice_row_values(self, row, invoice, invoice_type, import_cache):
+        """
+        Get invoice line values for an InvoiceRow
 
-            if not price_unit:
-                price_unit = 0
+        :param row: FinvoiceImportRow parsed from the InvoiceRow element
+        """
+        line_values = {"move_id": invoice.id}
+
+        default_code = row.default_code
+        article_name = row.article_name
+        article_description = row.article_description
+        ean_code = row.ean_code
+
+        # Construct a unit price
+        quantity = row.quantity or 1
+        # Try to find UnitPriceAmount
+        price_unit = row.unit_price
+
+        if not price_unit:
+            # Didn't find UnitPriceAmount. Try RowVatExcludedAmount
+            price_subtotal = row.vat_excluded_amount
+            if price_subtotal:
+                price_subtotal = round_amount(
+                    price_subtotal, invoice.currency_id.decimal_places
+                )
+                price_unit = price_subtotal / quantity
 
-            if article_name:
-                _logger.debug("Importing '{}'".format(article_name))
+        if not price_unit:
+            price_unit = 0
 
-            if line_count > 200 and not price_unit:
-                # If invoice has more than 200 lines, skip zero lines to prevent a timeout
-                # This can be disabled (or limit raised) after line import is optimized
-                _logger.debug("Skipping a zero line due to a long invoice")
-                continue
+        if article_name:
+            _logger.debug("Importing '{}'".format(article_name))
 
-            # Try to find a product by default code, name or barcode
-            product_id = self.env["product.product"]._retrieve_product(
+        # Try to find a product by default code, name or barcode
+        with finvoice_phase("product_lookup"):
+            product_id = import_cache.get_product(
                 default_code=default_code,
                 name=article_name,
                 barcode=ean_code,
             )
-            # TODO: An option to auto-create products
+        # TODO: An option to auto-create products
 
-            if product_id:
-                line_values["product_id"] = product_id.id
+        if product_id:
+            line_values["product_id"] = product_id.id
 
-            if product_id:
-                accounts = product_id.product_tmpl_id._get_product_accounts()
+        if product_id:
+            accounts = import_cache.get_product_accounts(product_id)
 
-                if invoice_type == "in_invoice":
-                    line_values["account_id"] = accounts["expense"].id
-                elif invoice_type == "out_invoice":
-                    line_values["account_id"] = accounts["income"].id
+            if invoice_type == "in_invoice":
+                line_values["account_id"] = accounts["expense"].id
+            elif invoice_type == "out_invoice":
+                line_values["account_id"] = accounts["income"].id
 
-            # Construct a line name, if product is not found
-            line_name = ""
-            if not product_id:
-                if article_name:
-                    line_name += f"{article_name}"
-                if article_description:
-                    line_name += f"\n{article_description}"
+        # Construct a line name, if product is not found
+        line_name = ""
+        if not product_id:
+            if article_name:
+                line_name += f"{article_name}"
+            if article_description:
+                line_name += f"\n{article_description}"
 
-            line_name += "\n" + edi_format._find_values_joined("./RowFreeText", line)
-            line_values["name"] = line_name
+        line_name += "\n" + row.text
+        line_values["name"] = line_name
 
-            if not article_name and not default_code:
-                # Comment line
-                # TODO: comment lines not working yet
-                line_values["display_type"] = "line_note"
-                line_values["account_id"] = self.env["account.account"]
+        if not article_name and not default_code:
+            # Comment line
+            # TODO: comment lines not working yet
+            line_values["display_type"] = "line_note"
+            line_values["account_id"] = self.env["account.account"]
 
-            line_values["quantity"] = quantity
+        line_values["quantity"] = float(quantity)
 
-            unit_code = edi_format._find_attribute(
-                "./InvoicedQuantity", line, "QuantityUnitCode"
-            )
-            if product_id:
-                uom = self.env["uom.uom"].search(
-                    [("name", "ilike", unit_code)], limit=1
-                )
-                # TODO: an option to auto-create a missing UOM
-                if not uom:
-                    uom = self.env.ref("uom.product_uom_unit")
+        if product_id:
+            # TODO: an option to auto-create a missing UOM
+            with finvoice_phase("uom_lookup"):
+                uom = import_cache.get_uom(row.unit_code)
+            line_values["product_uom_id"] = uom.id
 
-                line_values["product_uom_id"] = uom.id
+        line_values["price_unit"] = float(price_unit)
 
-            line_values["price_unit"] = edi_format._to_float(price_unit)
+        line_values["discount"] = float(row.discount or 0)
 
-            line_values["discount"] = edi_format._to_float(
-                _find_value("./RowDiscountPercent", line)
-            )
+        # Taxes
+        # We are not using _retrieve_tax()
+        # as it might return a tax with prices included
+        tax_amount = float(row.vat_rate or 0)
+        if tax_amount:
+            with finvoice_phase("tax_lookup"):
+                tax = import_cache.get_tax(tax_amount, invoice.journal_id.type)
 
-            # Taxes
-            # We are not using _retrieve_tax()
-            # as it might return a tax with prices included
-            tax_amount = edi_format._to_float(_find_value("./RowVatRatePercent", line))
-            if tax_amount:
-                tax_domain = [
-                    ("amount", "=", tax_amount),
-                    ("type_tax_use", "=", invoice.journal_id.type),
-                    # The subtotal will be saved as untaxed amount
-                    ("price_include", "=", False),
-                    ("company_id", "=", company_id),
-                ]
-
-                tax = self.env["account.tax"].search(
-                    tax_domain, order="sequence ASC", limit=1
-                )
-
-                if not tax:
-                    raise ValidationError(_(f"Could not find a tax for {tax_amount}"))
+            if not tax:
+                raise ValidationError(_(f"Could not find a tax for {tax_amount}"))
 
-                line_values["tax_ids"] = tax
+            line_values["tax_ids"] = tax
 
-            invoice.invoice_line_ids.create(line_values)
+        return line_values
 
-            # TODO: handle SubInvoiceRows
-
-        # endregion
+    def _import_finvoice_note_values(self, row, invoice):
+        """
+        Get note line values for a note row: a SubInvoiceRow without
+        amounts, or itemizing an InvoiceRow with content of its own
+        """
+        return {
+            "move_id": invoice.id,
+            "display_type": "line_note",
+            "name": row.text,
+        }
 
+    def _import_finvoice_epi_details(self, tree, invoice, import_cache):
+        """
+        Import the payment reference and the bank account
+        """
         # region EpiDetails
-        ede = "EpiDetails"
-        payment_reference = invoice.payment_reference = _find_value(
-            f"./{ede}/EpiIdentificationDetails/EpiReference"
+        epi_details = extract_epi_details(tree)
+
+        # If there's no payment reference, try to get it from
+        # SellersBuyerIdentifier. It's not officially for a payment reference,
+        # but is sometimes incorrectly used as it was
+        invoice.payment_reference = (
+            epi_details.epi_reference or epi_details.sellers_buyer_identifier
         )
 
-        if not payment_reference:
-            # Try to get payment reference from SellersBuyerIdentifier
-            # It's not officially for a payment reference,
-            # but is sometimes incorrectly used as it was
-            payment_reference = invoice.payment_reference = _find_value(
-                f"./{ind}/SellersBuyerIdentifier"
+        with finvoice_phase("bank_account"):
+            partner_bank_id = import_cache.get_bank_account(
+                epi_details.epi_account_id,
+                partner_id=invoice.partner_id.id,
+                bic=epi_details.epi_bfi_identifier,
             )
 
-        invoice.payment_reference = payment_reference
-
-        epd = "EpiPartyDetails"
-
-        partner_bank_id = edi_format._retrieve_bank_account(
-            _find_value(f"./{ede}/{epd}/EpiBeneficiaryPartyDetails/EpiAccountID"),
-            partner_id=invoice.partner_id.id,
-            bic=_find_value(f"./{ede}/{epd}/EpiBfiPartyDetails/EpiBfiIdentifier"),
-            company_id=company_id,
-        )
-
         if partner_bank_id:
             invoice.partner_bank_id = partner_bank_id
         # endregion
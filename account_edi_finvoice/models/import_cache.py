@@ -0,0 +1,275 @@
+from collections import defaultdict
+
+from odoo.tools import float_round
+
+
+class FinvoiceImportCache:
+    """
+    Memoized lookups for the duration of a Finvoice import.
+
+    A single cache can be shared by all the documents of an import batch,
+    as long as they are imported for the same company.
+    """
+
+    def __init__(self, env, company_id):
+        self.env = env
+        self.company_id = company_id
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+        self._products = {}
+        self._products_by_barcode = {}
+        self._products_by_code = {}
+        self._products_by_name = {}
+        self._product_accounts = {}
+
+        self._taxes = None
+        self._uoms = None
+        self._uom_names = None
+
+        self._partners = {}
+        self._partner_values = {}
+        self._bank_accounts = {}
+
+    def _hit(self, kind):
+        self.stats[kind]["hits"] += 1
+
+    def _miss(self, kind):
+        self.stats[kind]["misses"] += 1
+
+    def get_stats(self):
+        return {kind: dict(counts) for kind, counts in self.stats.items()}
+
+    # region Products
+    def _product_domain(self, field, values):
+        return [
+            (field, "in", list(values)),
+            ("company_id", "in", [False, self.company_id]),
+        ]
+
+    def prefetch_products(self, articles):
+        """
+        Resolve products for all the articles of a document at once
+
+        :param articles: iterable of (default_code, name, barcode) tuples
+        """
+        barcodes = set()
+        codes = set()
+        names = set()
+        for default_code, name, barcode in articles:
+            if barcode and barcode not in self._products_by_barcode:
+                barcodes.add(barcode)
+            if default_code and default_code not in self._products_by_code:
+                codes.add(default_code)
+            if name and name not in self._products_by_name:
+                names.add(name)
+
+        product_model = self.env["product.product"]
+        for field, values, index in (
+            ("barcode", barcodes, self._products_by_barcode),
+            ("default_code", codes, self._products_by_code),
+            ("name", names, self._products_by_name),
+        ):
+            if not values:
+                continue
+            for product in product_model.search(self._product_domain(field, values)):
+                index.setdefault(product[field], product)
+            for value in values:
+                # Remember the values without a product, too
+                index.setdefault(value, product_model)
+
+    def get_product(self, default_code=None, name=None, barcode=None):
+        """
+        Get a product by barcode, default code or name, in that order
+        """
+        key = (default_code, name, barcode)
+        if key in self._products:
+            self._hit("product")
+            return self._products[key]
+
+        self._miss("product")
+        product = self.env["product.product"]
+        for value, index in (
+            (barcode, self._products_by_barcode),
+            (default_code, self._products_by_code),
+            (name, self._products_by_name),
+        ):
+            if value and index.get(value):
+                product = index[value]
+                break
+
+        if not product and any(key):
+            # Nothing found with exact values. Fall back to the fuzzy search
+            product = self.env["product.product"]._retrieve_product(
+                default_code=default_code,
+                name=name,
+                barcode=barcode,
+            )
+
+        self._products[key] = product
+        return product
+
+    def get_product_accounts(self, product):
+        template = product.product_tmpl_id
+        accounts = self._product_accounts.get(template.id)
+        if accounts is not None:
+            self._hit("product_accounts")
+        else:
+            self._miss("product_accounts")
+            accounts = template._get_product_accounts()
+            self._product_accounts[template.id] = accounts
+
+        return accounts
+
+    # endregion
+
+    # region Taxes
+    def _tax_key(self, amount, type_tax_use):
+        return float_round(amount, precision_digits=4), type_tax_use
+
+    def get_tax(self, amount, type_tax_use):
+        """
+        Get a tax without prices included by amount and usage.
+        All the taxes of the company are read once, as there are only a few
+        """
+        if self._taxes is None:
+            self._taxes = {}
+            taxes = self.env["account.tax"].search(
+                [
+                    # The subtotal will be saved as untaxed amount
+                    ("price_include", "=", False),
+                    ("company_id", "=", self.company_id),
+                ],
+                order="sequence ASC",
+            )
+            for tax in taxes:
+                key = self._tax_key(tax.amount, tax.type_tax_use)
+                self._taxes.setdefault(key, tax)
+
+        key = self._tax_key(amount, type_tax_use)
+        if key in self._taxes:
+            self._hit("tax")
+            return self._taxes[key]
+
+        self._miss("tax")
+        return self.env["account.tax"]
+
+    # endregion
+
+    # region Units of measure
+    def get_uom(self, unit_code):
+        """
+        Get a unit of measure for a Finvoice unit code.
+        The code is looked up from the unit code mapping and then by unit
+        name. Falls back to Units
+        """
+        if self._uoms is None:
+            self._uoms = {}
+            # Read in reverse, so the oldest unit wins on duplicate names
+            self._uom_names = {
+                uom.name.lower(): uom.id
+                for uom in self.env["uom.uom"].search([], order="id DESC")
+            }
+            self._uom_names.update(
+                self.env["account.edi.format"]._finvoice_get_uom_mapping()
+            )
+
+        code = (unit_code or "").strip().lower()
+        if code in self._uoms:
+            self._hit("uom")
+            return self._uoms[code]
+
+        self._miss("uom")
+        uom_id = self._uom_names.get(code)
+        if uom_id:
+            uom = self.env["uom.uom"].browse(uom_id)
+        else:
+            uom = self.env.ref("uom.product_uom_unit")
+
+        self._uoms[code] = uom
+        return uom
+
+    # endregion
+
+    # region Partners and bank accounts
+    def get_partner(
+        self, invoice, name=None, phone=None, mail=None, vat=None, business_code=None
+    ):
+        """
+        Set the partner of an invoice, creating it if needed.
+        The documents of the same seller reuse the partner found for the first
+        one. Sellers are identified by business code and VAT, or by name and
+        contact details if they have neither
+        """
+        if business_code or vat:
+            key = (business_code, vat)
+        else:
+            key = (name, phone, mail)
+
+        partner = self._partners.get(key)
+        if partner is not None:
+            self._hit("partner")
+            invoice.partner_id = partner
+            return partner
+
+        self._miss("partner")
+        self.env["account.edi.common"]._import_retrieve_and_fill_partner(
+            invoice, name=name, phone=phone, mail=mail, vat=vat
+        )
+        partner = invoice.partner_id
+        if partner:
+            self._partners[key] = partner
+        return partner
+
+    def update_partner(self, partner, values):
+        """
+        Write values to a partner, skipping the ones it already has.
+        Avoids locking the partner row again for each document of a seller
+        """
+        if not partner:
+            return
+        if self._partner_values.get(partner.id) == values:
+            self._hit("partner_update")
+            return
+
+        self._miss("partner_update")
+        changed = {
+            field: value
+            for field, value in values.items()
+            if partner[field] != (value or False)
+        }
+        if changed:
+            partner.write(changed)
+        self._partner_values[partner.id] = values
+
+    def get_bank_account(self, account_number, partner_id, bic=False):
+        """
+        Get a bank account by account number (IBAN), creating it if needed
+        """
+        if not account_number:
+            return None
+
+        key = account_number.replace(" ", "")
+        if key in self._bank_accounts:
+            self._hit("bank_account")
+            return self._bank_accounts[key]
+
+        self._miss("bank_account")
+        bank_account = self.env["account.edi.format"]._retrieve_bank_account(
+            account_number,
+            partner_id=partner_id,
+            bic=bic,
+            company_id=self.company_id,
+        )
+        self._bank_accounts[key] = bank_account
+        return bank_account
+
+    def reset_partners(self):
+        """
+        Forget the partners and bank accounts. Call after rolling back an
+        import, as the rollback may have removed or changed them
+        """
+        self._partners.clear()
+        self._partner_values.clear()
+        self._bank_accounts.clear()
+
+    # endregion
@@ -0,0 +1,84 @@
+import contextlib
+import gzip
+import mmap
+
+from odoo import api, fields, models
+
+from ..tools.sniff import sniff_finvoice
+
+
+class IrAttachment(models.Model):
+    _inherit = "ir.attachment"
+
+    finvoice_compressed = fields.Boolean(
+        string="Compressed Finvoice",
+        help="The content is stored gzip compressed, and decompressed when read",
+        readonly=True,
+        # Copies get the decompressed content
+        copy=False,
+    )
+
+    @api.depends("store_fname", "db_datas", "finvoice_compressed")
+    def _compute_raw(self):
+        super()._compute_raw()
+        for attachment in self:
+            if attachment.finvoice_compressed and attachment.raw:
+                attachment.raw = gzip.decompress(attachment.raw)
+
+    def write(self, vals):
+        if ("raw" in vals or "datas" in vals) and "finvoice_compressed" not in vals:
+            # New content is written as is
+            vals = dict(vals, finvoice_compressed=False)
+        return super().write(vals)
+
+    @contextlib.contextmanager
+    def _finvoice_open_content(self):
+        """
+        Content of the attachment, mapped to memory from the filestore so
+        a big file isn't read at once. Attachments stored in the database
+        or compressed are read as a whole
+        """
+        self.ensure_one()
+        if not self.store_fname or self.finvoice_compressed or not self.file_size:
+            yield self.raw
+            return
+
+        with open(self._full_path(self.store_fname), "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as content:
+            yield content
+
+    def _finvoice_get_import_source(self):
+        """
+        Path of the attachment's file in the filestore, to read it only when
+        it's imported. Attachments stored in the database or compressed are
+        read now
+        """
+        self.ensure_one()
+        if self.store_fname and not self.finvoice_compressed:
+            return self._full_path(self.store_fname)
+        return self.raw
+
+    def _finvoice_sniff(self):
+        """FinvoiceSniff of the first Finvoice of the attachment, or None"""
+        with self._finvoice_open_content() as content:
+            return sniff_finvoice(content)
+
+    def _decode_edi_xml(self, filename, content):
+        # Finvoice files are detected from their first bytes, and parsed
+        # only when imported. This also handles transmission files, which
+        # aren't a single well-formed XML document
+        sniff = sniff_finvoice(content)
+        if not sniff:
+            return super()._decode_edi_xml(filename, content)
+
+        return [
+            {
+                "attachment": self,
+                "filename": filename,
+                "content": content,
+                "finvoice": sniff,
+                "sort_weight": 10,
+                "type": "finvoice",
+            }
+        ]
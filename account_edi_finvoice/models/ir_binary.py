@@ -0,0 +1,77 @@
+import gzip
+import io
+
+from werkzeug.utils import send_file
+
+from odoo import models
+from odoo.http import Response, Stream, request
+
+
+class FinvoiceGzipStream(Stream):
+    """
+    Stream of a compressed Finvoice attachment. The content is decompressed
+    chunk by chunk while it's sent, never as a whole
+    """
+
+    def open(self):
+        if self.type == "path":
+            return gzip.open(self.path, "rb")
+        return gzip.GzipFile(fileobj=io.BytesIO(self.data))
+
+    def read(self):
+        with self.open() as source:
+            return source.read()
+
+    def get_response(
+        self,
+        as_attachment=None,
+        immutable=None,
+        content_security_policy="default-src 'none'",
+        **send_file_kwargs,
+    ):
+        if as_attachment is None:
+            as_attachment = self.as_attachment
+
+        # The file is read after the request cursor is closed: no ORM here
+        response = send_file(
+            self.open(),
+            request.httprequest.environ,
+            mimetype=self.mimetype,
+            as_attachment=as_attachment,
+            download_name=self.download_name,
+            conditional=self.conditional,
+            etag=self.etag,
+            last_modified=self.last_modified,
+            max_age=self.max_age,
+            response_class=Response,
+            **send_file_kwargs,
+        )
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        if content_security_policy:
+            response.headers["Content-Security-Policy"] = content_security_policy
+        return response
+
+
+class IrBinary(models.AbstractModel):
+    _inherit = "ir.binary"
+
+    def _record_to_stream(self, record, field_name):
+        if (
+            record._name == "ir.attachment"
+            and field_name in ("raw", "datas")
+            and record.finvoice_compressed
+        ):
+            # The stored file is compressed: /web/content decompresses it
+            # while sending it
+            if record.store_fname:
+                stream = FinvoiceGzipStream(
+                    type="path", path=record._full_path(record.store_fname)
+                )
+            else:
+                stream = FinvoiceGzipStream(type="data", data=record.db_datas)
+            stream.mimetype = record.mimetype
+            stream.download_name = record.name
+            stream.etag = record.checksum
+            stream.last_modified = record.write_date
+            return stream
+        return super()._record_to_stream(record, field_name)
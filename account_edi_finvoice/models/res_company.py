@@ -0,0 +1,11 @@
+from odoo import models
+
+
+class ResCompany(models.Model):
+    _inherit = "res.company"
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Exported invoices embed the company details
+        self.env["account.edi.format"]._finvoice_clear_fragment_cache()
+        return res
@@ -0,0 +1,12 @@
+from odoo import models
+
+
+class ResPartner(models.Model):
+    _inherit = "res.partner"
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self.sudo().ref_company_ids:
+            # Exported invoices embed the address of the company
+            self.env["account.edi.format"]._finvoice_clear_fragment_cache()
+        return res
@@ -0,0 +1,11 @@
+from odoo import models
+
+
+class ResPartnerBank(models.Model):
+    _inherit = "res.partner.bank"
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Exported invoices embed the bank account receiving the payment
+        self.env["account.edi.format"]._finvoice_clear_fragment_cache()
+        return res
@@ -0,0 +1,13 @@
+from . import test_amount
+from . import test_batch_import
+from . import test_extract
+from . import test_finvoice_attachment
+from . import test_finvoice_export
+from . import test_finvoice_import
+from . import test_finvoice_sharded_export
+from . import test_finvoice_stream_export
+from . import test_finvoice_stream_import
+from . import test_finvoice_transmission
+from . import test_rows
+from . import test_sniff
+from . import test_transport
@@ -0,0 +1,179 @@
+from datetime import datetime
+
+from lxml import etree
+
+from odoo import Command
+from odoo.tests.common import new_test_user
+from odoo.tools import file_open
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+class FinvoiceTestCommon(AccountTestInvoicingCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.edi_format = cls.env.ref("account_edi_finvoice.edi_finvoice_3_0")
+        cls.company = cls.company_data["company"]
+        finland = cls.env.ref("base.fi")
+
+        cls.company.write(
+            {
+                "name": "Testiyritys Oy",
+                "company_registry": "1234567-1",
+                "vat": "FI12345671",
+                "street": "Testikatu 1",
+                "street2": False,
+                "city": "Tampere",
+                "zip": "33100",
+                "country_id": finland.id,
+                "phone": "+358 40 123 4567",
+                "email": "laskutus@testiyritys.fi",
+                "edicode": "003712345671",
+            }
+        )
+        cls.finvoice_bank = cls.env["res.partner.bank"].create(
+            {
+                "acc_number": "FI2112345600000785",
+                "partner_id": cls.company.partner_id.id,
+                "bank_id": cls.env["res.bank"]
+                .create({"name": "Nordea", "bic": "NDEAFIHH"})
+                .id,
+            }
+        )
+        cls.finvoice_partner = cls.env["res.partner"].create(
+            {
+                "name": "Asiakas Oy",
+                "is_company": True,
+                "company_registry": "2000000-8",
+                "vat": "FI20000008",
+                "street": "Asiakaskatu 2",
+                "city": "Helsinki",
+                "zip": "00100",
+                "country_id": finland.id,
+                "email": "ostoreskontra@asiakas.fi",
+                "edicode": "003720000008",
+            }
+        )
+        cls.finvoice_user = new_test_user(
+            cls.env,
+            login="finvoice_seller",
+            name="Maija Myyjä",
+            groups="account.group_account_invoice",
+            company_id=cls.company.id,
+            company_ids=[Command.set(cls.company.ids)],
+        )
+        cls.finvoice_tax = cls.company_data["default_tax_sale"].copy(
+            {"name": "ALV 24%", "amount": 24}
+        )
+        cls.finvoice_supplier = cls.env["res.partner"].create(
+            {
+                "name": "Toimittaja Oy",
+                "is_company": True,
+                "company_registry": "3000000-1",
+                "vat": "FI30000001",
+                "country_id": finland.id,
+            }
+        )
+        cls.finvoice_purchase_tax = cls.company_data["default_tax_purchase"].copy(
+            {"name": "ALV 24% (osto)", "amount": 24}
+        )
+        cls.product_service = cls.env["product.product"].create(
+            {"name": "Konsultointi", "default_code": "KONS"}
+        )
+        cls.product_goods = cls.env["product.product"].create(
+            {"name": "Tarvike", "default_code": "TARV", "barcode": "6412345678903"}
+        )
+
+    @classmethod
+    def _create_finvoice_invoice(cls, lines=None):
+        """
+        Create and post the invoice of the golden files: two product lines
+        and a note, exported as a SubInvoiceRow of the first line
+        """
+        taxes = [Command.set(cls.finvoice_tax.ids)]
+        if lines is None:
+            lines = [
+                {
+                    "sequence": 10,
+                    "product_id": cls.product_service.id,
+                    "name": "Konsultointi tammikuu",
+                    "quantity": 2,
+                    "price_unit": 100,
+                    "tax_ids": taxes,
+                },
+                {
+                    "sequence": 20,
+                    "display_type": "line_note",
+                    "name": "Sisältää matkakulut",
+                },
+                {
+                    "sequence": 30,
+                    "product_id": cls.product_goods.id,
+                    "name": "Tarvike",
+                    "quantity": 3,
+                    "price_unit": 12.5,
+                    "tax_ids": taxes,
+                },
+            ]
+
+        invoice = cls.env["account.move"].create(
+            {
+                "move_type": "out_invoice",
+                "partner_id": cls.finvoice_partner.id,
+                "partner_bank_id": cls.finvoice_bank.id,
+                "invoice_user_id": cls.finvoice_user.id,
+                "invoice_date": "2024-01-15",
+                "invoice_date_due": "2024-02-14",
+                "invoice_payment_term_id": False,
+                "ref": "PO-1001",
+                "narration": False,
+                "invoice_line_ids": [Command.create(line) for line in lines],
+            }
+        )
+        invoice.action_post()
+        return invoice
+
+    def _read_finvoice_file(self, filename):
+        with file_open(f"account_edi_finvoice/tests/data/{filename}", "rb") as file:
+            return file.read()
+
+    def _upload_finvoice(self, content, name="finvoice.xml"):
+        """Upload a file to the purchase journal, like from the bills view"""
+        attachment = self.env["ir.attachment"].create(
+            {"name": name, "raw": content, "mimetype": "application/xml"}
+        )
+        journal = self.company_data["default_journal_purchase"]
+        return journal._create_document_from_attachment(attachment.ids)
+
+    def _normalize_finvoice(self, xml):
+        """Canonical form of a Finvoice document, without the timestamp"""
+        if isinstance(xml, str):
+            xml = xml.encode()
+        parser = etree.XMLParser(remove_blank_text=True)
+        tree = etree.fromstring(xml, parser)
+        timestamp = tree.find("./MessageTransmissionDetails/MessageDetails")
+        timestamp.find("MessageTimeStamp").text = "TIMESTAMP"
+        return etree.tostring(tree, method="c14n").decode()
+
+    def _get_golden_finvoice(self, filename, invoice):
+        """
+        Read a golden file, filling in the values that depend on
+        the database (ids, sequence numbers, currency) and the date
+        """
+        with file_open(f"account_edi_finvoice/tests/data/{filename}", "rb") as file:
+            golden = file.read().decode()
+
+        lines = invoice.invoice_line_ids
+        values = {
+            "invoice_id": invoice.id,
+            "name": invoice.name,
+            "payment_reference": invoice.payment_reference,
+            "currency": invoice.currency_id.name,
+            "today": datetime.now().strftime("%Y%m%d"),
+        }
+        values.update(
+            {f"line_{index}": line.id for index, line in enumerate(lines, start=1)}
+        )
+        return self._normalize_finvoice(golden.format(**values))
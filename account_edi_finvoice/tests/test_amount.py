@@ -0,0 +1,82 @@
+from decimal import Decimal
+
+from odoo.tests.common import BaseCase
+
+from ..tools.amount import (
+    FinvoiceRowAmounts,
+    parse_amount,
+    parse_amounts,
+    parse_row_amounts,
+    round_amount,
+)
+from ..tools.extract import FinvoiceRow
+
+
+class TestFinvoiceAmount(BaseCase):
+    def test_parse_amount_separators(self):
+        for value, expected in (
+            ("1234,56", "1234.56"),
+            ("1234.56", "1234.56"),
+            ("1 234,56", "1234.56"),
+            ("1\u00a0234,56", "1234.56"),
+            ("1.234,56", "1234.56"),
+            ("1,234.56", "1234.56"),
+            ("1.234.567", "1234567"),
+            ("1,234,567", "1234567"),
+            ("12,50-", "-12.50"),
+            ("-0,5", "-0.5"),
+            ("100", "100"),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(parse_amount(value), Decimal(expected))
+
+    def test_parse_amount_noise(self):
+        self.assertEqual(parse_amount("12,50 EUR"), Decimal("12.50"))
+        self.assertEqual(parse_amount("€ 7,00"), Decimal("7.00"))
+
+    def test_parse_amount_empty(self):
+        self.assertEqual(parse_amount(None), Decimal(0))
+        self.assertEqual(parse_amount(""), Decimal(0))
+        self.assertEqual(parse_amount(" "), Decimal(0))
+        self.assertIsNone(parse_amount(None, default=None))
+
+    def test_parse_amount_numbers(self):
+        self.assertEqual(parse_amount(Decimal("1.5")), Decimal("1.5"))
+        self.assertEqual(parse_amount(2), Decimal(2))
+        self.assertEqual(parse_amount(0.1), Decimal("0.1"))
+
+    def test_parse_amount_invalid(self):
+        for value in ("abc", "NaN", "-Infinity", "inf", float("nan"), Decimal("Inf")):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_amount(value)
+
+    def test_round_amount(self):
+        self.assertEqual(round_amount(Decimal("2.345")), Decimal("2.35"))
+        self.assertEqual(round_amount(Decimal("-2.345")), Decimal("-2.35"))
+        self.assertEqual(round_amount(Decimal("2.3449"), 3), Decimal("2.345"))
+
+    def test_parse_amounts(self):
+        self.assertEqual(
+            parse_amounts(["1,5", None, "1,5"], default=None),
+            [Decimal("1.5"), None, Decimal("1.5")],
+        )
+
+    def test_parse_row_amounts(self):
+        rows = [
+            FinvoiceRow(
+                invoiced_quantity="2",
+                unit_price_amount="10,00",
+                row_vat_excluded_amount="20,00",
+                row_vat_rate_percent="24",
+            ),
+            FinvoiceRow(row_discount_percent="5"),
+        ]
+        self.assertEqual(
+            parse_row_amounts(rows),
+            [
+                FinvoiceRowAmounts(
+                    Decimal(2), Decimal("10.00"), Decimal("20.00"), None, Decimal(24)
+                ),
+                FinvoiceRowAmounts(None, None, None, Decimal(5), None),
+            ],
+        )
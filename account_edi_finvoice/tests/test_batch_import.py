@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from odoo.tests.common import BaseCase
+
+from ..tools import batch_import
+from ..tools.batch_import import check_finvoice_files
+
+MODULE_PATH = os.path.dirname(os.path.dirname(__file__))
+XSD_PATH = os.path.join(MODULE_PATH, "static", "schema", "Finvoice3.0.xsd")
+
+
+class TestFinvoiceBatchImport(BaseCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.directory.cleanup)
+
+        with open(
+            os.path.join(MODULE_PATH, "tests", "data", "finvoice_import.xml"), "rb"
+        ) as file:
+            valid = file.read()
+        cls.paths = []
+        for name, content in (
+            ("valid.xml", valid),
+            ("invalid.xml", b'<Finvoice Version="3.0"><Unknown/></Finvoice>'),
+            ("broken.xml", b"<Finvoice"),
+            ("other.xml", b"<Invoice/>"),
+        ):
+            path = os.path.join(cls.directory.name, name)
+            with open(path, "wb") as file:
+                file.write(content)
+            cls.paths.append(path)
+
+    def _check(self, checks):
+        valid, invalid, broken, other = checks
+        self.assertTrue(valid["finvoice"] and valid["valid"])
+        self.assertEqual(valid["type_code"], "INV01")
+        self.assertEqual(len(valid["rows"]), 4)
+        self.assertTrue(invalid["finvoice"])
+        self.assertFalse(invalid["valid"])
+        self.assertTrue(invalid["errors"])
+        self.assertFalse(broken["finvoice"])
+        self.assertFalse(other["finvoice"])
+
+    def test_check_in_process(self):
+        # The files are read one at a time, as the results are consumed
+        checks = check_finvoice_files(self.paths, XSD_PATH, parse_rows=True)
+        self.assertEqual(next(checks)["type_code"], "INV01")
+        self._check(list(check_finvoice_files(self.paths, XSD_PATH, parse_rows=True)))
+
+    def test_check_in_workers(self):
+        # Chunks smaller than the batch, so the pool is reused
+        with patch.object(batch_import, "CHECK_CHUNK_SIZE", 3):
+            checks = check_finvoice_files(
+                self.paths, XSD_PATH, max_workers=2, parse_rows=True
+            )
+            self._check(list(checks))
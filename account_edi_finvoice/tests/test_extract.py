@@ -0,0 +1,140 @@
+from lxml import etree
+
+from odoo.tests.common import BaseCase
+
+from ..tools.extract import (
+    FinvoiceRow,
+    FinvoiceSubRow,
+    extract_epi_details,
+    extract_header,
+    extract_rows,
+    find_attribute,
+    find_text,
+    find_texts_joined,
+)
+
+FINVOICE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Finvoice Version="3.0">
+    <SellerPartyDetails>
+        <SellerPartyIdentifier>1234567-1</SellerPartyIdentifier>
+        <SellerOrganisationName>Toimittaja Oy</SellerOrganisationName>
+        <SellerOrganisationTaxCode>FI12345671</SellerOrganisationTaxCode>
+        <SellerPostalAddressDetails>
+            <SellerStreetName>Toimittajankatu 3</SellerStreetName>
+            <SellerTownName>Turku</SellerTownName>
+            <SellerPostCodeIdentifier>20100</SellerPostCodeIdentifier>
+        </SellerPostalAddressDetails>
+    </SellerPartyDetails>
+    <InvoiceDetails>
+        <InvoiceTypeCode>INV01</InvoiceTypeCode>
+        <InvoiceNumber>1001</InvoiceNumber>
+        <InvoiceDate Format="CCYYMMDD">20240115</InvoiceDate>
+        <SellerReferenceIdentifier>10016</SellerReferenceIdentifier>
+        <SellersBuyerIdentifier>ASIAKAS-1</SellersBuyerIdentifier>
+        <InvoiceFreeText>First</InvoiceFreeText>
+        <InvoiceFreeText>Second</InvoiceFreeText>
+        <PaymentTermsDetails>
+            <PaymentTermsFreeText>14 days</PaymentTermsFreeText>
+            <InvoiceDueDate Format="CCYYMMDD">20240129</InvoiceDueDate>
+        </PaymentTermsDetails>
+    </InvoiceDetails>
+    <InvoiceRow>
+        <ArticleIdentifier>A-1</ArticleIdentifier>
+        <ArticleName>Article</ArticleName>
+        <InvoicedQuantity QuantityUnitCode="kpl">2</InvoicedQuantity>
+        <UnitPriceAmount>10,00</UnitPriceAmount>
+        <RowFreeText>Line 1</RowFreeText>
+        <RowFreeText>Line 2</RowFreeText>
+        <RowVatRatePercent>24</RowVatRatePercent>
+        <RowVatExcludedAmount>20,00</RowVatExcludedAmount>
+        <SubInvoiceRow>
+            <SubArticleName>Included part</SubArticleName>
+            <SubInvoicedQuantity QuantityUnitCode="kpl">4</SubInvoicedQuantity>
+        </SubInvoiceRow>
+    </InvoiceRow>
+    <InvoiceRow>
+        <SubInvoiceRow>
+            <SubArticleName>Note</SubArticleName>
+        </SubInvoiceRow>
+    </InvoiceRow>
+    <EpiDetails>
+        <EpiIdentificationDetails>
+            <EpiReference>REF-1</EpiReference>
+        </EpiIdentificationDetails>
+        <EpiPartyDetails>
+            <EpiBfiPartyDetails>
+                <EpiBfiIdentifier IdentificationSchemeName="BIC">NDEAFIHH</EpiBfiIdentifier>
+            </EpiBfiPartyDetails>
+            <EpiBeneficiaryPartyDetails>
+                <EpiAccountID IdentificationSchemeName="IBAN">FI2112345600000785</EpiAccountID>
+            </EpiBeneficiaryPartyDetails>
+        </EpiPartyDetails>
+    </EpiDetails>
+</Finvoice>
+"""
+
+
+class TestFinvoiceExtract(BaseCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tree = etree.fromstring(FINVOICE)
+
+    def test_find(self):
+        self.assertEqual(find_text("./InvoiceDetails/InvoiceNumber", self.tree), "1001")
+        self.assertIsNone(find_text("./InvoiceDetails/Missing", self.tree))
+        self.assertEqual(
+            find_texts_joined("./InvoiceDetails/InvoiceFreeText", self.tree, " "),
+            "First Second",
+        )
+        self.assertEqual(
+            find_attribute("./InvoiceDetails/InvoiceDate", self.tree, "Format"),
+            "CCYYMMDD",
+        )
+        self.assertIsNone(find_attribute("./Missing", self.tree, "Format"))
+
+    def test_extract_header(self):
+        header = extract_header(self.tree)
+        self.assertEqual(header.invoice_type_code, "INV01")
+        self.assertEqual(header.seller_party_identifier, "1234567-1")
+        self.assertEqual(header.seller_organisation_name, "Toimittaja Oy")
+        self.assertEqual(header.seller_street_name, "Toimittajankatu 3")
+        self.assertEqual(header.seller_post_code, "20100")
+        self.assertEqual(header.invoice_date, "20240115")
+        self.assertEqual(header.invoice_due_date, "20240129")
+        self.assertEqual(header.invoice_free_text, "First\nSecond")
+        self.assertEqual(header.payment_terms_free_text, "14 days")
+        self.assertIsNone(header.seller_email)
+
+    def test_extract_epi_details(self):
+        epi = extract_epi_details(self.tree)
+        self.assertEqual(epi.epi_reference, "REF-1")
+        self.assertEqual(epi.sellers_buyer_identifier, "ASIAKAS-1")
+        self.assertEqual(epi.epi_account_id, "FI2112345600000785")
+        self.assertEqual(epi.epi_bfi_identifier, "NDEAFIHH")
+
+    def test_extract_rows(self):
+        first, second = self.tree.iterfind("InvoiceRow")
+        self.assertEqual(
+            extract_rows(first),
+            [
+                FinvoiceRow(
+                    article_identifier="A-1",
+                    article_name="Article",
+                    invoiced_quantity="2",
+                    quantity_unit_code="kpl",
+                    unit_price_amount="10,00",
+                    row_vat_excluded_amount="20,00",
+                    row_vat_rate_percent="24",
+                    row_free_text="Line 1\nLine 2",
+                ),
+                FinvoiceSubRow(
+                    article_name="Included part",
+                    invoiced_quantity="4",
+                    quantity_unit_code="kpl",
+                ),
+            ],
+        )
+        # A row of sub rows only has no FinvoiceRow of its own
+        self.assertEqual(extract_rows(second), [FinvoiceSubRow(article_name="Note")])
+        self.assertEqual(extract_rows(first)[0].default_code, "A-1")
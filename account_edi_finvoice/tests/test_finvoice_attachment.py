@@ -0,0 +1,90 @@
+import hashlib
+import tempfile
+from datetime import timedelta
+
+from freezegun import freeze_time
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from ..tools.sniff import sniff_finvoice
+from .common import FinvoiceTestCommon
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceAttachment(FinvoiceTestCommon):
+    def test_create_attachment_from_file(self):
+        content = b"<Finvoice>" + b"<InvoiceRow/>" * 100000 + b"</Finvoice>"
+        with tempfile.TemporaryFile() as xml_file:
+            xml_file.write(content)
+            attachment = self.edi_format._finvoice_create_attachment_from_file(
+                xml_file, {"name": "finvoice.xml", "mimetype": "application/xml"}
+            )
+
+        attachment.invalidate_recordset()
+        self.assertEqual(attachment.raw, content)
+        self.assertEqual(attachment.file_size, len(content))
+        self.assertEqual(attachment.checksum, hashlib.sha1(content).hexdigest())
+        if attachment._storage() == "file":
+            self.assertTrue(attachment.store_fname)
+            self.assertFalse(attachment.db_datas)
+
+    def test_export_transmission(self):
+        invoice = self._create_finvoice_invoice()
+        attachment = self.edi_format._export_finvoice_transmission(invoice)
+
+        attachment.invalidate_recordset()
+        content = attachment.raw
+        sniff = sniff_finvoice(content)
+        self.assertTrue(sniff and sniff.soap)
+        self.assertEqual(
+            self._normalize_finvoice(content[sniff.start : sniff.end]),
+            self._get_golden_finvoice("finvoice_3_0.xml", invoice),
+        )
+
+    def test_export_transmission_action(self):
+        invoice = self._create_finvoice_invoice()
+        draft = self._create_finvoice_invoice()
+        draft.button_draft()
+        with self.assertRaisesRegex(UserError, "Only posted invoices"):
+            (invoice | draft).action_export_finvoice_transmission()
+
+        action = invoice.action_export_finvoice_transmission()
+        self.assertEqual(action["type"], "ir.actions.act_url")
+
+    def test_gc_transmissions(self):
+        now = fields.Datetime.now()
+        invoice = self._create_finvoice_invoice()
+        attachment = self.edi_format._export_finvoice_transmission(invoice)
+
+        with freeze_time(now + timedelta(hours=1)):
+            self.edi_format._gc_finvoice_transmissions()
+        self.assertTrue(attachment.exists())
+
+        with freeze_time(now + timedelta(days=2)):
+            self.edi_format._gc_finvoice_transmissions()
+        self.assertFalse(attachment.exists())
+        # The Finvoice documents of the invoices are kept
+        self.assertTrue(invoice.edi_document_ids.attachment_id.exists())
+
+    def test_compressed_attachment(self):
+        self.edi_format.finvoice_compress_attachments = True
+        invoice = self._create_finvoice_invoice()
+        attachment = self.edi_format._export_finvoice(invoice)
+
+        attachment.invalidate_recordset()
+        self.assertTrue(attachment.finvoice_compressed)
+        content = attachment.raw
+        self.assertEqual(
+            self._normalize_finvoice(content),
+            self._get_golden_finvoice("finvoice_3_0.xml", invoice),
+        )
+
+        stream = self.env["ir.binary"]._get_stream_from(attachment)
+        self.assertEqual(stream.read(), content)
+
+        copy = attachment.copy()
+        copy.invalidate_recordset()
+        self.assertFalse(copy.finvoice_compressed)
+        self.assertEqual(copy.raw, content)
@@ -0,0 +1,169 @@
+from unittest.mock import patch
+
+from lxml import etree
+
+from odoo.tests import tagged
+
+from .common import FinvoiceTestCommon
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceExport(FinvoiceTestCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.invoice = cls._create_finvoice_invoice()
+
+    def _render(self, engine):
+        self.edi_format.finvoice_export_engine = engine
+        return self._normalize_finvoice(self.edi_format._finvoice_render(self.invoice))
+
+    def test_export_qweb_golden(self):
+        self.assertEqual(
+            self._render("qweb"),
+            self._get_golden_finvoice("finvoice_3_0.xml", self.invoice),
+        )
+
+    def test_export_lxml_golden(self):
+        self.assertEqual(
+            self._render("lxml"),
+            self._get_golden_finvoice("finvoice_3_0.xml", self.invoice),
+        )
+
+    def test_export_engines_match(self):
+        self.assertEqual(self._render("qweb"), self._render("lxml"))
+
+    def test_export_batch(self):
+        attachments = self.edi_format._export_finvoice_batch(self.invoice)
+        self.assertEqual(
+            self._normalize_finvoice(attachments[self.invoice].raw),
+            self._get_golden_finvoice("finvoice_3_0.xml", self.invoice),
+        )
+
+    def _get_finvoice_document(self, invoice):
+        document = invoice.edi_document_ids.filtered(
+            lambda d: d.edi_format_id == self.edi_format
+        )
+        return document or self.env["account.edi.document"].create(
+            {"move_id": invoice.id, "edi_format_id": self.edi_format.id}
+        )
+
+    def test_export_fingerprint(self):
+        invoice = self._create_finvoice_invoice()
+        document = self._get_finvoice_document(invoice)
+        attachment = self.edi_format._export_finvoice_batch(invoice)[invoice]
+        document.attachment_id = attachment
+        fingerprint = document.finvoice_fingerprint
+        self.assertTrue(fingerprint)
+
+        # Nothing has changed: the exported document is reused as is
+        with patch.object(
+            type(self.edi_format),
+            "_finvoice_render",
+            side_effect=AssertionError("Rendered again"),
+        ):
+            self.assertEqual(
+                self.edi_format._finvoice_get_unchanged_attachment(invoice), attachment
+            )
+            reused = self.edi_format._export_finvoice_batch(invoice)[invoice]
+        self.assertEqual(reused.raw, attachment.raw)
+
+        # A change to the data the export reads invalidates it
+        self.finvoice_partner.name = "Asiakas Oyj"
+        self.assertFalse(self.edi_format._finvoice_get_unchanged_attachment(invoice))
+        rendered = self.edi_format._export_finvoice_batch(invoice)[invoice]
+        self.assertIn("Asiakas Oyj", rendered.raw.decode())
+        self.assertNotEqual(document.finvoice_fingerprint, fingerprint)
+
+        # As does a change of the export engine
+        document.attachment_id = rendered
+        self.assertEqual(
+            self.edi_format._finvoice_get_unchanged_attachment(invoice), rendered
+        )
+        self.edi_format.finvoice_export_engine = "lxml"
+        self.assertFalse(self.edi_format._finvoice_get_unchanged_attachment(invoice))
+
+    def _get_seller_text(self, invoice, tag, path):
+        fragments = self.edi_format._finvoice_get_seller_fragments(invoice)
+        return fragments[tag].findtext(path)
+
+    def test_seller_fragments(self):
+        invoice = self.invoice
+        spd = "SellerPartyDetails"
+        self.assertEqual(
+            self._get_seller_text(invoice, spd, "SellerOrganisationName"),
+            "Testiyritys Oy",
+        )
+
+        # Writes in the same transaction, where write_date doesn't change
+        self.company.name = "Testiyhtiö Oy"
+        self.assertEqual(
+            self._get_seller_text(invoice, spd, "SellerOrganisationName"),
+            "Testiyhtiö Oy",
+        )
+        self.company.partner_id.city = "Espoo"
+        self.assertEqual(
+            self._get_seller_text(
+                invoice, spd, "SellerPostalAddressDetails/SellerTownName"
+            ),
+            "Espoo",
+        )
+        self.finvoice_bank.acc_number = "FI49 5000 9420 0287 30"
+        self.assertEqual(
+            self._get_seller_text(
+                invoice, "EpiBeneficiaryPartyDetails", "EpiAccountID"
+            ),
+            "FI4950009420028730",
+        )
+
+        # Each language has fragments of its own
+        self.env["res.lang"]._activate_lang("fi_FI")
+        finland = self.env.ref("base.fi")
+        finland.with_context(lang="fi_FI").name = "Suomi"
+        country_name = "SellerPostalAddressDetails/CountryName"
+        for lang, name in (("en_US", "Finland"), ("fi_FI", "Suomi")):
+            with self.subTest(lang=lang):
+                self.assertEqual(
+                    self._get_seller_text(
+                        invoice.with_context(lang=lang), spd, country_name
+                    ),
+                    name,
+                )
+
+    def test_post_batching(self):
+        invoices = self.invoice | self._create_finvoice_invoice()
+        documents = self.env["account.edi.document"]
+        for invoice in invoices:
+            document = invoice.edi_document_ids.filtered(
+                lambda d: d.edi_format_id == self.edi_format
+            )
+            if not document:
+                document = documents.create(
+                    {"move_id": invoice.id, "edi_format_id": self.edi_format.id}
+                )
+            documents |= document
+        documents.write({"state": "to_send", "blocking_level": False, "error": False})
+
+        # Both invoices are posted in a single job
+        jobs = documents._prepare_jobs()
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]["documents"], documents)
+
+    def test_schema_error_location(self):
+        tree = etree.Element("Finvoice", Version="3.0")
+        etree.SubElement(tree, "Unknown")
+        parsed = etree.fromstring(etree.tostring(tree, pretty_print=True))
+
+        # Trees built in memory have no line numbers: errors have the path
+        errors = self.edi_format._finvoice_get_schema_errors(tree)
+        self.assertTrue(
+            self.edi_format._finvoice_format_schema_errors(errors).startswith(
+                "/Finvoice/Unknown: "
+            )
+        )
+        errors = self.edi_format._finvoice_get_schema_errors(parsed)
+        self.assertTrue(
+            self.edi_format._finvoice_format_schema_errors(errors).startswith(
+                "Line 2: "
+            )
+        )
@@ -0,0 +1,222 @@
+import os
+
+from odoo.tests import tagged
+
+from .common import FinvoiceTestCommon
+from .test_sniff import ENVELOPE
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceImport(FinvoiceTestCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        hour = cls.env.ref("uom.product_uom_hour")
+        cls.product_installation = cls.env["product.product"].create(
+            {
+                "name": "Asennus",
+                "default_code": "ASEN",
+                "uom_id": hour.id,
+                "uom_po_id": hour.id,
+            }
+        )
+        cls.finvoice_reduced_tax = cls.company_data["default_tax_purchase"].copy(
+            {"name": "ALV 14% (osto)", "amount": 14}
+        )
+
+    def _import_finvoice_file(self, filename):
+        bill = self.env["account.move"].create(
+            {
+                "move_type": "in_invoice",
+                "journal_id": self.company_data["default_journal_purchase"].id,
+            }
+        )
+        return bill._import_finvoice_content(self._read_finvoice_file(filename))
+
+    def test_import(self):
+        bill = self._import_finvoice_file("finvoice_import.xml")
+
+        # Header
+        self.assertEqual(bill.move_type, "in_invoice")
+        self.assertEqual(bill.partner_id, self.finvoice_supplier)
+        self.assertEqual(bill.ref, "50018")
+        self.assertEqual(str(bill.invoice_date), "2024-02-01")
+        self.assertEqual(str(bill.invoice_date_due), "2024-02-15")
+        self.assertIn("Kiitos kaupasta", bill.narration)
+        self.assertIn("14 pv netto", bill.narration)
+        self.assertEqual(bill.payment_reference, "50018")
+        self.assertEqual(bill.partner_bank_id.acc_number, "FI4950009420028730")
+        self.assertEqual(bill.partner_bank_id.partner_id, self.finvoice_supplier)
+        self.assertEqual(bill.finvoice_document_key, "3000000-1/5001")
+
+        installation, goods, freight, note = bill.invoice_line_ids.sorted("sequence")
+
+        # Product by the buyer's article identifier, in hours
+        self.assertEqual(installation.product_id, self.product_installation)
+        self.assertEqual(
+            installation.product_uom_id, self.env.ref("uom.product_uom_hour")
+        )
+        self.assertEqual(installation.quantity, 2)
+        self.assertEqual(installation.price_unit, 100)
+        self.assertEqual(installation.tax_ids, self.finvoice_purchase_tax)
+        self.assertAlmostEqual(installation.price_subtotal, 200)
+
+        # Product by EAN code, with a discount and the reduced VAT rate
+        self.assertEqual(goods.product_id, self.product_goods)
+        self.assertEqual(goods.product_uom_id, self.env.ref("uom.product_uom_unit"))
+        self.assertEqual(goods.quantity, 3)
+        self.assertEqual(goods.price_unit, 12.5)
+        self.assertEqual(goods.discount, 20)
+        self.assertEqual(goods.tax_ids, self.finvoice_reduced_tax)
+        self.assertAlmostEqual(goods.price_subtotal, 30)
+
+        # Unknown product: the name and the free text describe the line
+        self.assertFalse(freight.product_id)
+        self.assertEqual(freight.name, "Rahti\nToimitus 1.2.2024")
+        self.assertEqual(freight.tax_ids, self.finvoice_purchase_tax)
+        self.assertAlmostEqual(freight.price_subtotal, 15)
+
+        self.assertEqual(note.display_type, "line_note")
+        self.assertEqual(note.name, "Kiitos tilauksestanne")
+
+        # Totals of the document
+        self.assertAlmostEqual(bill.amount_untaxed, 245)
+        self.assertAlmostEqual(bill.amount_tax, 55.8)
+        self.assertAlmostEqual(bill.amount_total, 300.8)
+
+    def test_import_sub_rows(self):
+        bill = self._import_finvoice_file("finvoice_sub_rows.xml")
+
+        self.assertEqual(bill.partner_id, self.finvoice_supplier)
+        self.assertEqual(bill.ref, "5002")
+        part, service, note = bill.invoice_line_ids.sorted("sequence")
+
+        # Priced sub rows of a row without content are lines of their own
+        self.assertEqual(part.name, "Varaosa\nHuoltosarja")
+        self.assertEqual(part.quantity, 2)
+        self.assertEqual(part.price_unit, 5)
+        self.assertEqual(part.discount, 10)
+        self.assertEqual(part.tax_ids, self.finvoice_purchase_tax)
+        self.assertAlmostEqual(part.price_subtotal, 9)
+
+        # A sub row with only SubRowAmount is priced by its VAT excluded amount
+        self.assertEqual(service.quantity, 1)
+        self.assertAlmostEqual(service.price_unit, 20)
+        self.assertEqual(service.tax_ids, self.finvoice_purchase_tax)
+
+        self.assertEqual(note.display_type, "line_note")
+        self.assertEqual(note.name, "Asennettu kohteeseen")
+
+        # Totals of the document
+        self.assertAlmostEqual(bill.amount_untaxed, 29)
+        self.assertAlmostEqual(bill.amount_tax, 6.96)
+        self.assertAlmostEqual(bill.amount_total, 35.96)
+
+    def test_import_attachment(self):
+        bill = self.env["account.move"].create(
+            {
+                "move_type": "in_invoice",
+                "journal_id": self.company_data["default_journal_purchase"].id,
+            }
+        )
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": "finvoice_sub_rows.xml",
+                "raw": self._read_finvoice_file("finvoice_sub_rows.xml"),
+                "mimetype": "application/xml",
+                "res_model": "account.move",
+                "res_id": bill.id,
+            }
+        )
+
+        attachments_by_invoice = bill._extend_with_attachments(attachment, new=True)
+
+        self.assertEqual(attachments_by_invoice.get(attachment), bill)
+        self.assertEqual(bill.partner_id, self.finvoice_supplier)
+        self.assertEqual(len(bill.invoice_line_ids), 3)
+        self.assertAlmostEqual(bill.amount_total, 35.96)
+
+    def test_upload_duplicate_document_key(self):
+        content = self._read_finvoice_file("finvoice_sub_rows.xml")
+        bill = self._upload_finvoice(content)
+        self.assertTrue(bill.finvoice_document_key)
+        self.assertEqual(bill.attachment_ids.raw, content)
+
+        # Same seller and invoice number, different content
+        content = content.replace(b"Asennettu kohteeseen", b"Asennettu toimistolle")
+        moves = self.env["account.move"].search([])
+        self.assertEqual(self._upload_finvoice(content), bill)
+        # No empty draft is left behind
+        self.assertEqual(self.env["account.move"].search([]), moves)
+
+    def test_upload_duplicate_content_hash(self):
+        content = self._read_finvoice_file("finvoice_sub_rows.xml")
+        bill = self._upload_finvoice(content)
+        self.assertTrue(bill.finvoice_content_hash)
+
+        # Only the content identifies the document
+        bill.finvoice_document_key = False
+        moves = self.env["account.move"].search([])
+        self.assertEqual(self._upload_finvoice(content), bill)
+        self.assertEqual(self.env["account.move"].search([]), moves)
+
+    def test_upload_transmission(self):
+        first = self._read_finvoice_file("finvoice_sub_rows.xml")
+        second = first.replace(
+            b"<InvoiceNumber>5002<", b"<InvoiceNumber>5003<"
+        ).replace(b"50021", b"50034")
+        content = ENVELOPE + first + ENVELOPE + second
+
+        bills = self._upload_finvoice(content, name="transmission.xml")
+
+        # A bill for each Finvoice, with its own Finvoice attached
+        self.assertEqual(bills.mapped("ref"), ["5002", "5003"])
+        for bill, finvoice in zip(bills, (first, second)):
+            self.assertEqual(len(bill.invoice_line_ids), 3)
+            self.assertEqual(bill.attachment_ids.raw.strip(), finvoice.strip())
+
+    def test_import_attachment_transmission(self):
+        content = self._read_finvoice_file("finvoice_sub_rows.xml")
+        bill = self.env["account.move"].create({"move_type": "in_invoice"})
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": "transmission.xml",
+                "raw": ENVELOPE + content + ENVELOPE + content,
+                "mimetype": "application/xml",
+            }
+        )
+
+        # A single bill can't hold several Finvoices: nothing is imported
+        bill._extend_with_attachments(attachment, new=True)
+        self.assertFalse(bill.invoice_line_ids)
+
+    def test_import_batch(self):
+        attachments = self.env["ir.attachment"].create(
+            [
+                {
+                    "name": "finvoice_import.xml",
+                    "raw": self._read_finvoice_file("finvoice_import.xml"),
+                    "mimetype": "application/xml",
+                },
+                {
+                    "name": "invalid.xml",
+                    "raw": b'<Finvoice Version="3.0"><Unknown/></Finvoice>',
+                    "mimetype": "application/xml",
+                },
+            ]
+        )
+        for attachment in attachments.filtered("store_fname"):
+            # Read by the import from the filestore, not up front
+            self.assertTrue(os.path.isfile(attachment._finvoice_get_import_source()))
+
+        results = self.env["account.move"]._import_finvoice_batch(
+            attachments, journal=self.company_data["default_journal_purchase"]
+        )
+
+        self.assertEqual([result["status"] for result in results], ["done", "invalid"])
+        bill = results[0]["move"]
+        self.assertEqual(bill.partner_id, self.finvoice_supplier)
+        self.assertAlmostEqual(bill.amount_total, 300.8)
+        self.assertEqual(attachments[0].res_id, bill.id)
+        self.assertTrue(results[1]["message"])
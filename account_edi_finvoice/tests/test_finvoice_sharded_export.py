@@ -0,0 +1,70 @@
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from .common import FinvoiceTestCommon
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceShardedExport(FinvoiceTestCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.edi_format.write(
+            {"finvoice_export_sharded": True, "finvoice_export_chunk_size": 2}
+        )
+        cls.invoices = cls.env["account.move"]
+        for _index in range(5):
+            cls.invoices |= cls._create_finvoice_invoice()
+        cls.documents = cls.invoices.edi_document_ids.filtered(
+            lambda d: d.edi_format_id == cls.edi_format
+        ).sorted("id")
+        cls.shard_cron = cls.env.ref("account_edi_finvoice.ir_cron_finvoice_export_1")
+
+    def _claim(self, skip_ids=()):
+        return self.env["account.edi.document"]._finvoice_claim_export_chunk(
+            self.edi_format, 2, skip_ids
+        )
+
+    def test_post_waits_for_shards(self):
+        self.assertEqual(set(self.documents.mapped("state")), {"to_send"})
+        with self.capture_triggers(self.shard_cron.id) as capture:
+            self._create_finvoice_invoice()
+        self.assertEqual(len(capture.records), 1)
+
+    def test_claim_export_chunk(self):
+        self.assertEqual(self._claim(), self.documents[:2])
+        # Documents claimed by this shard already are skipped
+        self.assertEqual(self._claim(self.documents[:2].ids), self.documents[2:4])
+        self.assertEqual(self._claim(self.documents[:4].ids), self.documents[4:])
+        self.assertFalse(self._claim(self.documents.ids))
+
+        # Documents with blocking errors wait for the user
+        self.documents[0].blocking_level = "error"
+        self.assertEqual(self._claim(), self.documents[1:3])
+
+    def test_cron_export(self):
+        with patch.object(self.env.cr, "commit") as commit, self.capture_triggers(
+            self.shard_cron.id
+        ) as capture:
+            self.env["account.edi.document"]._cron_finvoice_export(shard=1)
+
+        self.assertEqual(set(self.documents.mapped("state")), {"sent"})
+        self.assertTrue(all(self.documents.mapped("attachment_id")))
+        # One transaction per chunk, and nothing left for a new run
+        self.assertEqual(commit.call_count, 3)
+        self.assertFalse(capture.records)
+
+    def test_cron_export_out_of_time(self):
+        with patch(
+            "odoo.addons.account_edi_finvoice.models.account_edi_document"
+            ".FINVOICE_EXPORT_SHARD_TIME",
+            0,
+        ), patch.object(self.env.cr, "commit"), self.capture_triggers(
+            self.shard_cron.id
+        ) as capture:
+            self.env["account.edi.document"]._cron_finvoice_export(shard=1)
+
+        # The shard continues in a new run instead of exporting
+        self.assertEqual(set(self.documents.mapped("state")), {"to_send"})
+        self.assertEqual(len(capture.records), 1)
@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+from lxml import etree
+
+from odoo import Command
+from odoo.models import PREFETCH_MAX
+from odoo.tests import tagged
+
+from .common import FinvoiceTestCommon
+
+LINE_COUNT = 5000
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceStreamExport(FinvoiceTestCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        taxes = [Command.set(cls.finvoice_tax.ids)]
+        lines = [
+            {
+                "sequence": index * 10,
+                "product_id": cls.product_service.id,
+                "name": f"Rivi {index}",
+                "quantity": index % 7 + 1,
+                "price_unit": 10 + index % 100,
+                "tax_ids": taxes,
+            }
+            for index in range(LINE_COUNT)
+        ]
+        # A note starting the second chunk of lines, exported as a sub row
+        # of the last line of the first chunk
+        lines.insert(
+            PREFETCH_MAX,
+            {
+                "sequence": PREFETCH_MAX * 10 - 5,
+                "display_type": "line_note",
+                "name": "Huomautus",
+            },
+        )
+        cls.invoice = cls._create_finvoice_invoice(lines)
+
+    def test_stream_export(self):
+        self.assertTrue(self.edi_format._finvoice_use_stream_export(self.invoice))
+
+        with patch.object(
+            type(self.edi_format),
+            "_finvoice_render",
+            side_effect=AssertionError("The invoice should be streamed"),
+        ):
+            attachments = self.edi_format._export_finvoice_batch(self.invoice)
+
+        attachment = attachments[self.invoice]
+        attachment.invalidate_recordset()
+        content = attachment.raw
+        tree = etree.fromstring(content)
+
+        rows = tree.findall("InvoiceRow")
+        self.assertEqual(len(rows), LINE_COUNT + 1)
+        sub_row = rows[PREFETCH_MAX]
+        self.assertEqual(sub_row.findtext("SubInvoiceRow/SubArticleName"), "Huomautus")
+        self.assertEqual(rows[-1].findtext("RowFreeText"), f"Rivi {LINE_COUNT - 1}")
+
+        # Same document as the in-memory export
+        self.edi_format.finvoice_export_engine = "lxml"
+        self.assertEqual(
+            self._normalize_finvoice(content),
+            self._normalize_finvoice(self.edi_format._finvoice_render(self.invoice)),
+        )
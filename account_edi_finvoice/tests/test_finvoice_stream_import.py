@@ -0,0 +1,66 @@
+import io
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from ..models import account_move
+from .common import FinvoiceTestCommon
+
+ROW = b"""<InvoiceRow>
+        <ArticleName>Tuote %d</ArticleName>
+        <InvoicedQuantity QuantityUnitCode="kpl">1</InvoicedQuantity>
+        <UnitPriceAmount AmountCurrencyIdentifier="EUR">10,00</UnitPriceAmount>
+        <RowVatRatePercent>24</RowVatRatePercent>
+        <RowVatExcludedAmount AmountCurrencyIdentifier="EUR">10,00</RowVatExcludedAmount>
+    </InvoiceRow>
+    """
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceStreamImport(FinvoiceTestCommon):
+    def _get_finvoice_with_rows(self, count):
+        """The sub rows sample, with count rows instead of its own"""
+        content = self._read_finvoice_file("finvoice_sub_rows.xml")
+        start = content.index(b"<InvoiceRow>")
+        end = content.rindex(b"</InvoiceRow>") + len(b"</InvoiceRow>")
+        rows = b"".join(ROW % number for number in range(1, count + 1))
+        return content[:start] + rows.rstrip() + content[end:]
+
+    def test_import_empty_or_truncated(self):
+        move_model = self.env["account.move"]
+        for content in (b"", b"<?xml version='1.0'?>", b'<Finvoice Version="3.0">'):
+            with self.subTest(content=content):
+                bill = move_model.create({"move_type": "in_invoice"})
+                with self.assertRaises(UserError):
+                    move_model._import_finvoice_stream(io.BytesIO(content), bill)
+
+    def test_import_in_chunks(self):
+        bill = self.env["account.move"].create({"move_type": "in_invoice"})
+        source = io.BytesIO(self._get_finvoice_with_rows(5))
+
+        result = bill._import_finvoice_stream(source, bill, chunk_size=2)
+
+        self.assertEqual(result, bill)
+        self.assertEqual(bill.partner_id, self.finvoice_supplier)
+        self.assertEqual(
+            bill.invoice_line_ids.mapped("name"),
+            [f"Tuote {number}\n" for number in range(1, 6)],
+        )
+        self.assertAlmostEqual(bill.amount_untaxed, 50)
+        self.assertAlmostEqual(bill.amount_tax, 12)
+
+    def test_upload_streamed(self):
+        content = self._get_finvoice_with_rows(3)
+
+        # Any size is streamed, from the file of the attachment
+        with patch.object(account_move, "FINVOICE_STREAM_MIN_SIZE", 0), patch.object(
+            type(self.env["account.move"]),
+            "_import_finvoice",
+            side_effect=AssertionError("Not streamed"),
+        ):
+            bill = self._upload_finvoice(content)
+
+        self.assertEqual(len(bill.invoice_line_ids), 3)
+        self.assertAlmostEqual(bill.amount_total, 37.2)
+        self.assertEqual(bill.attachment_ids.raw, content)
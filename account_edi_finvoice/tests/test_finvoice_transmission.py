@@ -0,0 +1,88 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from freezegun import freeze_time
+
+from odoo import fields
+from odoo.tests import tagged
+
+from ..tools.transport import FinvoiceTransport
+from .common import FinvoiceTestCommon
+
+
+class FakeTransport(FinvoiceTransport):
+    """Transport answering with the result of the test, recording the keys"""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+        self.sent = []
+
+    def _send_one(self, document):
+        self.sent.append(document[0])
+        return self.result
+
+
+@tagged("post_install", "-at_install")
+class TestFinvoiceTransmission(FinvoiceTestCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.edi_format.write(
+            {
+                "finvoice_transport": "http",
+                "finvoice_transport_url": "https://operator.example.com/finvoice",
+                "finvoice_transport_max_attempts": 3,
+            }
+        )
+        cls.invoice = cls._create_finvoice_invoice()
+        cls.document = cls.invoice.edi_document_ids.filtered(
+            lambda d: d.edi_format_id == cls.edi_format
+        )
+
+    def _transmit(self, result):
+        transport = FakeTransport(result)
+        with patch.object(
+            type(self.edi_format), "_finvoice_get_transport", return_value=transport
+        ), patch.object(self.env.cr, "commit"):
+            self.env["account.edi.document"]._cron_finvoice_transmit()
+        return transport.sent
+
+    def test_transmit(self):
+        self.assertEqual(self.document.finvoice_transmission_state, "to_send")
+
+        sent = self._transmit((True, "Vastaanotettu"))
+        self.assertEqual(sent, self.document.ids)
+        self.assertEqual(self.document.finvoice_transmission_state, "sent")
+        self.assertFalse(self._transmit((True, "Vastaanotettu")))
+
+    def test_transmit_backoff(self):
+        now = fields.Datetime.now()
+        # Each failure doubles the delay, until the attempts run out
+        for attempt, delay in ((1, 2), (2, 4)):
+            with freeze_time(now):
+                self.assertEqual(
+                    self._transmit((False, "503 Server Error")), self.document.ids
+                )
+            self.assertRecordValues(
+                self.document,
+                [
+                    {
+                        "finvoice_transmission_state": "to_send",
+                        "finvoice_transmission_attempts": attempt,
+                        "finvoice_transmission_next_try": now
+                        + timedelta(minutes=delay),
+                        "finvoice_transmission_error": "503 Server Error",
+                    }
+                ],
+            )
+            with freeze_time(now + timedelta(minutes=delay - 1)):
+                self.assertFalse(self._transmit((True, "Vastaanotettu")))
+            now += timedelta(minutes=delay)
+
+        with freeze_time(now):
+            self._transmit((False, "503 Server Error"))
+        self.assertEqual(self.document.finvoice_transmission_state, "error")
+        self.assertEqual(self.document.finvoice_transmission_attempts, 3)
+        with freeze_time(now + timedelta(days=1)):
+            self.assertFalse(self._transmit((True, "Vastaanotettu")))
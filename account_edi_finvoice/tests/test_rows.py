@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from lxml import etree
+
+from odoo.tests.common import BaseCase
+
+from ..tools.rows import FinvoiceImportRow, parse_rows
+from .test_extract import FINVOICE
+
+PRICED_SUB_ROWS = b"""<Finvoice Version="3.0">
+    <InvoiceRow>
+        <SubInvoiceRow>
+            <SubArticleIdentifier>S-1</SubArticleIdentifier>
+            <SubArticleName>Part</SubArticleName>
+            <SubInvoicedQuantity QuantityUnitCode="kpl">2</SubInvoicedQuantity>
+            <SubUnitPriceAmount>5,00</SubUnitPriceAmount>
+            <SubRowFreeText>Spare</SubRowFreeText>
+            <SubRowDiscountPercent>10</SubRowDiscountPercent>
+            <SubRowVatRatePercent>24</SubRowVatRatePercent>
+            <SubRowVatExcludedAmount>9,00</SubRowVatExcludedAmount>
+        </SubInvoiceRow>
+        <SubInvoiceRow>
+            <SubArticleName>Service</SubArticleName>
+            <SubRowVatRatePercent>24</SubRowVatRatePercent>
+            <SubRowVatAmount>4,80</SubRowVatAmount>
+            <SubRowAmount>24,80</SubRowAmount>
+        </SubInvoiceRow>
+        <SubInvoiceRow>
+            <SubArticleName>Note</SubArticleName>
+        </SubInvoiceRow>
+    </InvoiceRow>
+</Finvoice>
+"""
+
+
+class TestFinvoiceRows(BaseCase):
+    def test_parse_rows(self):
+        tree = etree.fromstring(FINVOICE)
+        rows = list(parse_rows(tree.iterfind("InvoiceRow")))
+        self.assertEqual(len(rows), 3)
+
+        row, sub_row, note = rows
+        self.assertFalse(row.note)
+        self.assertEqual(row.default_code, "A-1")
+        self.assertEqual(row.quantity, Decimal(2))
+        self.assertEqual(row.unit_code, "kpl")
+        self.assertEqual(row.unit_price, Decimal("10.00"))
+        self.assertEqual(row.vat_excluded_amount, Decimal("20.00"))
+        self.assertEqual(row.vat_rate, Decimal(24))
+        self.assertIsNone(row.discount)
+        self.assertEqual(row.text, "Line 1\nLine 2")
+
+        self.assertTrue(sub_row.note)
+        self.assertEqual(sub_row.text, "Included part (4 kpl)")
+        self.assertTrue(note.note)
+        self.assertEqual(note.text, "Note")
+
+    def test_parse_priced_sub_rows(self):
+        tree = etree.fromstring(PRICED_SUB_ROWS)
+        part, service, note = parse_rows(tree.iterfind("InvoiceRow"))
+
+        # The row has no content of its own: priced sub rows are lines
+        self.assertFalse(part.note)
+        self.assertEqual(part.default_code, "S-1")
+        self.assertEqual(part.article_name, "Part")
+        self.assertEqual(part.quantity, Decimal(2))
+        self.assertEqual(part.unit_price, Decimal("5.00"))
+        self.assertEqual(part.discount, Decimal(10))
+        self.assertEqual(part.vat_rate, Decimal(24))
+        self.assertEqual(part.vat_excluded_amount, Decimal("9.00"))
+        self.assertEqual(part.text, "Spare")
+
+        # The VAT excluded amount is derived from SubRowAmount
+        self.assertFalse(service.note)
+        self.assertIsNone(service.unit_price)
+        self.assertEqual(service.vat_excluded_amount, Decimal("20.00"))
+
+        self.assertTrue(note.note)
+        self.assertEqual(note.text, "Note")
+
+    def test_import_row(self):
+        row = FinvoiceImportRow(note=True, text="Note")
+        self.assertIsNone(row.quantity)
+        self.assertEqual(repr(row), "FinvoiceImportRow(note=True, text='Note')")
+        with self.assertRaises(AttributeError):
+            row.unknown = 1
@@ -0,0 +1,62 @@
+from odoo.tests.common import BaseCase
+
+from ..tools.sniff import iter_finvoices, open_finvoice, sniff_finvoice
+
+FINVOICE = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<Finvoice Version="3.0"><InvoiceDetails/></Finvoice>'
+)
+
+ENVELOPE = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+    b"<SOAP-ENV:Header/><SOAP-ENV:Body/></SOAP-ENV:Envelope>\n"
+)
+
+
+class TestFinvoiceSniff(BaseCase):
+    def test_plain_finvoice(self):
+        sniff = sniff_finvoice(FINVOICE)
+        self.assertEqual(sniff.version, "3.0")
+        self.assertEqual((sniff.start, sniff.end), (0, len(FINVOICE)))
+        self.assertFalse(sniff.soap)
+
+    def test_transmission_file(self):
+        content = ENVELOPE + FINVOICE + b"\n" + ENVELOPE + FINVOICE
+        sniff = sniff_finvoice(content)
+        self.assertTrue(sniff.soap)
+        self.assertEqual(sniff.version, "3.0")
+        # Only the first Finvoice
+        self.assertEqual(content[sniff.start : sniff.end], FINVOICE)
+
+    def test_iter_finvoices(self):
+        content = ENVELOPE + FINVOICE + b"\n" + ENVELOPE + FINVOICE + b"\n"
+        sniffs = list(iter_finvoices(content))
+        self.assertEqual(len(sniffs), 2)
+        for sniff in sniffs:
+            self.assertTrue(sniff.soap)
+            self.assertEqual(content[sniff.start : sniff.end], FINVOICE)
+        self.assertEqual(sniff_finvoice(content, sniffs[0].end), sniffs[1])
+
+        with open_finvoice(content, sniffs[1]) as finvoice:
+            self.assertEqual(finvoice.read(10), FINVOICE[:10])
+            self.assertEqual(finvoice.read(), FINVOICE[10:])
+
+        self.assertEqual(list(iter_finvoices(FINVOICE)), [sniff_finvoice(FINVOICE)])
+        self.assertEqual(list(iter_finvoices(b"%PDF-1.4")), [])
+
+    def test_truncated_finvoice(self):
+        # Only the start of the document is needed
+        self.assertTrue(sniff_finvoice(FINVOICE[:70]))
+
+    def test_not_finvoice(self):
+        for content in (
+            b"",
+            b"%PDF-1.4",
+            b"<Invoice><Finvoice/></Invoice>",
+            b'<?xml version="1.0"?><Invoice xmlns="urn:x"/>',
+            ENVELOPE,
+            b"<Finvoice",
+        ):
+            with self.subTest(content=content):
+                self.assertIsNone(sniff_finvoice(content))
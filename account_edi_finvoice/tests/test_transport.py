@@ -0,0 +1,98 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from urllib3.util.retry import Retry
+
+from odoo.tests.common import BaseCase
+
+from ..tools.transport import FinvoiceHttpTransport
+
+
+class OperatorHandler(BaseHTTPRequestHandler):
+    """E-invoice operator answering with the status and delay of the server"""
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.received.append(body)
+        time.sleep(server.delay)
+        self.send_response(server.status)
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestFinvoiceTransport(BaseCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), OperatorHandler)
+        self.server.lock = threading.Lock()
+        self.server.received = []
+        self.server.status = 200
+        self.server.delay = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        host, port = self.server.server_address
+        self.url = f"http://{host}:{port}/finvoice"
+
+    def _get_transport(self, url=None, **kwargs):
+        transport = FinvoiceHttpTransport(
+            url or self.url, max_workers=2, backoff_factor=0, **kwargs
+        )
+        self.addCleanup(transport.close)
+        return transport
+
+    def test_send(self):
+        transport = self._get_transport()
+        documents = [
+            (index, f"<Finvoice>{index}</Finvoice>".encode()) for index in range(5)
+        ]
+        results = transport.send(documents)
+
+        self.assertEqual(results, {index: (True, "OK") for index in range(5)})
+        self.assertCountEqual(
+            self.server.received, [content for _key, content in documents]
+        )
+
+    def test_send_error_status(self):
+        # The operator got the document: it isn't sent again
+        self.server.status = 500
+        results = self._get_transport().send([(1, b"<Finvoice/>")])
+
+        success, message = results[1]
+        self.assertFalse(success)
+        self.assertIn("500", message)
+        self.assertEqual(len(self.server.received), 1)
+
+    def test_send_read_timeout(self):
+        # The operator may have got the document: it isn't sent again
+        self.server.delay = 0.5
+        results = self._get_transport(timeout=0.1).send([(1, b"<Finvoice/>")])
+
+        self.assertFalse(results[1][0])
+        self.assertEqual(len(self.server.received), 1)
+
+    def test_send_connect_error(self):
+        # Nothing listens on a port that was just released
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        transport = self._get_transport(f"http://127.0.0.1:{port}/", retries=2)
+
+        with patch.object(
+            Retry, "increment", autospec=True, side_effect=Retry.increment
+        ) as increment:
+            results = transport.send([(1, b"<Finvoice/>")])
+
+        self.assertFalse(results[1][0])
+        # The first try, then a retry for each of the retries
+        self.assertEqual(increment.call_count, 3)
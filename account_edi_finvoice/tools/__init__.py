@@ -0,0 +1,7 @@
+from . import amount
+from . import batch_import
+from . import extract
+from . import rows
+from . import sniff
+from . import timing
+from . import transport
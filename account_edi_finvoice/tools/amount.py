@@ -0,0 +1,133 @@
+"""
+Parsing of the amounts, quantities and percentages of Finvoice documents.
+
+Finvoice amounts use a comma as the decimal separator ("1234,56"), but
+documents in the wild also contain thousands separators ("1 234,56",
+"1.234,56", "1,234.56"). Amounts are parsed as exact Decimals, so summing
+the rows of a big invoice doesn't drift like floats do.
+"""
+import re
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import NamedTuple, Optional
+
+# Thousands separators and spaces dropped before parsing
+_DROP_CHARACTERS = str.maketrans("", "", " \t\n\u00a0\u202f'")
+
+# Anything that isn't part of a number, like a currency code or symbol
+_NON_NUMERIC = re.compile(r"[^\d.\-]")
+
+ZERO = Decimal(0)
+
+
+def parse_amount(value, default=ZERO):
+    """
+    Parse a Finvoice amount as a Decimal
+
+    Handles "1234,56", "1234.56", "1 234,56", "1.234,56", "1,234.56" and
+    trailing minus signs ("12,50-").
+    Returns default for an empty value, raises ValueError for an invalid one,
+    including NaN and infinity
+    """
+    if value is None:
+        return default
+    if isinstance(value, Decimal):
+        return _check_finite(value, value)
+    if isinstance(value, (int, float)):
+        return _check_finite(Decimal(str(value)), value)
+
+    value = value.translate(_DROP_CHARACTERS)
+    if not value:
+        return default
+
+    comma = value.rfind(",")
+    dot = value.rfind(".")
+    if comma >= 0 and dot >= 0:
+        # Both separators: the last one is the decimal separator
+        if comma > dot:
+            value = value.replace(".", "").replace(",", ".")
+        else:
+            value = value.replace(",", "")
+    elif comma >= 0:
+        if value.count(",") > 1:
+            value = value.replace(",", "")
+        else:
+            value = value.replace(",", ".")
+    elif dot >= 0 and value.count(".") > 1:
+        value = value.replace(".", "")
+
+    if value.endswith("-"):
+        value = "-" + value[:-1]
+
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        # Slow path for values with a currency or other noise
+        try:
+            amount = Decimal(_NON_NUMERIC.sub("", value))
+        except InvalidOperation:
+            raise ValueError(f"Invalid Finvoice amount: {value}") from None
+    return _check_finite(amount, value)
+
+
+def _check_finite(amount, value):
+    # Decimal accepts "NaN" and "Infinity", which no amount can be
+    if not amount.is_finite():
+        raise ValueError(f"Invalid Finvoice amount: {value}")
+    return amount
+
+
+def round_amount(value, digits=2):
+    """Round a Decimal to the given number of decimals, half up"""
+    return value.quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP)
+
+
+def parse_amounts(values, default=ZERO, parsed=None):
+    """
+    Parse a sequence of amounts in one go.
+    The same amounts repeat a lot (quantities, VAT rates),
+    so each distinct value is only parsed once
+
+    :param parsed: dict of already parsed values, to share between calls
+    """
+    if parsed is None:
+        parsed = {}
+    result = []
+    for value in values:
+        if value not in parsed:
+            parsed[value] = parse_amount(value, default)
+        result.append(parsed[value])
+    return result
+
+
+class FinvoiceRowAmounts(NamedTuple):
+    quantity: Optional[Decimal]
+    unit_price: Optional[Decimal]
+    vat_excluded_amount: Optional[Decimal]
+    discount_percent: Optional[Decimal]
+    vat_rate_percent: Optional[Decimal]
+
+
+# FinvoiceRow fields parsed into FinvoiceRowAmounts
+_ROW_AMOUNT_FIELDS = (
+    "invoiced_quantity",
+    "unit_price_amount",
+    "row_vat_excluded_amount",
+    "row_discount_percent",
+    "row_vat_rate_percent",
+)
+
+
+def parse_row_amounts(rows, parsed=None):
+    """
+    Parse the numeric fields of all the FinvoiceRows in one call.
+    Missing values are None
+
+    :param parsed: dict of already parsed values, to share between calls
+    """
+    values = [getattr(row, field) for row in rows for field in _ROW_AMOUNT_FIELDS]
+    amounts = parse_amounts(values, default=None, parsed=parsed)
+    size = len(_ROW_AMOUNT_FIELDS)
+    return [
+        FinvoiceRowAmounts(*amounts[index : index + size])
+        for index in range(0, len(amounts), size)
+    ]
@@ -0,0 +1,103 @@
+"""
+Process pool helpers for importing batches of Finvoice files.
+
+Everything here runs outside of the Odoo environment (in worker processes),
+so it must not use the ORM or the database.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from lxml import etree
+
+from .rows import parse_rows as _parse_rows
+
+# Compiled schemas of the worker process, by XSD path
+_schemas = {}
+
+# Files checked at a time. Only the parsed rows of a chunk are held in
+# memory at once
+CHECK_CHUNK_SIZE = 64
+
+
+def _get_schema(xsd_path):
+    schema = _schemas.get(xsd_path)
+    if schema is None:
+        schema = _schemas[xsd_path] = etree.XMLSchema(etree.parse(xsd_path))
+    return schema
+
+
+def check_finvoice_file(source, xsd_path, parse_rows=False):
+    """
+    Parse and validate a single Finvoice file
+
+    :param source: a file path, or the file content as bytes
+    :param xsd_path: path of the Finvoice XSD to validate against
+    :param parse_rows: also parse the invoice rows of a valid file
+    :return: dict with keys finvoice, valid, type_code, errors and rows
+        (FinvoiceImportRows, or None if not parsed)
+    """
+    result = {
+        "finvoice": False,
+        "valid": False,
+        "type_code": None,
+        "errors": [],
+        "rows": None,
+    }
+    try:
+        if isinstance(source, bytes):
+            tree = etree.ElementTree(etree.fromstring(source))
+        else:
+            tree = etree.parse(source)
+    except (OSError, etree.XMLSyntaxError) as e:
+        result["errors"].append(str(e))
+        return result
+
+    root = tree.getroot()
+    if root.tag != "Finvoice":
+        result["errors"].append(f"Not a Finvoice document (root is {root.tag})")
+        return result
+
+    result["finvoice"] = True
+    result["type_code"] = root.findtext("./InvoiceDetails/InvoiceTypeCode")
+
+    schema = _get_schema(xsd_path)
+    result["valid"] = schema.validate(tree)
+    result["errors"] = [
+        f"line {error.line}: {error.message}" for error in schema.error_log
+    ]
+    if parse_rows and result["valid"]:
+        try:
+            result["rows"] = list(_parse_rows(root.iterfind("InvoiceRow")))
+        except ValueError as e:
+            result["valid"] = False
+            result["errors"].append(str(e))
+    return result
+
+
+def check_finvoice_files(sources, xsd_path, max_workers=0, parse_rows=False):
+    """
+    Parse and validate Finvoice files, in a pool of max_workers processes
+
+    Yields the results of check_finvoice_file in the order of sources.
+    The files are checked a chunk at a time, as the results are consumed
+
+    :param sources: file paths, read by the workers, or contents as bytes
+    :param max_workers: number of worker processes. 0 or 1 checks the
+        files in this process
+    """
+    workers = min(max_workers or 0, len(sources))
+    if workers <= 1:
+        for source in sources:
+            yield check_finvoice_file(source, xsd_path, parse_rows=parse_rows)
+        return
+
+    # Fork, so the workers don't need to import (and configure) Odoo again.
+    # The workers only parse XML, they never touch the inherited DB connections
+    mp_context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(workers, mp_context=mp_context) as executor:
+        for start in range(0, len(sources), CHECK_CHUNK_SIZE):
+            chunk = sources[start : start + CHECK_CHUNK_SIZE]
+            yield from executor.map(
+                check_finvoice_file, chunk, repeat(xsd_path), repeat(parse_rows)
+            )
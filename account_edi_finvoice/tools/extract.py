@@ -0,0 +1,237 @@
+"""
+Precompiled extraction of the values imported from a Finvoice document.
+
+The XPath expressions are compiled once at import time, and invoice rows
+are read with a single pass over their children, so no expression is
+parsed again for each document or row. Finvoice elements aren't namespaced,
+so the expressions don't use any namespaces.
+"""
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from lxml import etree
+
+
+@lru_cache(maxsize=256)
+def compile_xpath(path):
+    """Compile an XPath expression, reusing already compiled ones"""
+    return etree.XPath(path)
+
+
+def find_text(path, element):
+    """Text of the first element matching path, or None"""
+    result = compile_xpath(path)(element)
+    return result[0].text if result else None
+
+
+def find_texts_joined(path, element, join_character="\n"):
+    """Texts of all the elements matching path, joined"""
+    return join_character.join(x.text or "" for x in compile_xpath(path)(element))
+
+
+def find_attribute(path, element, attribute):
+    """Attribute of the first element matching path, or None"""
+    result = compile_xpath(path)(element)
+    return result[0].attrib.get(attribute) if result else None
+
+
+class FinvoiceHeader(NamedTuple):
+    invoice_type_code: Optional[str]
+    seller_party_identifier: Optional[str]
+    seller_organisation_tax_code: Optional[str]
+    seller_organisation_name: Optional[str]
+    seller_phone_number: Optional[str]
+    seller_email: Optional[str]
+    seller_street_name: Optional[str]
+    seller_town_name: Optional[str]
+    seller_post_code: Optional[str]
+    seller_reference_identifier: Optional[str]
+    invoice_number: Optional[str]
+    invoice_date: Optional[str]
+    invoice_due_date: Optional[str]
+    agreement_identifier: Optional[str]
+    invoice_free_text: str
+    payment_terms_free_text: str
+
+
+class FinvoiceEpiDetails(NamedTuple):
+    epi_reference: Optional[str]
+    sellers_buyer_identifier: Optional[str]
+    epi_account_id: Optional[str]
+    epi_bfi_identifier: Optional[str]
+
+
+class FinvoiceRow(NamedTuple):
+    article_identifier: Optional[str] = None
+    buyer_article_identifier: Optional[str] = None
+    article_name: Optional[str] = None
+    article_description: Optional[str] = None
+    ean_code: Optional[str] = None
+    invoiced_quantity: Optional[str] = None
+    quantity_unit_code: Optional[str] = None
+    unit_price_amount: Optional[str] = None
+    row_vat_excluded_amount: Optional[str] = None
+    row_discount_percent: Optional[str] = None
+    row_vat_rate_percent: Optional[str] = None
+    row_free_text: str = ""
+
+    @property
+    def default_code(self):
+        return self.buyer_article_identifier or self.article_identifier
+
+
+class FinvoiceSubRow(NamedTuple):
+    # Same field names as FinvoiceRow, so sub rows are parsed the same way
+    article_identifier: Optional[str] = None
+    buyer_article_identifier: Optional[str] = None
+    article_name: Optional[str] = None
+    article_description: Optional[str] = None
+    ean_code: Optional[str] = None
+    invoiced_quantity: Optional[str] = None
+    quantity_unit_code: Optional[str] = None
+    unit_price_amount: Optional[str] = None
+    row_vat_excluded_amount: Optional[str] = None
+    row_discount_percent: Optional[str] = None
+    row_vat_rate_percent: Optional[str] = None
+    row_vat_amount: Optional[str] = None
+    row_amount: Optional[str] = None
+    row_free_text: str = ""
+
+    @property
+    def default_code(self):
+        return self.buyer_article_identifier or self.article_identifier
+
+    @property
+    def priced(self):
+        """Whether the sub row has an amount of its own"""
+        return bool(
+            self.unit_price_amount or self.row_vat_excluded_amount or self.row_amount
+        )
+
+
+_SPD = "./SellerPartyDetails"
+_SPAD = f"{_SPD}/SellerPostalAddressDetails"
+_IND = "./InvoiceDetails"
+_PTD = f"{_IND}/PaymentTermsDetails"
+_EDE = "./EpiDetails"
+_EPD = f"{_EDE}/EpiPartyDetails"
+
+_HEADER_PATHS = {
+    "invoice_type_code": f"{_IND}/InvoiceTypeCode",
+    "seller_party_identifier": f"{_SPD}/SellerPartyIdentifier",
+    "seller_organisation_tax_code": f"{_SPD}/SellerOrganisationTaxCode",
+    "seller_organisation_name": f"{_SPD}/SellerOrganisationName",
+    "seller_phone_number": f"{_SPD}/SellerPhoneNumberIdentifier",
+    "seller_email": f"{_SPD}/SellerEmailaddressIdentifier",
+    "seller_street_name": f"{_SPAD}/SellerStreetName",
+    "seller_town_name": f"{_SPAD}/SellerTownName",
+    "seller_post_code": f"{_SPAD}/SellerPostCodeIdentifier",
+    "seller_reference_identifier": f"{_IND}/SellerReferenceIdentifier",
+    "invoice_number": f"{_IND}/InvoiceNumber",
+    "invoice_date": f"{_IND}/InvoiceDate",
+    "invoice_due_date": f"{_PTD}/InvoiceDueDate",
+    "agreement_identifier": f"{_IND}/AgreementIdentifier",
+}
+_HEADER_JOINED_PATHS = {
+    "invoice_free_text": f"{_IND}/InvoiceFreeText",
+    "payment_terms_free_text": f"{_PTD}/PaymentTermsFreeText",
+}
+_EPI_PATHS = {
+    "epi_reference": f"{_EDE}/EpiIdentificationDetails/EpiReference",
+    "sellers_buyer_identifier": f"{_IND}/SellersBuyerIdentifier",
+    "epi_account_id": f"{_EPD}/EpiBeneficiaryPartyDetails/EpiAccountID",
+    "epi_bfi_identifier": f"{_EPD}/EpiBfiPartyDetails/EpiBfiIdentifier",
+}
+
+# InvoiceRow child elements read into FinvoiceRow fields
+_ROW_FIELDS = {
+    "ArticleIdentifier": "article_identifier",
+    "BuyerArticleIdentifier": "buyer_article_identifier",
+    "ArticleName": "article_name",
+    "ArticleDescription": "article_description",
+    "EanCode": "ean_code",
+    "InvoicedQuantity": "invoiced_quantity",
+    "UnitPriceAmount": "unit_price_amount",
+    "RowVatExcludedAmount": "row_vat_excluded_amount",
+    "RowDiscountPercent": "row_discount_percent",
+    "RowVatRatePercent": "row_vat_rate_percent",
+}
+
+# SubInvoiceRow child elements read into FinvoiceSubRow fields
+_SUB_ROW_FIELDS = {
+    "SubArticleIdentifier": "article_identifier",
+    "SubBuyerArticleIdentifier": "buyer_article_identifier",
+    "SubArticleName": "article_name",
+    "SubArticleDescription": "article_description",
+    "SubEanCode": "ean_code",
+    "SubInvoicedQuantity": "invoiced_quantity",
+    "SubUnitPriceAmount": "unit_price_amount",
+    "SubRowVatExcludedAmount": "row_vat_excluded_amount",
+    "SubRowDiscountPercent": "row_discount_percent",
+    "SubRowVatRatePercent": "row_vat_rate_percent",
+    "SubRowVatAmount": "row_vat_amount",
+    "SubRowAmount": "row_amount",
+}
+
+
+def extract_header(tree):
+    """Read the seller and invoice details of a Finvoice document"""
+    values = {name: find_text(path, tree) for name, path in _HEADER_PATHS.items()}
+    for name, path in _HEADER_JOINED_PATHS.items():
+        values[name] = find_texts_joined(path, tree)
+    return FinvoiceHeader(**values)
+
+
+def extract_epi_details(tree):
+    """Read the payment details of a Finvoice document"""
+    return FinvoiceEpiDetails(
+        **{name: find_text(path, tree) for name, path in _EPI_PATHS.items()}
+    )
+
+
+def extract_rows(row):
+    """
+    Read an InvoiceRow element in a single pass over its children.
+    Returns a FinvoiceRow, followed by a FinvoiceSubRow for each of its
+    SubInvoiceRows. An InvoiceRow holding only SubInvoiceRows has no
+    FinvoiceRow of its own
+    """
+    values = {}
+    free_texts = []
+    sub_rows = []
+    for child in row:
+        tag = child.tag
+        if tag == "SubInvoiceRow":
+            sub_rows.append(extract_sub_row(child))
+            continue
+        if tag == "RowFreeText":
+            free_texts.append(child.text or "")
+            continue
+
+        name = _ROW_FIELDS.get(tag)
+        if name and name not in values:
+            values[name] = child.text
+            if tag == "InvoicedQuantity":
+                values["quantity_unit_code"] = child.get("QuantityUnitCode")
+
+    if sub_rows and not values and not free_texts:
+        return sub_rows
+    return [FinvoiceRow(row_free_text="\n".join(free_texts), **values), *sub_rows]
+
+
+def extract_sub_row(sub_row):
+    """Read a SubInvoiceRow element"""
+    values = {}
+    free_texts = []
+    for child in sub_row:
+        tag = child.tag
+        if tag == "SubRowFreeText":
+            free_texts.append(child.text or "")
+            continue
+
+        name = _SUB_ROW_FIELDS.get(tag)
+        if name and name not in values:
+            values[name] = child.text
+            if tag == "SubInvoicedQuantity":
+                values["quantity_unit_code"] = child.get("QuantityUnitCode")
+    return FinvoiceSubRow(row_free_text="\n".join(free_texts), **values)
@@ -0,0 +1,140 @@
+"""
+Compact representation of the rows of a Finvoice document for importing.
+
+Invoice rows are imported in two stages: parse_rows reads the InvoiceRow
+elements into FinvoiceImportRow records, and the import maps the records
+to invoice line values. Parsing doesn't use the ORM or the database, so it
+can be tested and benchmarked on its own, or run in a worker process.
+"""
+from .amount import parse_amounts, parse_row_amounts
+from .extract import FinvoiceSubRow, extract_rows
+
+
+class FinvoiceImportRow:
+    """
+    A row of a Finvoice document, with only the fields the import uses.
+    Amounts are Decimals, or None if the row doesn't have them.
+    Note rows (from SubInvoiceRows not imported as lines) only have a text
+    """
+
+    __slots__ = (
+        "note",
+        "default_code",
+        "article_name",
+        "article_description",
+        "ean_code",
+        "quantity",
+        "unit_code",
+        "unit_price",
+        "vat_excluded_amount",
+        "discount",
+        "vat_rate",
+        "text",
+    )
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def __repr__(self):
+        values = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        )
+        return f"FinvoiceImportRow({values})"
+
+
+def _is_line(row, rows):
+    # An InvoiceRow holds either content of its own or SubInvoiceRows.
+    # Priced SubInvoiceRows of a row without content are the invoice lines
+    if not isinstance(row, FinvoiceSubRow):
+        return True
+    return row.priced and isinstance(rows[0], FinvoiceSubRow)
+
+
+def _sub_row_vat_excluded_amount(sub_row, vat_rate, parsed):
+    # SubRowAmount includes VAT, for sub rows with neither a unit price
+    # nor a VAT excluded amount
+    amount, vat_amount = parse_amounts(
+        (sub_row.row_amount, sub_row.row_vat_amount), default=None, parsed=parsed
+    )
+    if amount is None:
+        return None
+    if vat_amount is not None:
+        return amount - vat_amount
+    if vat_rate:
+        return amount * 100 / (100 + vat_rate)
+    return amount
+
+
+def _sub_row_text(sub_row):
+    # Sub rows itemizing a row with content of its own would count the
+    # amounts twice as lines, so they are described in text, amounts included
+    text = sub_row.article_name or sub_row.article_identifier or ""
+    description = sub_row.article_description
+    if description:
+        text = description if description.startswith(text) else f"{text}\n{description}"
+
+    details = []
+    if sub_row.invoiced_quantity:
+        quantity = f"{sub_row.invoiced_quantity} {sub_row.quantity_unit_code or ''}"
+        details.append(quantity.strip())
+    if sub_row.unit_price_amount:
+        details.append(f"à {sub_row.unit_price_amount}")
+    amount = sub_row.row_vat_excluded_amount or sub_row.row_amount
+    if amount:
+        details.append(f"= {amount}")
+    if details:
+        text = f"{text} ({', '.join(details)})".strip()
+    if sub_row.row_free_text:
+        text = f"{text}\n{sub_row.row_free_text}".strip()
+    return text
+
+
+def parse_rows(lines):
+    """
+    Parse InvoiceRow elements into FinvoiceImportRows.
+    SubInvoiceRows with amounts, of an InvoiceRow without content of its
+    own, are invoice lines. Other SubInvoiceRows are flattened into note
+    rows right after their InvoiceRow
+
+    The rows are yielded one InvoiceRow at a time, so lines can be a
+    streaming iterator. Amounts repeating across the rows are parsed once
+    """
+    parsed = {}
+    for line in lines:
+        rows = extract_rows(line)
+        amounts = iter(
+            parse_row_amounts(
+                [row for row in rows if _is_line(row, rows)],
+                parsed=parsed,
+            )
+        )
+
+        for row in rows:
+            if not _is_line(row, rows):
+                yield FinvoiceImportRow(note=True, text=_sub_row_text(row))
+                continue
+
+            row_amounts = next(amounts)
+            vat_excluded_amount = row_amounts.vat_excluded_amount
+            if vat_excluded_amount is None and isinstance(row, FinvoiceSubRow):
+                vat_excluded_amount = _sub_row_vat_excluded_amount(
+                    row, row_amounts.vat_rate_percent, parsed
+                )
+
+            yield FinvoiceImportRow(
+                note=False,
+                default_code=row.default_code,
+                article_name=row.article_name,
+                article_description=row.article_description,
+                ean_code=row.ean_code,
+                quantity=row_amounts.quantity,
+                unit_code=row.quantity_unit_code,
+                unit_price=row_amounts.unit_price,
+                vat_excluded_amount=vat_excluded_amount,
+                discount=row_amounts.discount_percent,
+                vat_rate=row_amounts.vat_rate_percent,
+                text=row.row_free_text,
+            )
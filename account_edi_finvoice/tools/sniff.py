@@ -0,0 +1,147 @@
+"""
+Cheap detection of Finvoice documents, without parsing the whole file.
+
+Only the start of the content is parsed, up to the root start tag. Finvoice
+transmission files, where each Finvoice is preceded by its SOAP envelope,
+are detected too.
+"""
+import io
+import re
+from typing import NamedTuple
+
+from lxml import etree
+
+# Enough for the XML declaration, comments and the root start tag
+SNIFF_SIZE = 4096
+
+# SOAP envelopes of transmission files are a few kilobytes
+SOAP_ENVELOPE_MAX_SIZE = 65536
+
+_SOAP_ENVELOPE_END = re.compile(rb"</(?:[\w.-]+:)?Envelope\s*>")
+_FINVOICE_END = b"</Finvoice>"
+
+
+class FinvoiceSniff(NamedTuple):
+    # Version attribute of the Finvoice root
+    version: str
+    # The Finvoice document is content[start:end]
+    start: int
+    end: int
+    soap: bool
+
+
+def _sniff_root(data):
+    """Return the root element of an XML document, parsing only its start tag"""
+    # Errors after the root start tag (e.g. the data is cut in the middle
+    # of the document) don't matter here
+    parser = etree.XMLPullParser(events=("start",), recover=True)
+    parser.feed(data)
+    for _event, element in parser.read_events():
+        return element
+    return None
+
+
+def sniff_finvoice(content, offset=0):
+    """
+    Detect a Finvoice document from its first bytes
+
+    :param content: file content as bytes, or a memory map of the file
+    :param offset: position to detect the document at, e.g. the end of
+        the previous Finvoice of a transmission file
+    :return: FinvoiceSniff, or None if the content isn't a Finvoice.
+        For a transmission file, only its Finvoice at offset is returned
+    """
+    while content[offset : offset + 1].isspace():
+        offset += 1
+
+    head = content[offset : offset + SNIFF_SIZE]
+    if not head:
+        return None
+    if b"Finvoice" not in head and b"Envelope" not in head:
+        # Neither a Finvoice nor a SOAP envelope: not worth parsing
+        return None
+
+    root = _sniff_root(head)
+    if root is None:
+        return None
+
+    if root.tag == "Finvoice":
+        if not offset:
+            return FinvoiceSniff(root.get("Version", ""), 0, len(content), False)
+        end = content.find(_FINVOICE_END, offset)
+        if end < 0:
+            return None
+        return FinvoiceSniff(
+            root.get("Version", ""), offset, end + len(_FINVOICE_END), False
+        )
+
+    if etree.QName(root).localname != "Envelope":
+        return None
+
+    envelope_end = _SOAP_ENVELOPE_END.search(
+        content, offset, offset + SOAP_ENVELOPE_MAX_SIZE
+    )
+    if not envelope_end:
+        return None
+
+    start = envelope_end.end()
+    while content[start : start + 1].isspace():
+        start += 1
+
+    root = _sniff_root(content[start : start + SNIFF_SIZE])
+    if root is None or root.tag != "Finvoice":
+        return None
+
+    end = content.find(_FINVOICE_END, start)
+    if end < 0:
+        return None
+    return FinvoiceSniff(root.get("Version", ""), start, end + len(_FINVOICE_END), True)
+
+
+def iter_finvoices(content):
+    """
+    Detect all the Finvoice documents of a file: the only one of a plain
+    Finvoice file, or each one of a transmission file
+
+    :param content: file content as bytes, or a memory map of the file
+    :return: iterator of FinvoiceSniffs
+    """
+    offset = 0
+    while True:
+        sniff = sniff_finvoice(content, offset)
+        if not sniff:
+            return
+        yield sniff
+        if sniff.end >= len(content):
+            return
+        offset = sniff.end
+
+
+class _FinvoiceReader(io.RawIOBase):
+    """Read-only file over a Finvoice of the content, without copying it"""
+
+    def __init__(self, content, start, end):
+        super().__init__()
+        self._content = content
+        self._position = start
+        self._end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._end - self._position)
+        buffer[:size] = self._content[self._position : self._position + size]
+        self._position += size
+        return size
+
+
+def open_finvoice(content, sniff):
+    """
+    Open a Finvoice of the content as a binary file, e.g. for streaming
+    one Finvoice of a transmission file mapped to memory
+
+    :param content: file content as bytes, or a memory map of the file
+    :param sniff: FinvoiceSniff of the Finvoice to open
+    """
+    return io.BufferedReader(_FinvoiceReader(content, sniff.start, sniff.end))
@@ -0,0 +1,106 @@
+"""
+Per-phase timing and SQL query counting for the Finvoice pipeline.
+
+An operation (e.g. an export or an import of one document) is measured
+with finvoice_timer(), and the parts of it with finvoice_phase(). Phases
+can nest, in which case the time of the inner phase is also included in
+the outer one. The results are logged as JSON at debug level, enable with
+--log-handler=odoo.addons.account_edi_finvoice.tools.timing:DEBUG
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class FinvoiceTimer:
+    def __init__(self, cr, operation, **info):
+        self.cr = cr
+        self.operation = operation
+        self.info = info
+        self.phases = {}
+        self.time = 0.0
+        self.queries = 0
+        self._start_time = time.perf_counter()
+        self._start_queries = cr.sql_log_count
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        start_queries = self.cr.sql_log_count
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(
+                name, {"calls": 0, "time": 0.0, "queries": 0}
+            )
+            phase["calls"] += 1
+            phase["time"] += time.perf_counter() - start_time
+            phase["queries"] += self.cr.sql_log_count - start_queries
+
+    def stop(self):
+        self.time = time.perf_counter() - self._start_time
+        self.queries = self.cr.sql_log_count - self._start_queries
+
+    def as_dict(self):
+        return {
+            "operation": self.operation,
+            **self.info,
+            "time": round(self.time, 6),
+            "queries": self.queries,
+            "phases": {
+                name: dict(phase, time=round(phase["time"], 6))
+                for name, phase in self.phases.items()
+            },
+        }
+
+
+def _get_stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def finvoice_timer(cr, operation, **info):
+    """
+    Measure an operation. A nested timer for the same operation joins
+    the enclosing timer
+    """
+    stack = _get_stack()
+    if stack and stack[-1].operation == operation:
+        yield stack[-1]
+        return
+
+    timer = FinvoiceTimer(cr, operation, **info)
+    stack.append(timer)
+    try:
+        yield timer
+    finally:
+        stack.pop()
+        timer.stop()
+        if _logger.isEnabledFor(logging.DEBUG):
+            timings = timer.as_dict()
+            _logger.debug(
+                "Finvoice %s: %s",
+                operation,
+                json.dumps(timings),
+                extra={"finvoice_timings": timings},
+            )
+
+
+def finvoice_phase(name):
+    """
+    Measure a phase of the current operation. Does nothing outside of
+    finvoice_timer()
+    """
+    stack = _get_stack()
+    if not stack:
+        return nullcontext()
+    return stack[-1].phase(name)
@@ -0,0 +1,128 @@
+"""
+Transports for sending Finvoice documents to an e-invoice operator.
+
+Transports run in the threads of a pool, so they get the document content
+as bytes and must not use the ORM or the database.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_logger = logging.getLogger(__name__)
+
+
+class FinvoiceTransport:
+    """
+    Base class for Finvoice transports.
+
+    Subclasses implement _send_one, send() calls it for each document in
+    a pool of max_workers threads.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max(max_workers, 1)
+
+    def send(self, documents):
+        """
+        Send documents concurrently
+
+        :param documents: list of (key, content) tuples
+        :return: dict of (success, message) tuples by key
+        """
+        if not documents:
+            return {}
+        workers = min(self.max_workers, len(documents))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(self._send_one, documents)
+            return dict(zip((key for key, _content in documents), results))
+
+    def _send_one(self, document):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class FinvoiceHttpTransport(FinvoiceTransport):
+    """
+    POST Finvoice documents to an operator endpoint.
+
+    All threads share one keep-alive session, with a connection pool of
+    max_workers connections. Failing to connect is retried with
+    exponential backoff. Once a document may have reached the operator
+    (read errors, error statuses), it isn't resent here: the document
+    fails, and the transmission queue decides whether to send it again.
+    """
+
+    def __init__(
+        self,
+        url,
+        max_workers=4,
+        timeout=30,
+        retries=3,
+        backoff_factor=0.5,
+        headers=None,
+    ):
+        super().__init__(max_workers=max_workers)
+        self.url = url
+        self.timeout = timeout
+
+        # Only connection errors are retried: the request hasn't been sent,
+        # so a POST can't be duplicated
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=False,
+            status=False,
+            other=False,
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_workers,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "text/xml"})
+        if headers:
+            self.session.headers.update(headers)
+
+    def _send_one(self, document):
+        key, content = document
+        try:
+            response = self.session.post(self.url, data=content, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            _logger.info("Sending Finvoice %s failed: %s", key, e)
+            return False, str(e)
+        return True, response.text[:1000]
+
+    def close(self):
+        self.session.close()
+
+
+# Transports by settings, to keep the connection pools alive between batches
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_http_transport(url, max_workers=4, timeout=30, retries=3):
+    """
+    Return a shared FinvoiceHttpTransport for the given settings
+    """
+    key = (url, max_workers, timeout, retries)
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = _transports[key] = FinvoiceHttpTransport(
+                url, max_workers=max_workers, timeout=timeout, retries=retries
+            )
+        return transport
@@ -0,0 +1,310 @@
+"""
+Benchmark Finvoice export, schema validation and import.
+
+Generates synthetic customer invoices with 1, 100, 1 000 and 10 000 rows,
+exports them as Finvoice (rendered, and reusing the export of an unchanged
+invoice), validates the documents against the XSD, parses
+the invoice rows and imports them back as vendor bills. For each operation
+the wall time, the number of SQL queries and the peak memory are recorded,
+and the results are written as JSON so they can be compared between versions.
+
+Run against a database with account_edi_finvoice installed:
+
+    python benchmarks/finvoice_benchmark.py -c odoo.conf -d benchmark_db \\
+        --output results.json
+
+Everything is done in a single transaction that is rolled back at the end,
+so the database is left untouched.
+"""
+import argparse
+import json
+import logging
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+from lxml import etree
+
+import odoo
+from odoo.tools import config
+
+_logger = logging.getLogger("finvoice_benchmark")
+
+DEFAULT_SIZES = [1, 100, 1000, 10000]
+
+# Number of distinct products used for the rows
+PRODUCT_COUNT = 50
+
+
+def measure(env, results, operation, rows, func, setup=None):
+    """
+    Record wall time, SQL query count and peak memory of func
+
+    Tracing the allocations slows Python code down, so func is run twice:
+    once for the time and the queries, once for the peak memory. setup, if
+    given, is run before each pass, and its result is passed to func.
+    Returns the result of the timed pass
+    """
+    args = setup() if setup else ()
+    env.flush_all()
+    cr = env.cr
+    queries_before = cr.sql_log_count
+    start = time.perf_counter()
+    value = func(*args)
+    env.flush_all()
+    wall_time = time.perf_counter() - start
+    queries = cr.sql_log_count - queries_before
+
+    args = setup() if setup else ()
+    env.flush_all()
+    tracemalloc.start()
+    try:
+        func(*args)
+        env.flush_all()
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "operation": operation,
+        "rows": rows,
+        "wall_time": round(wall_time, 6),
+        "queries": queries,
+        # Python allocations only, memory allocated by libxml2 isn't traced
+        "peak_memory_kb": peak // 1024,
+        # Peak resident size of the whole process so far
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    results.append(result)
+    _logger.info(
+        "%-20s %6s rows: %9.3f s, %7s queries, %9s KiB",
+        operation,
+        rows,
+        result["wall_time"],
+        result["queries"],
+        result["peak_memory_kb"],
+    )
+    return value
+
+
+def get_tax(env, company, type_tax_use, amount=25.5):
+    tax_model = env["account.tax"]
+    tax = tax_model.search(
+        [
+            ("company_id", "=", company.id),
+            ("type_tax_use", "=", type_tax_use),
+            ("amount_type", "=", "percent"),
+            ("amount", "=", amount),
+            ("price_include", "=", False),
+        ],
+        limit=1,
+    )
+    if not tax:
+        tax = tax_model.create(
+            {
+                "name": f"Benchmark {type_tax_use} {amount}%",
+                "company_id": company.id,
+                "type_tax_use": type_tax_use,
+                "amount_type": "percent",
+                "amount": amount,
+            }
+        )
+    return tax
+
+
+def create_invoice(env, partner, products, tax, rows):
+    lines = [
+        (
+            0,
+            0,
+            {
+                "product_id": products[index % len(products)].id,
+                "quantity": index % 7 + 1,
+                "price_unit": 10 + index % 100,
+                "tax_ids": [(6, 0, tax.ids)],
+            },
+        )
+        for index in range(rows)
+    ]
+    invoice = env["account.move"].create(
+        {
+            "move_type": "out_invoice",
+            "partner_id": partner.id,
+            "invoice_date": datetime.now().date(),
+            "invoice_line_ids": lines,
+        }
+    )
+    invoice.action_post()
+    return invoice
+
+
+def clear_export_fingerprint(invoice):
+    """
+    Forget the fingerprint of the invoice's last export. action_post()
+    already exported the invoice, and an export with an unchanged
+    fingerprint only reuses that attachment
+    """
+    invoice.edi_document_ids.write({"finvoice_fingerprint": False})
+    return ()
+
+
+def store_export_fingerprint(edi_format, invoice):
+    """Store the fingerprint of the invoice, as an export does"""
+    fingerprint = edi_format._finvoice_get_export_fingerprint(invoice)
+    edi_format._finvoice_store_fingerprints({invoice: fingerprint})
+    return ()
+
+
+def run(env, sizes, repeat, output_dir=None):
+    # Odoo addons can only be imported once the configuration is loaded
+    from odoo.addons.account_edi_finvoice.tools.rows import parse_rows
+
+    company = env.company
+    edi_format = env.ref("account_edi_finvoice.edi_finvoice_3_0")
+    move_model = env["account.move"]
+
+    partner = env["res.partner"].create(
+        {
+            "name": "Finvoice Benchmark Customer",
+            "is_company": True,
+            "company_registry": "1234567-1",
+            "vat": "FI12345671",
+            "street": "Benchmark Street 1",
+            "city": "Tampere",
+            "zip": "33100",
+            "country_id": env.ref("base.fi").id,
+        }
+    )
+    products = env["product.product"].create(
+        [
+            {
+                "name": f"Benchmark product {index}",
+                "default_code": f"BENCH-{index}",
+                "barcode": f"64{index:011d}",
+            }
+            for index in range(PRODUCT_COUNT)
+        ]
+    )
+    sale_tax = get_tax(env, company, "sale")
+    # Imported rows need a purchase tax with the same rate
+    get_tax(env, company, "purchase", sale_tax.amount)
+
+    results = []
+    for rows in sizes:
+        _logger.info("Creating an invoice with %s rows", rows)
+        invoice = create_invoice(env, partner, products, sale_tax, rows)
+
+        for _round in range(repeat):
+            # Rendered from scratch each time
+            attachment = measure(
+                env,
+                results,
+                "export",
+                rows,
+                lambda: edi_format._export_finvoice(invoice),
+                setup=lambda: clear_export_fingerprint(invoice),
+            )
+
+            # The invoice hasn't changed since posting: the export of
+            # action_post() is reused
+            measure(
+                env,
+                results,
+                "export_unchanged",
+                rows,
+                lambda: edi_format._export_finvoice(invoice),
+                setup=lambda: store_export_fingerprint(edi_format, invoice),
+            )
+
+            xml_content = attachment.raw
+            if output_dir:
+                with open(f"{output_dir}/finvoice_{rows}.xml", "wb") as xml_file:
+                    xml_file.write(xml_content)
+
+            measure(
+                env,
+                results,
+                "check_xml_schema",
+                rows,
+                lambda: edi_format._finvoice_check_xml_schema(xml_content),
+            )
+
+            tree = etree.fromstring(xml_content)
+            # The ORM free first stage of the import. The rows are parsed
+            # lazily, consume them without keeping them
+            measure(
+                env,
+                results,
+                "parse_rows",
+                rows,
+                lambda: deque(parse_rows(tree.iterfind("InvoiceRow")), maxlen=0),
+            )
+
+            # Empty duplicate keys: the same document is imported repeatedly
+            measure(
+                env,
+                results,
+                "import",
+                rows,
+                lambda bill: move_model._import_finvoice(tree, bill, duplicate_keys={}),
+                setup=lambda: (move_model.create({"move_type": "in_invoice"}),),
+            )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-c", "--config", help="Odoo configuration file")
+    parser.add_argument("-d", "--database", required=True)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Invoice row counts to benchmark",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--output-dir", help="Keep the generated Finvoice files in this directory"
+    )
+    args = parser.parse_args()
+
+    odoo_args = ["-d", args.database]
+    if args.config:
+        odoo_args += ["-c", args.config]
+    config.parse_config(odoo_args)
+    logging.basicConfig(level=logging.INFO)
+
+    registry = odoo.modules.registry.Registry(args.database)
+    with registry.cursor() as cr:
+        env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+        module = env["ir.module.module"].search([("name", "=", "account_edi_finvoice")])
+        module_version = module.latest_version
+        try:
+            results = run(env, args.sizes, args.repeat, args.output_dir)
+        finally:
+            cr.rollback()
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "odoo_version": odoo.release.version,
+        "module_version": module_version,
+        "python_version": platform.python_version(),
+        "results": results,
+    }
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report_json)
+    else:
+        sys.stdout.write(report_json + "\n")
+
+
+if __name__ == "__main__":
+    main()
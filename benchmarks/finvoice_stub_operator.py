@@ -0,0 +1,133 @@
+"""
+Local stub of an e-invoice operator for testing Finvoice transmission.
+
+Accepts Finvoice documents POSTed over keep-alive HTTP/1.1 connections and
+answers with a small acknowledgement. Latency and failures can be simulated
+to test the retries and the throughput of the transmission queue.
+
+    python benchmarks/finvoice_stub_operator.py --port 8099 --delay 0.2 \\
+        --fail-rate 0.1
+
+Then set the operator URL of the Finvoice 3.0 EDI format to
+http://localhost:8099/ and the transport to HTTP. Received documents can be
+saved with --output-dir.
+"""
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lxml import etree
+
+_logger = logging.getLogger("finvoice_stub_operator")
+
+
+class FinvoiceStubHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        content = self.rfile.read(length)
+
+        if server.delay:
+            time.sleep(server.delay)
+
+        if random.random() < server.fail_rate:
+            server.count("failed")
+            self._respond(503, b"Service unavailable")
+            return
+
+        try:
+            root = etree.fromstring(content)
+        except etree.XMLSyntaxError as e:
+            server.count("rejected")
+            self._respond(400, str(e).encode())
+            return
+
+        number = root.findtext(".//InvoiceNumber") or ""
+        received = server.count("received")
+        if server.output_dir:
+            path = os.path.join(server.output_dir, "finvoice_%06d.xml" % received)
+            with open(path, "wb") as output:
+                output.write(content)
+
+        _logger.debug("Received Finvoice %s (%s bytes)", number, length)
+        self._respond(
+            200,
+            b'<?xml version="1.0" encoding="UTF-8"?>'
+            b"<Acknowledgement><Status>OK</Status><InvoiceNumber>"
+            + number.encode()
+            + b"</InvoiceNumber></Acknowledgement>",
+        )
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+class FinvoiceStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay=0.0, fail_rate=0.0, output_dir=None):
+        super().__init__(address, FinvoiceStubHandler)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.output_dir = output_dir
+        self.counts = {"received": 0, "failed": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+            return self.counts[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="seconds to wait per request"
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="share of requests answered with 503, between 0 and 1",
+    )
+    parser.add_argument("--output-dir", help="directory to save documents to")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    server = FinvoiceStubServer(
+        (args.host, args.port),
+        delay=args.delay,
+        fail_rate=args.fail_rate,
+        output_dir=args.output_dir,
+    )
+    _logger.info("Finvoice stub operator listening on %s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _logger.info("Documents: %s", server.counts)
+
+
+if __name__ == "__main__":
+    main()